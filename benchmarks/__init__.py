@@ -0,0 +1,10 @@
+"""
+Benchmarks for the portfolio assistant.
+
+Run from the project root, e.g.:
+    python -m benchmarks.prefill --help
+    python -m benchmarks.load --mock --server --workers 2
+
+benchmarks.mock_ollama is a stand-in for Ollama's HTTP API, so the server
+can be load-tested without a real model.
+"""
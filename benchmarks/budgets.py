@@ -0,0 +1,153 @@
+"""
+Generation Budgets Benchmark
+
+Runs the agent server under gunicorn twice against the same
+benchmarks.mock_ollama, with GENERATION_BUDGETS=0 and with budgets on (see
+vishal_agent/budgets.py), and drives both with benchmarks.load's run_sse
+scenario at every --concurrency level (unique prompts; FAQ fast path and
+response cache off).
+
+The mock answers --ramble-share of the prompts with --ramble-tokens tokens
+instead of --answer-tokens, like a small model that doesn't stop. Per level
+the report shows:
+
+- completion tokens the mock actually generated (streams closed at a
+  deadline count what was sent), and the tokens the budgets saved
+- latency and TTFT p50 / p95 / p99: rambling answers hold an admission slot
+  for long, so the queue behind them - and the tail - is where budgets show
+- truncated answers by reason (max_tokens, deadline) and how many turns got
+  a budget tightened by the queue
+
+Extra server settings (both runs) go in --env, e.g. --env BUDGET_MAX_TOKENS=160.
+
+Usage:
+    python -m benchmarks.budgets --concurrency 1,4,16 --requests 48
+    python -m benchmarks.budgets --ramble-share 0.5 --env BUDGET_DEADLINE=5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import ExitStack
+
+import httpx
+
+from benchmarks.load import run_level, start_process, wait_for
+
+MODES = ("off", "on")
+
+
+def run_mode(mode: str, args, mock_url: str) -> dict:
+    target = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        LITELLM_LOCAL_MODEL_COST_MAP="True",
+        OLLAMA_API_BASE=mock_url,
+        FAQ_FAST_PATH="0",
+        RESPONSE_CACHE="off",
+        GENERATION_BUDGETS="1" if mode == "on" else "0",
+        **args.extra_env,
+    )
+    levels = []
+    with ExitStack() as stack:
+        start_process(stack, [
+            sys.executable, "-m", "gunicorn", "vishal_agent.server:app",
+            "--workers", str(args.workers),
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--bind", f"127.0.0.1:{args.port}",
+            "--timeout", "300",
+        ], env=env)
+        wait_for(f"{target}/health", timeout=120)
+        for concurrency in args.levels:
+            before = httpx.get(f"{mock_url}/mock/stats").json()["eval_tokens"]
+            level = asyncio.run(run_level(target, "run_sse", concurrency, args.requests, False, args.timeout))
+            # Includes run_level's warm-up request, in both modes
+            level["completion_tokens"] = httpx.get(f"{mock_url}/mock/stats").json()["eval_tokens"] - before
+            levels.append(level)
+        # One worker's view; enough to see that budgets were applied
+        budgets = httpx.get(f"{target}/stats").json().get("budgets")
+    return {"mode": mode, "levels": levels, "budgets": budgets}
+
+
+def compare(results: dict[str, dict]) -> list[dict]:
+    """Per concurrency level: tokens and tail latency without and with budgets."""
+    rows = []
+    for i, off in enumerate(results["off"]["levels"]):
+        on = results["on"]["levels"][i]
+        row = {"concurrency": off["concurrency"]}
+        for mode, data in (("off", off), ("on", on)):
+            row[mode] = {
+                "completion_tokens": data["completion_tokens"],
+                "latency_ms": data["latency_ms"],
+                "ttft_ms": data["ttft_ms"],
+                "errors": data["errors"],
+            }
+        saved = off["completion_tokens"] - on["completion_tokens"]
+        row["tokens_saved"] = saved
+        row["tokens_saved_pct"] = round(100 * saved / off["completion_tokens"], 1) if off["completion_tokens"] else None
+        p99_off, p99_on = off["latency_ms"]["p99"], on["latency_ms"]["p99"]
+        row["latency_p99_change_pct"] = round(100 * (p99_on - p99_off) / p99_off, 1) if p99_off and p99_on else None
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=48, help="Requests per level")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=8793)
+    parser.add_argument("--mock-port", type=int, default=11522)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Mock time-to-first-token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80, help="Mock generation rate")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Mock tokens per normal answer")
+    parser.add_argument("--ramble-share", type=float, default=0.25, help="Share of prompts with long answers")
+    parser.add_argument("--ramble-tokens", type=int, default=600, help="Mock tokens per long answer")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra server setting")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    args.levels = [int(c) for c in args.concurrency.split(",")]
+    args.extra_env = dict(item.split("=", 1) for item in args.env)
+
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        start_process(stack, [
+            sys.executable, "-m", "benchmarks.mock_ollama",
+            "--port", str(args.mock_port),
+            "--ttft", str(args.ttft),
+            "--tokens-per-sec", str(args.tokens_per_sec),
+            "--answer-tokens", str(args.answer_tokens),
+            "--ramble-share", str(args.ramble_share),
+            "--ramble-tokens", str(args.ramble_tokens),
+        ])
+        wait_for(f"{mock_url}/api/version")
+        results = {mode: run_mode(mode, args, mock_url) for mode in MODES}
+
+    report = {
+        "workers": args.workers,
+        "settings": args.extra_env,
+        "mock": {
+            "ttft": args.ttft,
+            "tokens_per_sec": args.tokens_per_sec,
+            "answer_tokens": args.answer_tokens,
+            "ramble_share": args.ramble_share,
+            "ramble_tokens": args.ramble_tokens,
+        },
+        "wall_seconds": round(time.perf_counter() - started, 1),
+        "comparison": compare(results),
+        "results": list(results.values()),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+History Compaction Benchmark
+
+Plays one long conversation against Ollama's /api/chat twice with the
+agent's full instruction and pinned keep_alive/num_ctx:
+
+1. full      - every turn replays the whole history (what ADK does without
+               a before_model_callback)
+2. compacted - history passed through history.compact_contents, exactly as
+               the agent's compact_history callback does
+
+For every turn it records the prompt tokens Ollama prefilled
+(prompt_eval_count), the prefill time and time-to-first-token, so the growth
+of per-turn cost with and without compaction can be compared.
+
+Usage:
+    python -m benchmarks.compaction --base http://localhost:11434 --turns 12
+"""
+
+import argparse
+import json
+
+import httpx
+from google.genai import types
+
+from benchmarks.prefill import chat_once
+from vishal_agent.agent import FULL_INSTRUCTION, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX
+from vishal_agent.history import HISTORY_KEEP_TURNS, HISTORY_TOKEN_BUDGET, compact_contents, content_text
+
+QUESTIONS = [
+    "Who is Vishal?",
+    "What does he do at Lumiq?",
+    "Tell me about LimeChat",
+    "What's his tech stack?",
+    "Which of those does he use the most?",
+    "What projects has he built?",
+    "Tell me more about the retro games",
+    "What's his education?",
+    "Roast him",
+    "Okay, something nicer now",
+    "How can I contact him?",
+    "Summarize everything you told me",
+]
+
+
+def to_messages(system: str, contents: list[types.Content]) -> list[dict]:
+    messages = [{"role": "system", "content": system}]
+    for content in contents:
+        role = "assistant" if content.role == "model" else "user"
+        messages.append({"role": role, "content": content_text(content)})
+    return messages
+
+
+def play(client: httpx.Client, base: str, model: str, turns: int, compact: bool, keep_turns: int, budget: int) -> list[dict]:
+    history: list[types.Content] = []
+    results = []
+    for i in range(turns):
+        history.append(types.Content(role="user", parts=[types.Part(text=QUESTIONS[i % len(QUESTIONS)])]))
+        contents = compact_contents(history, keep_turns=keep_turns, token_budget=budget).contents if compact else history
+        result = chat_once(
+            client, base, model, to_messages(FULL_INSTRUCTION, contents),
+            {"num_ctx": OLLAMA_NUM_CTX}, OLLAMA_KEEP_ALIVE,
+        )
+        history.append(types.Content(role="model", parts=[types.Part(text=result.pop("text"))]))
+        results.append({"turn": i + 1, "messages": len(contents), **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default="http://localhost:11434", help="Ollama base URL")
+    parser.add_argument("--model", default="llama3.2:latest", help="Ollama model name")
+    parser.add_argument("--turns", type=int, default=12, help="Turns in the conversation")
+    parser.add_argument("--keep-turns", type=int, default=HISTORY_KEEP_TURNS, help="Turns kept verbatim")
+    parser.add_argument("--budget", type=int, default=HISTORY_TOKEN_BUDGET, help="History token budget")
+    args = parser.parse_args()
+
+    report = {"model": args.model, "turns": args.turns, "keep_turns": args.keep_turns, "budget": args.budget}
+    with httpx.Client(timeout=300) as client:
+        for name, compact in (("full", False), ("compacted", True)):
+            runs = play(client, args.base, args.model, args.turns, compact, args.keep_turns, args.budget)
+            report[name] = {
+                "last_turn": runs[-1],
+                "total_prompt_eval_ms": round(sum(r["prompt_eval_ms"] for r in runs), 1),
+                "runs": runs,
+            }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+llama.cpp vs Ollama Benchmark
+
+Runs the agent server under gunicorn once per backend on the same machine:
+
+- ollama   - LiteLLM's ollama_chat provider over HTTP to --ollama-url
+- llamacpp - llama-server over a Unix socket (LLM_BACKEND=llamacpp, see
+  vishal_agent/llamacpp.py), started by gunicorn.conf.py with --gguf,
+  --threads and --parallel
+
+Each one is driven with benchmarks.load's run_sse scenario at every
+--concurrency level (unique prompts; FAQ fast path and response cache off),
+and the report puts TTFT, latency, tokens/sec and requests/sec of the
+backends side by side.
+
+For a fair comparison, serve the same model and quantization from both
+(the GGUF file Ollama uses is under ~/.ollama/models/blobs) and give Ollama
+the same parallelism (OLLAMA_NUM_PARALLEL=--parallel). The backends run one
+after the other, but an idle Ollama still holds its model in memory.
+
+--mock replaces both with benchmarks.mock_ollama (over TCP for Ollama, over a
+Unix socket for llama-server). That checks the setup and shows the overhead
+of the two transports and protocols alone, not inference speed.
+
+Usage:
+    python -m benchmarks.llamacpp --gguf ~/models/llama-3.2-3b-q4_k_m.gguf --threads 8 --parallel 4
+    python -m benchmarks.llamacpp --mock --concurrency 1,4,16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+
+import httpx
+
+from benchmarks.load import run_level, start_process, wait_for
+
+BACKENDS = ("ollama", "llamacpp")
+
+
+def backend_env(backend: str, args, tmp: str, mock_url: str | None, mock_socket: str | None) -> dict:
+    env = dict(
+        os.environ,
+        LITELLM_LOCAL_MODEL_COST_MAP="True",
+        LLM_BACKEND=backend,
+        FAQ_FAST_PATH="0",
+        RESPONSE_CACHE="off",
+    )
+    if backend == "ollama":
+        env["OLLAMA_API_BASE"] = mock_url or args.ollama_url
+    elif mock_socket:
+        env["LLAMACPP_URL"] = f"unix:{mock_socket}"
+        env.pop("LLAMACPP_MODEL", None)
+    else:
+        env.update(
+            LLAMACPP_URL=f"unix:{os.path.join(tmp, 'llama.sock')}",
+            LLAMACPP_MODEL=args.gguf,
+            LLAMACPP_THREADS=str(args.threads),
+            LLAMACPP_PARALLEL=str(args.parallel),
+        )
+    return env
+
+
+def run_backend(backend: str, args, mock_url: str | None, mock_socket: str | None) -> dict:
+    target = f"http://127.0.0.1:{args.port}"
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as tmp:
+        env = backend_env(backend, args, tmp, mock_url, mock_socket)
+        start_process(stack, [
+            sys.executable, "-m", "gunicorn", "vishal_agent.server:app",
+            "--workers", str(args.workers),
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--bind", f"127.0.0.1:{args.port}",
+            "--timeout", "300",
+        ], env=env)
+        # llama-server loads the model before the workers start
+        wait_for(f"{target}/health", timeout=600)
+        started = time.perf_counter()
+        levels = [
+            asyncio.run(run_level(target, "run_sse", c, args.requests, False, args.timeout))
+            for c in args.levels
+        ]
+        stats = httpx.get(f"{target}/stats").json()
+    return {
+        "backend": backend,
+        "wall_seconds": round(time.perf_counter() - started, 1),
+        "levels": levels,
+        "llamacpp": stats.get("llamacpp"),
+    }
+
+
+def compare(results: list[dict]) -> list[dict]:
+    """Per concurrency level: TTFT p50 and throughput of each backend."""
+    rows = []
+    for i, level in enumerate(results[0]["levels"]):
+        row = {"concurrency": level["concurrency"]}
+        for result in results:
+            data = result["levels"][i]
+            row[result["backend"]] = {
+                "ttft_p50_ms": data["ttft_ms"]["p50"] if data.get("ttft_ms") else None,
+                "latency_p50_ms": data["latency_ms"]["p50"],
+                "tokens_per_sec": data["tokens_per_sec"]["throughput"],
+                "requests_per_sec": data["requests_per_sec"],
+                "errors": data["errors"],
+            }
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gguf", help="GGUF model for llama-server (the model Ollama serves)")
+    parser.add_argument("--ollama-url", default=os.environ.get("OLLAMA_API_BASE", "http://localhost:11434"))
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4, help="llama-server CPU threads")
+    parser.add_argument("--parallel", type=int, default=4, help="llama-server slots (continuous batching)")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to run")
+    parser.add_argument("--concurrency", default="1,2,4", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per level")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=8792)
+    parser.add_argument("--mock", action="store_true", help="Both backends served by benchmarks.mock_ollama")
+    parser.add_argument("--mock-port", type=int, default=11521)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Mock time-to-first-token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=40, help="Mock generation rate")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    if "llamacpp" in backends and not args.mock and not args.gguf:
+        parser.error("--gguf is required for the llamacpp backend (or use --mock)")
+    args.levels = [int(c) for c in args.concurrency.split(",")]
+
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as tmp:
+        mock_url = mock_socket = None
+        if args.mock:
+            mock_url = f"http://127.0.0.1:{args.mock_port}"
+            mock_socket = os.path.join(tmp, "mock_llama.sock")
+            mock = ["--ttft", str(args.ttft), "--tokens-per-sec", str(args.tokens_per_sec)]
+            start_process(stack, [sys.executable, "-m", "benchmarks.mock_ollama", "--port", str(args.mock_port), *mock])
+            start_process(stack, [sys.executable, "-m", "benchmarks.mock_ollama", "--uds", mock_socket, *mock])
+            wait_for(f"{mock_url}/api/version")
+            deadline = time.monotonic() + 30
+            while not os.path.exists(mock_socket) and time.monotonic() < deadline:
+                time.sleep(0.1)
+
+        results = [run_backend(backend, args, mock_url, mock_socket) for backend in backends]
+
+    report = {
+        "mock": args.mock,
+        "workers": args.workers,
+        "llamacpp": {"gguf": args.gguf, "threads": args.threads, "parallel": args.parallel},
+        "comparison": compare(results),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
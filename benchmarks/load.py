@@ -0,0 +1,357 @@
+"""
+Load Test and Latency Benchmark
+
+Drives a running agent server (or one it starts itself) at increasing
+concurrency and reports, per scenario and concurrency level:
+
+- latency p50 / p95 / p99 and mean
+- time-to-first-token p50 / p95 / p99 (streaming scenarios)
+- tokens/sec: overall throughput and the median per-request stream rate
+- requests/sec, error rate and status code counts
+
+Scenarios:
+    run       POST /run
+    run_sse   POST /run_sse (TTFT = first event carrying text)
+    sessions  POST /sessions
+    a2a       POST /a2a/ JSON-RPC message/stream (TTFT = first artifact)
+
+Each concurrency level is a closed loop: C clients send requests
+back-to-back until --requests requests have completed. Prompts are unique
+per request by default so caches and coalescing don't hide the model cost;
+--prompts repeated sends the same first-turn question every time.
+
+With --mock the benchmark starts benchmarks.mock_ollama; with --server it
+also starts the agent under gunicorn (--workers) pointed at the mock, with
+any extra settings from --env. That way worker counts, session backends
+and caching modes can be compared on a laptop:
+
+    python -m benchmarks.load --mock --server --workers 4 --env RESPONSE_CACHE=off
+    python -m benchmarks.load --mock --server --env SESSION_STORE=sqlite --scenarios run_sse
+    python -m benchmarks.load --target http://localhost:8000 --concurrency 1,4,16
+
+--mock-backends N starts N mocks on consecutive ports and points the
+server's LLM_BACKENDS at all of them (see vishal_agent/router.py); the
+report then includes how many chat calls each mock received.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import ExitStack
+from dataclasses import dataclass
+
+import httpx
+
+# Deliberately not FAQ intents, so they reach the model (or the response cache)
+QUESTIONS = [
+    "What did he work on at Lumiq?",
+    "Which databases has he used?",
+    "What kind of retro games does he build?",
+    "How did LimeChat start?",
+    "What is he learning these days?",
+]
+
+
+@dataclass
+class Sample:
+    ok: bool
+    status: int
+    latency: float
+    ttft: float | None = None
+    tokens: int = 0
+    streamed: bool = False
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples: list[Sample], wall: float) -> dict:
+    latencies = [s.latency for s in samples if s.ok]
+    ttfts = [s.ttft for s in samples if s.ok and s.ttft is not None]
+    rates = [
+        s.tokens / (s.latency - s.ttft)
+        for s in samples
+        if s.ok and s.streamed and s.ttft is not None and s.tokens > 1 and s.latency > s.ttft
+    ]
+    statuses: dict[str, int] = {}
+    for s in samples:
+        statuses[str(s.status)] = statuses.get(str(s.status), 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if not s.ok),
+        "error_rate": round(sum(1 for s in samples if not s.ok) / max(len(samples), 1), 4),
+        "status_codes": statuses,
+        "requests_per_sec": round(len(samples) / wall, 2),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "mean": ms(statistics.mean(latencies)) if latencies else None,
+        },
+        "ttft_ms": {
+            "p50": ms(percentile(ttfts, 50)),
+            "p95": ms(percentile(ttfts, 95)),
+            "p99": ms(percentile(ttfts, 99)),
+        },
+        "tokens_per_sec": {
+            "throughput": round(sum(s.tokens for s in samples if s.ok) / wall, 1),
+            "per_stream_p50": round(statistics.median(rates), 1) if rates else None,
+        },
+    }
+
+
+# ============================================
+# Scenarios
+# ============================================
+
+def run_body(i: int, repeated: bool) -> dict:
+    # A random tag keeps unique prompts below the response cache's similarity threshold
+    question = QUESTIONS[0] if repeated else f"{QUESTIONS[i % len(QUESTIONS)]} [{uuid.uuid4().hex[:16]}]"
+    return {
+        "user_id": f"load-{i % 50}",
+        "session_id": f"load-{uuid.uuid4().hex[:12]}",
+        "new_message": {"role": "user", "parts": [{"text": question}]},
+    }
+
+
+async def scenario_run(client: httpx.AsyncClient, i: int, repeated: bool) -> Sample:
+    start = time.perf_counter()
+    response = await client.post("/run", json=run_body(i, repeated))
+    latency = time.perf_counter() - start
+    if response.status_code != 200:
+        return Sample(False, response.status_code, latency)
+    text = response.json().get("response") or ""
+    # /run is not streamed; estimate tokens from the answer length
+    return Sample(True, 200, latency, tokens=len(text) // 4)
+
+
+async def scenario_run_sse(client: httpx.AsyncClient, i: int, repeated: bool) -> Sample:
+    start = time.perf_counter()
+    ttft = None
+    chars = 0
+    error = False
+    async with client.stream("POST", "/run_sse", json=run_body(i, repeated)) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return Sample(False, response.status_code, time.perf_counter() - start)
+        async for line in response.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            event = json.loads(line[6:])
+            if "error" in event:
+                error = True
+            if event.get("text") and not event.get("is_final"):
+                # Events may carry several batched tokens; estimate from the text
+                chars += len(event["text"])
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+    return Sample(not error, 200, time.perf_counter() - start, ttft, chars // 4, streamed=True)
+
+
+async def scenario_sessions(client: httpx.AsyncClient, i: int, repeated: bool) -> Sample:
+    start = time.perf_counter()
+    response = await client.post("/sessions", json={"user_id": f"load-{i % 50}"})
+    return Sample(response.status_code == 200, response.status_code, time.perf_counter() - start)
+
+
+async def scenario_a2a(client: httpx.AsyncClient, i: int, repeated: bool) -> Sample:
+    question = run_body(i, repeated)["new_message"]["parts"][0]["text"]
+    body = {
+        "jsonrpc": "2.0",
+        "id": str(i),
+        "method": "message/stream",
+        "params": {"message": {
+            "role": "user",
+            "messageId": uuid.uuid4().hex,
+            "parts": [{"kind": "text", "text": question}],
+        }},
+    }
+    start = time.perf_counter()
+    ttft = None
+    tokens = 0
+    error = False
+    async with client.stream("POST", "/a2a/", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return Sample(False, response.status_code, time.perf_counter() - start)
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            message = json.loads(line[6:])
+            if "error" in message:
+                error = True
+                continue
+            artifact = message.get("result", {}).get("artifact")
+            if artifact:
+                text = "".join(part.get("text", "") for part in artifact.get("parts", []))
+                tokens += len(text) // 4
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+    return Sample(not error, 200, time.perf_counter() - start, ttft, tokens)
+
+
+SCENARIOS = {
+    "run": scenario_run,
+    "run_sse": scenario_run_sse,
+    "sessions": scenario_sessions,
+    "a2a": scenario_a2a,
+}
+
+
+async def run_level(target: str, scenario: str, concurrency: int, requests: int, repeated: bool, timeout: float) -> dict:
+    """Closed loop: `concurrency` clients until `requests` requests completed."""
+    samples: list[Sample] = []
+    counter = iter(range(requests))
+    func = SCENARIOS[scenario]
+
+    async def client_loop(client: httpx.AsyncClient):
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                samples.append(await func(client, i, repeated))
+            except Exception:
+                samples.append(Sample(False, 0, time.perf_counter() - start))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits) as client:
+        # Warm-up request (imports, first model load) outside the measurement
+        await func(client, requests, repeated)
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    return {"concurrency": concurrency, **summarize(samples, wall)}
+
+
+# ============================================
+# Optional mock / server processes
+# ============================================
+
+def wait_for(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_process(stack: ExitStack, args: list[str], env: dict | None = None) -> None:
+    process = subprocess.Popen(args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    stack.callback(stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="Agent server base URL")
+    parser.add_argument("--scenarios", default="run,run_sse,sessions,a2a", help="Comma-separated scenarios")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per scenario and level")
+    parser.add_argument("--prompts", choices=("unique", "repeated"), default="unique")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--mock", action="store_true", help="Start benchmarks.mock_ollama")
+    parser.add_argument("--mock-port", type=int, default=11500)
+    parser.add_argument("--mock-backends", type=int, default=1, help="Mocks to start (LLM_BACKENDS when > 1)")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Mock time-to-first-token (s)")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=0, help="Mock prefill rate added to --ttft (0: off)")
+    parser.add_argument("--tokens-per-sec", type=float, default=40, help="Mock generation rate")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Mock tokens per answer")
+    parser.add_argument("--server", action="store_true", help="Start the agent server under gunicorn")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers for --server")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra server setting")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    with ExitStack() as stack:
+        mock_urls = [f"http://127.0.0.1:{args.mock_port + i}" for i in range(args.mock_backends)] if args.mock else []
+        for i, url in enumerate(mock_urls):
+            start_process(stack, [
+                sys.executable, "-m", "benchmarks.mock_ollama",
+                "--port", str(args.mock_port + i),
+                "--ttft", str(args.ttft),
+                "--prefill-tokens-per-sec", str(args.prefill_tokens_per_sec),
+                "--tokens-per-sec", str(args.tokens_per_sec),
+                "--answer-tokens", str(args.answer_tokens),
+            ])
+        for url in mock_urls:
+            wait_for(f"{url}/api/version")
+
+        if args.server:
+            port = httpx.URL(args.target).port or 8000
+            env = dict(os.environ, LITELLM_LOCAL_MODEL_COST_MAP="True", **extra_env)
+            if args.mock:
+                env["OLLAMA_API_BASE"] = mock_urls[0]
+                if len(mock_urls) > 1:
+                    env.setdefault("LLM_BACKENDS", ",".join(mock_urls))
+            start_process(stack, [
+                sys.executable, "-m", "gunicorn", "vishal_agent.server:app",
+                "--workers", str(args.workers),
+                "--worker-class", "uvicorn.workers.UvicornWorker",
+                "--bind", f"127.0.0.1:{port}",
+                "--timeout", "120",
+            ], env=env)
+            wait_for(f"{args.target}/health", timeout=120)
+
+        report = {
+            "target": args.target,
+            "workers": args.workers if args.server else None,
+            "settings": extra_env,
+            "mock": {
+                "ttft": args.ttft,
+                "prefill_tokens_per_sec": args.prefill_tokens_per_sec,
+                "tokens_per_sec": args.tokens_per_sec,
+                "answer_tokens": args.answer_tokens,
+            } if args.mock else None,
+            "prompts": args.prompts,
+            "scenarios": {},
+        }
+        for scenario in scenarios:
+            report["scenarios"][scenario] = [
+                asyncio.run(run_level(args.target, scenario, c, args.requests, args.prompts == "repeated", args.timeout))
+                for c in levels
+            ]
+        if len(mock_urls) > 1:
+            report["mock_backends"] = {url: httpx.get(f"{url}/mock/stats").json()["chat"] for url in mock_urls}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Mock Ollama Server
+
+A stand-in for Ollama's HTTP API so the agent server can be load-tested
+on a laptop without a GPU (or even without Ollama installed). LiteLLM's
+ollama_chat provider talks to it exactly as it would to the real thing.
+
+- POST /api/chat      streaming (NDJSON) and non-streaming answers with a
+                      configurable time-to-first-token and token rate
+                      (optionally growing with the prompt, like CPU
+                      prefill: --prefill-tokens-per-sec);
+                      honours options.num_predict (done_reason
+                      "length" when it cuts the answer) and reports
+                      prompt_eval_count / eval_count like Ollama
+- POST /api/generate  empty completion (keep-alive pings, model unloads)
+- POST /api/embed     deterministic pseudo-embeddings
+- GET  /api/tags, POST /api/show, GET /api/version
+- POST /v1/chat/completions  the same answers in OpenAI format (SSE
+                      when streaming), as llama.cpp's llama-server serves them
+- GET  /health        llama-server's readiness check
+- GET  /mock/stats    request counters, peak concurrency and generated
+                      tokens (streams closed early count what was sent)
+
+--ramble-share makes that share of the prompts (picked by a hash of the
+last message, so the same prompts every run) answer with --ramble-tokens
+tokens instead, like a small model that doesn't know when to stop.
+
+When a request carries tools and the last message is from the user, the
+mock first answers with a call to the first tool (like llama3.2 does for
+search_knowledge in PROMPT_MODE=retrieval).
+
+--uds serves on a Unix socket instead of a port, like llama-server with
+LLM_BACKEND=llamacpp (vishal_agent/llamacpp.py).
+
+Usage:
+    python -m benchmarks.mock_ollama --port 11500 --ttft 0.3 --tokens-per-sec 40
+    OLLAMA_API_BASE=http://127.0.0.1:11500 uvicorn vishal_agent.server:app
+    python -m benchmarks.mock_ollama --uds /tmp/mock_llama.sock
+    LLM_BACKEND=llamacpp LLAMACPP_URL=unix:/tmp/mock_llama.sock uvicorn vishal_agent.server:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER = (
+    "Vishal is a Technical Lead at Lumiq who builds data platforms by day and retro games by night. "
+    "Before that he co-founded LimeChat, and he still self-hosts this assistant on a MacBook in his closet. "
+)
+
+
+class MockSettings:
+    ttft = 0.3
+    # 0: time-to-first-token doesn't depend on the prompt
+    prefill_tokens_per_sec = 0.0
+    tokens_per_sec = 40.0
+    answer_tokens = 60
+    ramble_share = 0.0
+    ramble_tokens = 600
+    tool_calls = True
+
+
+settings = MockSettings()
+counters = {"requests": 0, "chat": 0, "tool_calls": 0, "in_flight": 0, "peak_in_flight": 0, "eval_tokens": 0, "truncated": 0}
+
+app = FastAPI(title="Mock Ollama")
+
+
+def rambles(body: dict) -> bool:
+    messages = body.get("messages") or []
+    last = str(messages[-1].get("content") or "") if messages else ""
+    return int(hashlib.sha256(last.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF < settings.ramble_share
+
+
+def answer_tokens(body: dict, limit: int | None) -> tuple[list[str], str]:
+    """The answer's tokens and its finish reason ("length" when limit cut it)."""
+    words = ANSWER.split()
+    full = settings.ramble_tokens if rambles(body) else settings.answer_tokens
+    count = full if not limit or limit < 0 else min(limit, full)
+    if count < full:
+        counters["truncated"] += 1
+    return [f"{words[i % len(words)]} " for i in range(count)], "length" if count < full else "stop"
+
+
+def prompt_tokens(body: dict) -> int:
+    """Rough prompt size, ~4 characters per token."""
+    text = "".join(str(m.get("content") or "") for m in body.get("messages", []))
+    return max(1, len(text) // 4)
+
+
+def prefill_seconds(body: dict) -> float:
+    if settings.prefill_tokens_per_sec <= 0:
+        return settings.ttft
+    return settings.ttft + prompt_tokens(body) / settings.prefill_tokens_per_sec
+
+
+def wants_tool_call(body: dict) -> bool:
+    messages = body.get("messages") or []
+    return settings.tool_calls and bool(body.get("tools")) and bool(messages) and messages[-1].get("role") == "user"
+
+
+def tool_call_message(body: dict) -> dict:
+    tool = body["tools"][0]["function"]
+    params = list(tool.get("parameters", {}).get("properties", {}))
+    arguments = {params[0]: body["messages"][-1].get("content", "")} if params else {}
+    return {"role": "assistant", "content": "", "tool_calls": [{"function": {"name": tool["name"], "arguments": arguments}}]}
+
+
+def openai_tool_call(body: dict) -> dict:
+    call = tool_call_message(body)["tool_calls"][0]["function"]
+    return {
+        "index": 0,
+        "id": "call_mock",
+        "type": "function",
+        "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])},
+    }
+
+
+def final_chunk(model: str, body: dict, eval_count: int, started: float, done_reason: str = "stop") -> dict:
+    return {
+        "model": model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "message": {"role": "assistant", "content": ""},
+        "done": True,
+        "done_reason": done_reason,
+        "total_duration": int((time.perf_counter() - started) * 1e9),
+        "prompt_eval_count": prompt_tokens(body),
+        "prompt_eval_duration": int(prefill_seconds(body) * 1e9),
+        "eval_count": eval_count,
+        "eval_duration": int(eval_count / settings.tokens_per_sec * 1e9),
+    }
+
+
+@app.middleware("http")
+async def track(request: Request, call_next):
+    counters["requests"] += 1
+    counters["in_flight"] += 1
+    counters["peak_in_flight"] = max(counters["peak_in_flight"], counters["in_flight"])
+    try:
+        return await call_next(request)
+    finally:
+        counters["in_flight"] -= 1
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    counters["chat"] += 1
+    model = body.get("model", "mock")
+    started = time.perf_counter()
+    tokens, finish_reason = answer_tokens(body, (body.get("options") or {}).get("num_predict"))
+    tool_call = wants_tool_call(body)
+    if tool_call:
+        counters["tool_calls"] += 1
+
+    if not body.get("stream", True):
+        await asyncio.sleep(prefill_seconds(body) + (0 if tool_call else len(tokens) / settings.tokens_per_sec))
+        counters["eval_tokens"] += 0 if tool_call else len(tokens)
+        result = final_chunk(model, body, 0 if tool_call else len(tokens), started, finish_reason)
+        result["message"] = tool_call_message(body) if tool_call else {"role": "assistant", "content": "".join(tokens)}
+        return JSONResponse(result)
+
+    async def stream():
+        await asyncio.sleep(prefill_seconds(body))
+        if tool_call:
+            yield json.dumps({"model": model, "message": tool_call_message(body), "done": False}) + "\n"
+            yield json.dumps(final_chunk(model, body, 1, started)) + "\n"
+            return
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / settings.tokens_per_sec)
+            counters["eval_tokens"] += 1
+            yield json.dumps({"model": model, "message": {"role": "assistant", "content": token}, "done": False}) + "\n"
+        yield json.dumps(final_chunk(model, body, len(tokens), started, finish_reason)) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body = await request.json()
+    counters["chat"] += 1
+    model = body.get("model", "mock")
+    tokens, finish_reason = answer_tokens(body, body.get("max_completion_tokens") or body.get("max_tokens"))
+    tool_call = wants_tool_call(body)
+    if tool_call:
+        counters["tool_calls"] += 1
+    usage = {
+        "prompt_tokens": prompt_tokens(body),
+        "completion_tokens": 0 if tool_call else len(tokens),
+        "total_tokens": prompt_tokens(body) + (0 if tool_call else len(tokens)),
+    }
+    base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": model}
+
+    if not body.get("stream"):
+        await asyncio.sleep(prefill_seconds(body) + (0 if tool_call else len(tokens) / settings.tokens_per_sec))
+        counters["eval_tokens"] += 0 if tool_call else len(tokens)
+        message = {"role": "assistant", "content": None if tool_call else "".join(tokens)}
+        if tool_call:
+            message["tool_calls"] = [openai_tool_call(body)]
+        return JSONResponse({
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else finish_reason}],
+            "usage": usage,
+        })
+
+    def event(delta: dict, finish_reason: str | None = None, **extra) -> str:
+        chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    async def stream():
+        await asyncio.sleep(prefill_seconds(body))
+        if tool_call:
+            yield event({"role": "assistant", "tool_calls": [openai_tool_call(body)]})
+            yield event({}, "tool_calls", usage=usage)
+        else:
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(1 / settings.tokens_per_sec)
+                counters["eval_tokens"] += 1
+                yield event({"role": "assistant", "content": token} if not i else {"content": token})
+            yield event({}, finish_reason, usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    return {"model": body.get("model", "mock"), "response": "", "done": True, "done_reason": "load"}
+
+
+@app.post("/api/embed")
+async def embed(request: Request):
+    body = await request.json()
+    inputs = body.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    embeddings = []
+    for text in inputs:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        embeddings.append([(b - 128) / 128 for b in digest])
+    return {"model": body.get("model", "mock"), "embeddings": embeddings}
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "llama3.2:latest", "model": "llama3.2:latest"}]}
+
+
+@app.post("/api/show")
+async def show(request: Request):
+    return {"modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}}
+
+
+@app.get("/api/version")
+async def version():
+    return {"version": "0.0.0-mock"}
+
+
+@app.get("/mock/stats")
+async def stats():
+    return counters
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--uds", help="Serve on this Unix socket instead of --host/--port")
+    parser.add_argument("--ttft", type=float, default=settings.ttft, help="Seconds before the first token")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=0, help="Prompt tokens per second added to --ttft (0: off)")
+    parser.add_argument("--tokens-per-sec", type=float, default=settings.tokens_per_sec, help="Generation rate")
+    parser.add_argument("--answer-tokens", type=int, default=settings.answer_tokens, help="Tokens per answer")
+    parser.add_argument("--ramble-share", type=float, default=0, help="Share of prompts with long answers (0-1)")
+    parser.add_argument("--ramble-tokens", type=int, default=settings.ramble_tokens, help="Tokens per long answer")
+    parser.add_argument("--no-tool-calls", action="store_true", help="Never answer with a tool call")
+    args = parser.parse_args()
+
+    settings.ttft = args.ttft
+    settings.prefill_tokens_per_sec = args.prefill_tokens_per_sec
+    settings.tokens_per_sec = args.tokens_per_sec
+    settings.answer_tokens = args.answer_tokens
+    settings.ramble_share = args.ramble_share
+    settings.ramble_tokens = args.ramble_tokens
+    settings.tool_calls = not args.no_tool_calls
+    if args.uds:
+        uvicorn.run(app, uds=args.uds, log_level="warning")
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Prefill / Time-to-First-Token Benchmark
+
+Talks to Ollama's /api/chat directly with the agent's real system prompt and
+compares three setups:
+
+1. baseline  - full instruction, Ollama defaults (no keep_alive, default num_ctx)
+2. pinned    - full instruction with keep_alive + num_ctx pinned, so the
+               static prefix is served from Ollama's KV cache after the
+               first request
+3. retrieval - PROMPT_MODE=retrieval instruction (knowledge fetched per turn
+               via search_knowledge instead of living in the prompt), also
+               pinned; the user message carries the snippets the tool would
+               return
+
+For every request it records time-to-first-token and the prefill counters
+Ollama reports (prompt_eval_count / prompt_eval_duration). The first request
+of each setup is the cold one; the rest show the warm-prefix behaviour.
+
+Usage:
+    python -m benchmarks.prefill --base http://localhost:11434 --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import httpx
+
+from vishal_agent.agent import (
+    FULL_INSTRUCTION,
+    KNOWLEDGE,
+    KNOWLEDGE_TOP_K,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_NUM_CTX,
+    PERSONA_INSTRUCTION,
+    RETRIEVAL_INSTRUCTION,
+)
+from vishal_agent.knowledge import KnowledgeIndex
+
+QUESTIONS = [
+    "Who is Vishal?",
+    "What are his skills?",
+    "Tell me about LimeChat",
+    "How can I contact him?",
+    "Roast him",
+]
+
+RETRIEVAL_PROMPT = "\n\n".join([PERSONA_INSTRUCTION, RETRIEVAL_INSTRUCTION])
+
+
+def with_snippets(question: str, index: KnowledgeIndex) -> str:
+    """Stand-in for the search_knowledge tool round trip."""
+    snippets = "\n\n".join(
+        f"{doc.title}\n{doc.text}" for doc in index.search(question, top_k=KNOWLEDGE_TOP_K)
+    )
+    return f"{question}\n\nKnowledge base results:\n{snippets}"
+
+
+def chat_once(client: httpx.Client, base: str, model: str, messages: list[dict], options: dict, keep_alive: str | None) -> dict:
+    """Send one streaming chat request and time it."""
+    body = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "options": options,
+    }
+    if keep_alive is not None:
+        body["keep_alive"] = keep_alive
+
+    start = time.perf_counter()
+    ttft = None
+    final = {}
+    text = []
+    with client.stream("POST", f"{base}/api/chat", json=body) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            content = chunk.get("message", {}).get("content")
+            if content:
+                text.append(content)
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+            if chunk.get("done"):
+                final = chunk
+
+    return {
+        "ttft_ms": round((ttft or 0.0) * 1000, 1),
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        "prompt_eval_count": final.get("prompt_eval_count"),
+        "prompt_eval_ms": round(final.get("prompt_eval_duration", 0) / 1e6, 1),
+        "eval_count": final.get("eval_count"),
+        "text": "".join(text),
+    }
+
+
+def run_setup(client: httpx.Client, base: str, model: str, system: str, runs: int, options: dict, keep_alive: str | None, index: KnowledgeIndex | None = None) -> dict:
+    results = []
+    for i in range(runs):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if index is not None:
+            question = with_snippets(question, index)
+        messages = [{"role": "system", "content": system}, {"role": "user", "content": question}]
+        result = chat_once(client, base, model, messages, options, keep_alive)
+        result.pop("text")
+        results.append(result)
+    warm = results[1:] or results
+    return {
+        "system_prompt_chars": len(system),
+        "cold": results[0],
+        "warm_median": {
+            "ttft_ms": statistics.median(r["ttft_ms"] for r in warm),
+            "prompt_eval_count": statistics.median(r["prompt_eval_count"] or 0 for r in warm),
+            "prompt_eval_ms": statistics.median(r["prompt_eval_ms"] for r in warm),
+        },
+        "runs": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default="http://localhost:11434", help="Ollama base URL")
+    parser.add_argument("--model", default="llama3.2:latest", help="Ollama model name")
+    parser.add_argument("--runs", type=int, default=5, help="Requests per setup")
+    args = parser.parse_args()
+
+    index = KnowledgeIndex(KNOWLEDGE)
+    pinned = {"num_ctx": OLLAMA_NUM_CTX}
+
+    report = {"model": args.model, "runs": args.runs}
+    with httpx.Client(timeout=300) as client:
+        # Unload the model first so the baseline starts cold
+        client.post(f"{args.base}/api/generate", json={"model": args.model, "keep_alive": 0})
+        report["baseline"] = run_setup(client, args.base, args.model, FULL_INSTRUCTION, args.runs, {}, None)
+        report["pinned"] = run_setup(client, args.base, args.model, FULL_INSTRUCTION, args.runs, pinned, OLLAMA_KEEP_ALIVE)
+        report["retrieval"] = run_setup(client, args.base, args.model, RETRIEVAL_PROMPT, args.runs, pinned, OLLAMA_KEEP_ALIVE, index)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Session Database Round-Trip Benchmark
+
+Counts the database round trips (statements + commits) each /run call costs,
+with the plain DatabaseSessionService (SESSION_CACHE=0) and with the cached,
+write-batching session layer (SESSION_CACHE=1).
+
+The server app is driven in-process. The model is replaced by a canned
+response so the numbers only reflect session handling and no Ollama is
+needed; the FAQ fast path and response cache are switched off so every call
+runs a full turn. Each mode runs in its own subprocess because the server
+reads its configuration at import time.
+
+Usage:
+    python -m benchmarks.session_roundtrips --sessions 5 --turns 4
+    python -m benchmarks.session_roundtrips --database-url postgresql+asyncpg://...
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+async def measure(sessions: int, turns: int, prefix: str) -> dict:
+    """Run the turns against the in-process server and count round trips per /run."""
+    import httpx
+    from sqlalchemy import event
+    from google.adk.models import BaseLlm, LlmResponse
+    from google.genai import types
+
+    from vishal_agent import server
+
+    class CannedLlm(BaseLlm):
+        async def generate_content_async(self, llm_request, stream=False):
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text="Kya baat hai, bhai!")]))
+
+    server.root_agent.model = CannedLlm(model="canned")
+
+    service = server.session_service
+    engine = getattr(service, "inner", service).db_engine
+    counter = {"round_trips": 0}
+
+    def count(*args, **kwargs):
+        counter["round_trips"] += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    event.listen(engine.sync_engine, "commit", count)
+
+    first, later = [], []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Create the tables outside the measurement
+        await client.post("/run", json={"session_id": f"{prefix}-warmup", "new_message": {"parts": [{"text": "hi"}]}})
+        for s in range(sessions):
+            for t in range(turns):
+                counter["round_trips"] = 0
+                response = await client.post("/run", json={
+                    "user_id": f"user-{s}",
+                    "session_id": f"{prefix}-{s}",
+                    "new_message": {"parts": [{"text": f"question {t}"}]},
+                })
+                response.raise_for_status()
+                (first if t == 0 else later).append(counter["round_trips"])
+
+    return {
+        "first_turn": statistics.mean(first),
+        "later_turns": statistics.mean(later) if later else None,
+        "per_run": statistics.mean(first + later),
+    }
+
+
+def run_mode(name: str, session_cache: str, database_url: str, sessions: int, turns: int) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        SESSION_CACHE=session_cache,
+        FAQ_FAST_PATH="0",
+        RESPONSE_CACHE="off",
+        SINGLE_FLIGHT="0",
+    )
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.session_roundtrips", "--worker",
+         "--sessions", str(sessions), "--turns", str(turns), "--prefix", name],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    # The server prints startup banners; the report is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Session database (default: a temporary SQLite file)")
+    parser.add_argument("--sessions", type=int, default=5, help="Number of sessions")
+    parser.add_argument("--turns", type=int, default=4, help="Turns per session")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--prefix", default="bench", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(measure(args.sessions, args.turns, args.prefix))))
+        return
+
+    report = {"sessions": args.sessions, "turns": args.turns}
+    for name, session_cache in (("baseline", "0"), ("cached", "1")):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = args.database_url or f"sqlite+aiosqlite:///{tmp}/sessions.db"
+            report[name] = run_mode(name, session_cache, database_url, args.sessions, args.turns)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Startup Benchmark
+
+Tracks how long it takes to get a worker serving, so regressions in import
+cost show up (see vishal_agent/startup.py):
+
+1. imports - `python -X importtime -c "import vishal_agent.server"` for each
+   A2A_APP mode (lazy, eager). Reports the median import time, wall time
+   and the packages that cost the most (self time summed per top-level
+   package)
+2. serve (--serve) - starts gunicorn with --workers, with and without
+   preload, and reports the time until /health answers, the memory of the
+   master + workers (PSS, which splits shared pages between processes, so
+   copy-on-write sharing from --preload shows up) and the latency of the
+   first /a2a request (the lazy A2A build)
+
+No Ollama is needed; nothing here calls the model.
+
+Usage:
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --serve --workers 4 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+
+import httpx
+
+from benchmarks.load import wait_for
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_run(env: dict) -> dict:
+    """One `-X importtime` import of the server module."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import vishal_agent.server"],
+        env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+
+    total_us = 0
+    packages: dict[str, int] = {}
+    modules = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        modules += 1
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0) + int(self_us)
+        if name == "vishal_agent.server":
+            total_us = int(cumulative_us)
+    return {"import_ms": total_us / 1000, "wall_s": wall, "modules": modules, "packages": packages}
+
+
+def import_report(mode: str, runs: int, top: int) -> dict:
+    env = dict(os.environ, A2A_APP=mode)
+    results = [import_run(env) for _ in range(runs)]
+    results.sort(key=lambda r: r["import_ms"])
+    median = results[len(results) // 2]
+    heaviest = sorted(median["packages"].items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "runs": runs,
+        "import_ms_p50": round(median["import_ms"], 1),
+        "import_ms_min": round(results[0]["import_ms"], 1),
+        "wall_s_p50": round(statistics.median(r["wall_s"] for r in results), 3),
+        "modules": median["modules"],
+        "heaviest_packages_ms": {name: round(us / 1000, 1) for name, us in heaviest},
+    }
+
+
+def process_tree(pid: int) -> list[int]:
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return pids
+    for child in children:
+        pids.extend(process_tree(child))
+    return pids
+
+
+def pss_mb(pids: list[int]) -> float | None:
+    """Proportional set size of the processes (Linux only)."""
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            return None
+    return round(total_kb / 1024, 1)
+
+
+def serve_report(workers: int, preload: bool, port: int) -> dict:
+    env = dict(os.environ, GUNICORN_PRELOAD="1" if preload else "0")
+    base = f"http://127.0.0.1:{port}"
+    with ExitStack() as stack:
+        start = time.perf_counter()
+        process = subprocess.Popen([
+            sys.executable, "-m", "gunicorn", "vishal_agent.server:app",
+            "--workers", str(workers),
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--bind", f"127.0.0.1:{port}",
+        ], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        stack.callback(lambda: (process.terminate(), process.wait(timeout=10)))
+        wait_for(f"{base}/health", timeout=180)
+        healthy = time.perf_counter() - start
+
+        # Give the remaining workers time to finish booting before measuring memory
+        deadline = time.monotonic() + 60
+        while len(process_tree(process.pid)) < workers + 1 and time.monotonic() < deadline:
+            time.sleep(0.5)
+        time.sleep(2)
+        memory = pss_mb(process_tree(process.pid))
+
+        start = time.perf_counter()
+        status = httpx.get(f"{base}/a2a/.well-known/agent-card.json", timeout=60).status_code
+        first_a2a = time.perf_counter() - start
+        start = time.perf_counter()
+        httpx.get(f"{base}/a2a/.well-known/agent-card.json", timeout=60)
+        second_a2a = time.perf_counter() - start
+
+    return {
+        "preload": preload,
+        "workers": workers,
+        "seconds_to_healthy": round(healthy, 2),
+        "pss_mb": memory,
+        "first_a2a_request_s": round(first_a2a, 3) if status == 200 else None,
+        "second_a2a_request_s": round(second_a2a, 3) if status == 200 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Imports per A2A_APP mode")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest packages to list")
+    parser.add_argument("--serve", action="store_true", help="Also measure gunicorn start-up with and without preload")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers for --serve")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "imports": {mode: import_report(mode, args.runs, args.top) for mode in ("lazy", "eager")},
+    }
+    if args.serve:
+        report["serve"] = [serve_report(args.workers, preload, args.port) for preload in (False, True)]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
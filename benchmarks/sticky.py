@@ -0,0 +1,208 @@
+"""
+Sticky Routing Benchmark
+
+Shows what sticky session routing (vishal_agent/sticky.py) buys:
+
+1. cache - starts the sticky proxy with --spawn N workers on the SQLite
+   session store, once with --policy random (what gunicorn or a plain load
+   balancer does) and once with --policy hash. Multi-turn sessions are run
+   through it, then each worker's /stats is read to sum the session cache
+   hits, misses and stale entries (sessions.py). Also reports /run latency
+2. ring - how many of --keys sessions change upstream when one of N
+   upstreams leaves or joins, for the consistent hash ring and for plain
+   modulo hashing
+
+The model is benchmarks.mock_ollama; no real Ollama is needed.
+
+Usage:
+    python -m benchmarks.sticky --workers 4 --sessions 16 --turns 5
+    python -m benchmarks.sticky --ring-only
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+
+import httpx
+
+from benchmarks.load import percentile, start_process, wait_for
+
+
+def ring_report(upstreams: int, keys: int) -> dict:
+    """Share of sessions that move when an upstream leaves / joins."""
+    from vishal_agent.sticky import HashRing, key_hash
+
+    names = [f"upstream-{i}" for i in range(upstreams + 1)]
+    sessions = [f"session-{i}" for i in range(keys)]
+
+    def moved(before: list[str], after: list[str]) -> dict:
+        ring_before, ring_after = HashRing(before), HashRing(after)
+        ring = sum(ring_before.lookup(s)[0] != ring_after.lookup(s)[0] for s in sessions)
+        modulo = sum(
+            before[key_hash(s) % len(before)] != after[key_hash(s) % len(after)] for s in sessions
+        )
+        return {"consistent_hash": round(ring / keys, 3), "modulo": round(modulo / keys, 3)}
+
+    base = names[:upstreams]
+    owners = HashRing(base)
+    load = {name: 0 for name in base}
+    for s in sessions:
+        load[owners.lookup(s)[0]] += 1
+    return {
+        "upstreams": upstreams,
+        "keys": keys,
+        # Least possible: the leaving upstream's share, or the newcomer's
+        "ideal_moved_when_one_leaves": round(1 / upstreams, 3),
+        "ideal_moved_when_one_joins": round(1 / (upstreams + 1), 3),
+        "moved_when_one_leaves": moved(base, base[1:]),
+        "moved_when_one_joins": moved(base, names),
+        "max_over_mean_load": round(max(load.values()) / (keys / upstreams), 3),
+    }
+
+
+async def drive(base: str, sessions: int, turns: int) -> list[float]:
+    """Run every session's turns in order, the sessions concurrently.
+
+    The first turn names no session, like a new visitor's; the later turns
+    use the session id it came back with.
+    """
+    latencies: list[float] = []
+
+    async def session(client: httpx.AsyncClient, i: int) -> None:
+        session_id = None
+        for turn in range(turns):
+            start = time.perf_counter()
+            response = await client.post(f"{base}/run", json={
+                "user_id": f"bench-{i}",
+                "session_id": session_id,
+                "new_message": {"role": "user", "parts": [{"text": f"Turn {turn}: what did he build at Lumiq?"}]},
+                "verbosity": "final",
+            })
+            response.raise_for_status()
+            session_id = response.json()["session_id"]
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        await asyncio.gather(*(session(client, i) for i in range(sessions)))
+    return latencies
+
+
+def worker_client(url: str) -> httpx.Client:
+    transport = httpx.HTTPTransport(uds=url.removeprefix("unix:"))
+    return httpx.Client(transport=transport, base_url="http://localhost", timeout=30)
+
+
+def worker_stats(urls: list[str]) -> list[dict]:
+    stats = []
+    for url in urls:
+        with worker_client(url) as client:
+            stats.append(client.get("/stats").json()["sessions"] or {})
+    return stats
+
+
+def warm_up(urls: list[str]) -> None:
+    """One session per worker, one worker at a time (fresh SQLite tables are created on first use)."""
+    for url in urls:
+        with worker_client(url) as client:
+            client.post("/sessions", json={"user_id": "warm-up"}).raise_for_status()
+
+
+def cache_report(policy: str, args, mock_url: str) -> dict:
+    port = args.port
+    base = f"http://127.0.0.1:{port}"
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            LITELLM_LOCAL_MODEL_COST_MAP="True",
+            OLLAMA_API_BASE=mock_url,
+            SESSION_STORE="sqlite",
+            SESSION_SQLITE_PATH=os.path.join(tmp, "sessions.db"),
+            FAQ_FAST_PATH="0",
+            RESPONSE_CACHE="off",
+            STICKY_SOCKET_DIR=tmp,
+        )
+        start_process(stack, [
+            sys.executable, "vishal_agent/sticky.py",
+            "--spawn", str(args.workers), "--port", str(port), "--policy", policy,
+        ], env=env)
+        wait_for(f"{base}/_sticky/stats", timeout=60)
+        deadline = time.monotonic() + 180
+        while True:
+            proxy = httpx.get(f"{base}/_sticky/stats").json()
+            upstreams = [u["url"] for u in proxy["upstreams"]]
+            if len(proxy["ring"]) == len(upstreams):
+                try:
+                    warm_up(upstreams)
+                    break
+                except (httpx.HTTPError, OSError):
+                    pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("workers did not come up")
+            time.sleep(0.5)
+
+        wall = time.perf_counter()
+        latencies = asyncio.run(drive(base, args.sessions, args.turns))
+        wall = time.perf_counter() - wall
+        stats = worker_stats(upstreams)
+        proxy = httpx.get(f"{base}/_sticky/stats").json()
+
+    hits = sum(s.get("hits", 0) for s in stats)
+    misses = sum(s.get("misses", 0) for s in stats)
+    return {
+        "policy": policy,
+        "requests": len(latencies),
+        "session_cache_hits": hits,
+        "session_cache_misses": misses,
+        "session_cache_stale": sum(s.get("stale", 0) for s in stats),
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "requests_per_sec": round(len(latencies) / wall, 2),
+        "requests_per_upstream": [u["requests"] for u in proxy["upstreams"]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--keys", type=int, default=10000, help="Sessions for the ring simulation")
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument("--mock-port", type=int, default=11520)
+    parser.add_argument("--ttft", type=float, default=0.05, help="Mock time-to-first-token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=400, help="Mock generation rate")
+    parser.add_argument("--ring-only", action="store_true", help="Skip the server runs")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"ring": ring_report(args.workers, args.keys)}
+    if not args.ring_only:
+        with ExitStack() as stack:
+            mock_url = f"http://127.0.0.1:{args.mock_port}"
+            start_process(stack, [
+                sys.executable, "-m", "benchmarks.mock_ollama",
+                "--port", str(args.mock_port),
+                "--ttft", str(args.ttft),
+                "--tokens-per-sec", str(args.tokens_per_sec),
+            ])
+            wait_for(f"{mock_url}/api/version")
+            report["workers"] = args.workers
+            report["sessions"] = args.sessions
+            report["turns"] = args.turns
+            report["cache"] = [cache_report(policy, args, mock_url) for policy in ("random", "hash")]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Gunicorn Configuration
+
+Gunicorn picks this file up from the working directory (/app in the
+image). Command-line options still apply on top of it. It must stay outside
+the vishal_agent package: importing the package loads the app and its
+metrics before the settings below are in place.
+
+Prepares prometheus-client's multiprocess mode so GET /metrics aggregates
+every worker instead of reporting whichever worker answered:
+
+- PROMETHEUS_MULTIPROC_DIR is set before any worker imports the app
+  (default /tmp/vishal_agent_metrics), and emptied at startup so samples
+  from a previous run don't leak in
+- Samples of exited workers are marked dead so their live gauges drop out
+
+Preloads the app (GUNICORN_PRELOAD=0 to disable): the master imports it once
+and forks the workers, which share the imported modules copy-on-write
+instead of each importing LiteLLM, ADK etc. again. Importing the app opens
+no connections and starts no tasks (see vishal_agent/startup.py); those
+happen per worker in the app's lifespan.
+
+With SESSION_STORE=shared (and no DATABASE_URL) the master starts the
+shared session store (vishal_agent/session_store.py) before the workers and
+stops it on exit. With LLM_BACKEND=llamacpp, LLAMACPP_MODEL set and a unix:
+LLAMACPP_URL it does the same for llama-server (vishal_agent/llamacpp.py),
+and waits until the model is loaded.
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+_metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/vishal_agent_metrics")
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir, exist_ok=True)
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1").lower() not in ("0", "off", "false")
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+_session_store = None
+_llama_server = None
+
+
+def _listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def _llama_ready(path: str) -> bool:
+    """llama-server answers /health with 200 once the model is loaded."""
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(2)
+        try:
+            sock.connect(path)
+            sock.sendall(b"GET /health HTTP/1.0\r\nHost: llama.cpp\r\n\r\n")
+            status = sock.recv(32).split(b" ")
+        except OSError:
+            return False
+    return len(status) > 1 and status[1] == b"200"
+
+
+def _script(name: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "vishal_agent", name)
+
+
+def _start_session_store():
+    if os.environ.get("DATABASE_URL") or os.environ.get("SESSION_STORE", "").lower() != "shared":
+        return None
+    path = os.environ.get("SESSION_STORE_SOCKET", "/tmp/vishal_agent_sessions.sock")
+    process = subprocess.Popen([sys.executable, _script("session_store.py"), "--socket", path])
+    # Workers that can't connect would start serving the store themselves
+    deadline = time.monotonic() + 10
+    while not _listening(path) and process.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return process
+
+
+def _start_llama_server():
+    url = os.environ.get("LLAMACPP_URL", "unix:/tmp/vishal_agent_llama.sock")
+    if (
+        os.environ.get("LLM_BACKEND", "").lower() != "llamacpp"
+        or not os.environ.get("LLAMACPP_MODEL")
+        or not url.startswith("unix:")
+    ):
+        return None
+    path = url.removeprefix("unix:")
+    if _llama_ready(path):
+        # Already served (another gunicorn, or started by hand)
+        return None
+    process = subprocess.Popen([sys.executable, _script("llamacpp.py")])
+    # Loading a GGUF model takes a while; workers would fail their first calls
+    deadline = time.monotonic() + float(os.environ.get("LLAMACPP_START_TIMEOUT", "300"))
+    while not _llama_ready(path) and process.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.2)
+    if process.poll() is not None:
+        print(f"⚠️ llama-server exited with status {process.returncode}")
+    return process
+
+
+def on_starting(server):
+    global _session_store, _llama_server
+    _session_store = _start_session_store()
+    _llama_server = _start_llama_server()
+
+
+def on_exit(server):
+    for process in (_llama_server, _session_store):
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
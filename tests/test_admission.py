@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from vishal_agent.admission import (
+    ANONYMOUS_USER,
+    AdmissionController,
+    AdmissionRejected,
+    queue_key,
+)
+
+
+def controller(**kwargs) -> AdmissionController:
+    settings = {"max_concurrency": 1, "max_queue": 8, "max_queue_per_user": 4, "queue_timeout": 60}
+    return AdmissionController(**{**settings, **kwargs})
+
+
+def test_queue_key():
+    assert queue_key("alice", "s1") == "alice"
+    assert queue_key(ANONYMOUS_USER, "s1") == "session:s1"
+    assert queue_key(ANONYMOUS_USER, "s1") != queue_key(ANONYMOUS_USER, "s2")
+
+
+def test_dispatch_is_round_robin_across_users():
+    async def scenario():
+        admission = controller()
+        running = admission.enqueue("alice")
+        tickets = [admission.enqueue(user) for user in ("alice", "alice", "alice", "bob", "carol")]
+        assert [admission.position(t) for t in tickets] == [1, 4, 5, 2, 3]
+
+        order = []
+        admission.release(running)
+        while admission.active:
+            ticket = next(t for t in tickets if t.granted.is_set() and not t.released)
+            order.append(ticket.user_id)
+            admission.release(ticket)
+        return order
+
+    assert asyncio.run(scenario()) == ["alice", "bob", "carol", "alice", "alice"]
+
+
+def test_full_user_queue_is_rejected_with_429():
+    async def scenario():
+        admission = controller(max_queue_per_user=2)
+        admission.enqueue("alice")
+        admission.enqueue("alice")
+        admission.enqueue("alice")
+        with pytest.raises(AdmissionRejected) as rejected:
+            admission.enqueue("alice")
+        admission.check("bob")
+        return admission, rejected.value
+
+    admission, rejected = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    assert admission.rejected == {"429": 1, "503": 0}
+
+
+def test_full_queue_is_rejected_with_503():
+    async def scenario():
+        admission = controller(max_queue=2)
+        for user in ("alice", "bob", "carol"):
+            admission.enqueue(user)
+        with pytest.raises(AdmissionRejected) as rejected:
+            admission.enqueue("dave")
+        return rejected.value
+
+    assert asyncio.run(scenario()).status_code == 503
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def scenario():
+        admission = controller(queue_timeout=0.05)
+        admission.enqueue("alice")
+        ticket = admission.enqueue("bob")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.wait(ticket)
+        return admission, rejected.value
+
+    admission, rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert admission.queued == 0
+
+
+def test_free_slot_is_granted_immediately():
+    async def scenario():
+        admission = controller(max_concurrency=2)
+        tickets = [admission.enqueue("alice"), admission.enqueue("bob")]
+        assert all([await admission.wait(t, timeout=0.01) for t in tickets])
+        admission.release(tickets[0])
+        admission.release(tickets[0])
+        return admission.active
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,70 @@
+import pytest
+
+from vishal_agent import budgets
+from vishal_agent.budgets import GenerationBudgets, _BudgetCall, load_scale, tokens_saved
+from vishal_agent.faq import FaqIndex
+
+EXAMPLES = [
+    {"question": '"Who is Vishal?" / "Tell me about Vishal"', "answer": "Vishal is a software developer."},
+    {"question": "What are your rates?", "answer": "It depends on the project.", "faq": False},
+]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(budgets, "BUDGET_MAX_TOKENS", 320)
+    monkeypatch.setattr(budgets, "BUDGET_MIN_TOKENS", 48)
+    monkeypatch.setattr(budgets, "BUDGET_DEADLINE", 60.0)
+    monkeypatch.setattr(budgets, "BUDGET_ENDPOINTS", {"run_batch": {"max_tokens": 512, "deadline": 120}})
+    monkeypatch.setattr(budgets, "BUDGET_INTENTS", {})
+    monkeypatch.setattr(budgets, "BUDGET_INTENT_FACTOR", 3.0)
+    monkeypatch.setattr(budgets, "BUDGET_MIN_SCALE", 0.5)
+    monkeypatch.setattr(budgets, "BUDGET_TIGHTEN_QUEUE", 8)
+    monkeypatch.setattr(budgets, "BUDGET_TAIL_TOKENS", 160)
+
+
+@pytest.fixture
+def generation_budgets():
+    return GenerationBudgets(FaqIndex(EXAMPLES, threshold=1.0))
+
+
+def test_load_scale():
+    assert load_scale(0) == 1.0
+    assert load_scale(4) == 0.75
+    assert load_scale(8) == 0.5
+    assert load_scale(100) == 0.5
+
+
+def test_load_scale_off(monkeypatch):
+    monkeypatch.setattr(budgets, "BUDGET_TIGHTEN_QUEUE", 0)
+    assert load_scale(100) == 1.0
+
+
+def test_endpoint_budgets(generation_budgets):
+    run = generation_budgets.for_request("run_sse", "What are your rates?")
+    assert (run.name, run.max_tokens, run.deadline, run.scale) == ("run_sse", 320, 60.0, 1.0)
+    batch = generation_budgets.for_request("run_batch", "What are your rates?")
+    assert (batch.max_tokens, batch.deadline) == (512, 120.0)
+
+
+def test_intent_budget(generation_budgets, monkeypatch):
+    budget = generation_budgets.for_request("run_sse", "who is vishal")
+    # 3 x the canned answer's ~8 tokens, floored at BUDGET_MIN_TOKENS
+    assert (budget.name, budget.max_tokens) == ("intent:who-is-vishal", 48)
+
+    monkeypatch.setattr(budgets, "BUDGET_INTENTS", {"who-is-vishal": {"max_tokens": 200}})
+    assert generation_budgets.for_request("run_sse", "Tell me about Vishal").max_tokens == 200
+
+
+def test_queue_tightens_budget(generation_budgets):
+    budget = generation_budgets.for_request("run_sse", "What are your rates?", queued=4)
+    assert (budget.scale, budget.max_tokens, budget.deadline) == (0.75, 240, 45.0)
+    floored = generation_budgets.for_request("run_sse", "who is vishal", queued=8)
+    assert floored.max_tokens == 48
+
+
+def test_tokens_saved():
+    call = _BudgetCall({"endpoint": "run_sse", "deadline_at": 0}, max_tokens=320)
+    assert tokens_saved(call, 100, "deadline") == 220
+    assert tokens_saved(call, 400, "deadline") == 0
+    assert tokens_saved(call, 320, "max_tokens") == 160
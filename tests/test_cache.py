@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+from vishal_agent.cache import (
+    CacheEntry,
+    MemoryCacheBackend,
+    ResponseCache,
+    normalize_message,
+    similarity,
+    trigrams,
+)
+
+
+def entry(key: str, text: str = "hello", **kwargs) -> CacheEntry:
+    return CacheEntry(key, normalize_message(text), f"answer to {text}", **kwargs)
+
+
+def test_normalize_message():
+    assert normalize_message("  Who IS  Vishal?! ") == "who is vishal"
+
+
+def test_similarity():
+    a = trigrams(normalize_message("Who is Vishal?"))
+    assert similarity(a, a) == 1.0
+    assert similarity(a, trigrams("who is vishal please")) > 0.5
+    assert similarity(a, trigrams("what are your rates")) < 0.3
+    assert similarity(a, frozenset()) == 0.0
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2, ttl=0)
+
+    async def scenario():
+        await backend.set(entry("a"))
+        await backend.set(entry("b"))
+        await backend.get("a")
+        await backend.set(entry("c"))
+        return [await backend.get(key) is not None for key in "abc"], await backend.size()
+
+    assert asyncio.run(scenario()) == ([True, False, True], 2)
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryCacheBackend(max_entries=10, ttl=5)
+
+    async def scenario():
+        await backend.set(entry("old", created_at=time.time() - 10))
+        await backend.set(entry("new"))
+        return [e.key for e in await backend.candidates()], await backend.get("old")
+
+    assert asyncio.run(scenario()) == (["new"], None)
+
+
+def test_response_cache_exact_and_near_hits():
+    cache = ResponseCache(MemoryCacheBackend(max_entries=10, ttl=0), "fp", similarity_threshold=0.8)
+
+    async def scenario():
+        await cache.store("Who is Vishal?", "A developer.")
+        return [
+            await cache.lookup("who is vishal"),
+            await cache.lookup("Who is Vishaal?"),
+            await cache.lookup("What are your rates?"),
+        ]
+
+    assert asyncio.run(scenario()) == ["A developer.", "A developer.", None]
+    assert (cache.hits, cache.near_hits, cache.misses) == (1, 1, 1)
+
+
+def test_response_cache_keys_depend_on_fingerprint():
+    backend = MemoryCacheBackend(max_entries=10, ttl=0)
+    old = ResponseCache(backend, "old-prompt", similarity_threshold=0)
+    new = ResponseCache(backend, "new-prompt", similarity_threshold=0)
+
+    async def scenario():
+        await old.store("Who is Vishal?", "A developer.")
+        return await new.lookup("Who is Vishal?")
+
+    assert asyncio.run(scenario()) is None
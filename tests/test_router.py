@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+from google.adk.models.lite_llm import LiteLLMClient
+
+from vishal_agent import router
+from vishal_agent.router import Backend, LlmRouter, create_llm_router, parse_backends
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace the real LiteLLM call: backends whose url contains "down" fail."""
+    calls = []
+
+    async def acompletion(self, model, messages, tools, api_base=None, **kwargs):
+        calls.append(api_base)
+        if "down" in api_base:
+            raise OSError(f"{api_base} refused the connection")
+        if kwargs.get("stream"):
+            return chunks(api_base)
+        return f"answer from {api_base}"
+
+    async def chunks(api_base):
+        for token in ("answer", " from", f" {api_base}"):
+            yield token
+
+    monkeypatch.setattr(LiteLLMClient, "acompletion", acompletion)
+    return calls
+
+
+def test_parse_backends():
+    backends = parse_backends(" http://a:11434/*2, ,http://b:11434")
+    assert [(b.url, b.weight) for b in backends] == [("http://a:11434", 2.0), ("http://b:11434", 1.0)]
+
+
+def test_candidates_prefer_least_loaded_then_ejected():
+    busy = Backend("http://busy", outstanding=2)
+    heavy = Backend("http://heavy", weight=4, outstanding=2)
+    idle = Backend("http://idle", requests=10)
+    ejected = Backend("http://ejected", ejected_until=time.monotonic() + 60)
+    llm = LlmRouter([ejected, busy, heavy, idle])
+    for _ in range(10):
+        assert [b.url for b in llm.candidates()] == ["http://idle", "http://heavy", "http://busy", "http://ejected"]
+
+
+def test_failover_before_first_token(calls):
+    llm = LlmRouter([Backend("http://down"), Backend("http://up", requests=5)])
+    assert asyncio.run(llm.acompletion("model", [], None)) == "answer from http://up"
+    assert calls == ["http://down", "http://up"]
+    assert llm.failovers == 1
+    assert [b.failures for b in llm.backends] == [1, 0]
+
+
+def test_streaming_failover(calls):
+    llm = LlmRouter([Backend("http://down"), Backend("http://up", requests=5)])
+
+    async def scenario():
+        return [chunk async for chunk in await llm.acompletion("model", [], None, stream=True)]
+
+    assert asyncio.run(scenario()) == ["answer", " from", " http://up"]
+    assert calls == ["http://down", "http://up"]
+    assert [b.outstanding for b in llm.backends] == [0, 0]
+
+
+def test_all_backends_down_raises_and_ejects(calls, monkeypatch):
+    monkeypatch.setattr(router, "LLM_EJECT_AFTER", 2)
+    llm = LlmRouter([Backend("http://down-1"), Backend("http://down-2")])
+    for _ in range(2):
+        with pytest.raises(OSError):
+            asyncio.run(llm.acompletion("model", [], None))
+    assert all(b.ejected for b in llm.backends)
+    # Fail open: ejected backends are still tried
+    with pytest.raises(OSError):
+        asyncio.run(llm.acompletion("model", [], None))
+    assert len(calls) == 6
+
+
+def test_small_model_for_short_prompts():
+    llm = LlmRouter([Backend("http://up")], small_model="small", small_max_words=3)
+    assert llm.choose_model("big", [{"role": "user", "content": "who is vishal?"}]) == "small"
+    assert llm.choose_model("big", [{"role": "user", "content": "tell me about his projects"}]) == "big"
+    assert llm.choose_model("big", [{"role": "tool", "content": "ok"}]) == "big"
+
+
+def test_create_llm_router(monkeypatch):
+    monkeypatch.delenv("LLM_SMALL_MODEL", raising=False)
+    monkeypatch.delenv("LLM_BACKENDS", raising=False)
+    assert create_llm_router() is None
+
+    monkeypatch.setenv("LLM_BACKENDS", "http://a*2,http://b")
+    assert [b.url for b in create_llm_router().backends] == ["http://a", "http://b"]
+
+    monkeypatch.setenv("LLM_BACKENDS", ",")
+    with pytest.raises(ValueError, match="LLM_BACKENDS lists no backends"):
+        create_llm_router()
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from vishal_agent.singleflight import SingleFlight
+
+
+def test_followers_share_the_leaders_items():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def producer():
+            yield "a"
+            await release.wait()
+            yield "b"
+
+        flight, leader = flights.join("key", producer)
+        follower, follower_leads = flights.join("key", producer)
+        assert (leader, follower_leads, follower is flight) == (True, False, True)
+        release.set()
+        items = [item async for item in follower.subscribe()]
+        return flights, items
+
+    flights, items = asyncio.run(scenario())
+    assert items == ["a", "b"]
+    assert "key" not in flights
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "followers": 1}
+
+
+def test_failed_flight_is_forgotten_before_subscribers_see_the_error():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def producer():
+            yield "a"
+            raise OSError("model down")
+
+        flight, _ = flights.join("key", producer)
+        with pytest.raises(OSError):
+            async for _ in flight.subscribe():
+                pass
+        assert "key" not in flights
+        return flights.join("key", producer)[1]
+
+    assert asyncio.run(scenario()) is True
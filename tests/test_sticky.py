@@ -0,0 +1,53 @@
+import json
+
+from vishal_agent.sticky import HashRing, assign_session, session_key
+
+NODES = ["http://w1", "http://w2", "http://w3", "http://w4"]
+KEYS = [f"session-{i}" for i in range(400)]
+
+
+def test_lookup_is_stable_and_lists_every_node():
+    ring = HashRing(NODES)
+    other = HashRing(reversed(NODES))
+    for key in KEYS[:20]:
+        order = ring.lookup(key)
+        assert sorted(order) == sorted(NODES)
+        assert order == other.lookup(key)
+    assert HashRing().lookup("session-1") == []
+
+
+def test_sessions_are_spread_over_nodes():
+    ring = HashRing(NODES)
+    owners = [ring.lookup(key)[0] for key in KEYS]
+    assert all(owners.count(node) > len(KEYS) / len(NODES) / 2 for node in NODES)
+
+
+def test_removing_a_node_only_moves_its_sessions_to_their_fallback():
+    ring = HashRing(NODES)
+    before = {key: ring.lookup(key) for key in KEYS}
+    ring.remove("http://w2")
+    for key in KEYS:
+        owner = ring.lookup(key)[0]
+        if before[key][0] == "http://w2":
+            assert owner == before[key][1]
+        else:
+            assert owner == before[key][0]
+
+
+def test_session_key():
+    json_headers = {"content-type": "application/json"}
+    assert session_key("/run", {"x-session-id": "s1"}, b"") == "s1"
+    assert session_key("/apps/a/users/u/sessions/s2", {}, b"") == "s2"
+    assert session_key("/run_sse", json_headers, b'{"session_id": "s3"}') == "s3"
+    a2a = {"params": {"message": {"contextId": "s4"}}}
+    assert session_key("/a2a/", json_headers, json.dumps(a2a).encode()) == "s4"
+    assert session_key("/run", json_headers, b'{"message": "hi"}') is None
+    assert session_key("/run", {}, b'{"session_id": "s3"}') is None
+
+
+def test_assign_session():
+    body, session_id = assign_session(b'{"message": "hi"}')
+    assert session_id.startswith("session-")
+    assert json.loads(body) == {"message": "hi", "session_id": session_id}
+    assert assign_session(b"not json") is None
+    assert assign_session(b"[]") is None
@@ -1 +1,6 @@
+import os
+
+# Use LiteLLM's bundled model cost map instead of downloading it on import
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
 from . import agent
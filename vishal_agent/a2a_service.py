@@ -0,0 +1,228 @@
+"""
+A2A Service
+
+The /a2a mount used to get everything of its own from to_a2a: a Runner with
+in-memory sessions, an unbounded in-memory task store, and (in
+docker-compose) a separate a2a-server with its own workers and model
+warm-up. Now it shares the server's pieces:
+
+- SharedRunnerExecutor runs A2A requests on the server's runner, so they
+  use the same session service (context_id is the session id), session
+  cache and Ollama connections as /run. Every turn goes through the
+  server's admission control and is flushed like a /run turn
+- A2A tasks (status, history, artifacts) are kept in a bounded store:
+
+  - memory (default) - per worker, least recently updated tasks beyond
+    A2A_TASK_MAX and tasks idle for longer than A2A_TASK_TTL are evicted
+  - database - the a2a_tasks table in DATABASE_URL (Postgres, or the SQLite
+    stand-in), so tasks/get works on every worker. The same limits are
+    enforced by a background pruner every A2A_TASK_PRUNE_INTERVAL seconds
+
+The agent card advertises A2A_PUBLIC_URL, the address other agents reach
+/a2a/ at (default: http://localhost:8000/a2a/ behind the API server).
+
+Importing this module imports the a2a SDK, so the server only does it when
+the A2A app is built (see startup.py).
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, Callable
+
+from a2a.server.agent_execution import RequestContext
+from a2a.server.context import ServerCallContext
+from a2a.server.events import EventQueue
+from a2a.server.models import Base, TaskMixin
+from a2a.server.tasks import DatabaseTaskStore, TaskStore
+from a2a.types import Task
+from google.adk.a2a.executor.a2a_agent_executor import A2aAgentExecutor
+from google.adk.runners import Runner
+from sqlalchemy import Float, delete, func, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+A2A_TASK_STORE = os.environ.get("A2A_TASK_STORE", "memory").lower()
+A2A_TASK_MAX = int(os.environ.get("A2A_TASK_MAX", "1000"))
+A2A_TASK_TTL = float(os.environ.get("A2A_TASK_TTL", "3600"))
+A2A_TASK_PRUNE_INTERVAL = float(os.environ.get("A2A_TASK_PRUNE_INTERVAL", "300"))
+A2A_PUBLIC_URL = os.environ.get("A2A_PUBLIC_URL", "")
+
+
+# ============================================
+# Task stores
+# ============================================
+
+class BoundedTaskStore(TaskStore):
+    """In-memory task store with a size cap and an idle TTL (0 = no limit)."""
+
+    def __init__(self, max_tasks: int = A2A_TASK_MAX, ttl: float = A2A_TASK_TTL):
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        # task id -> (last save, task), least recently saved first
+        self.tasks: OrderedDict[str, tuple[float, Task]] = OrderedDict()
+        self.evicted = {"ttl": 0, "size": 0}
+
+    def _expired(self, saved: float, now: float) -> bool:
+        return self.ttl > 0 and now - saved > self.ttl
+
+    async def save(self, task: Task, context: ServerCallContext | None = None) -> None:
+        self.tasks[task.id] = (time.monotonic(), task)
+        self.tasks.move_to_end(task.id)
+        await self.prune()
+
+    async def get(self, task_id: str, context: ServerCallContext | None = None) -> Task | None:
+        entry = self.tasks.get(task_id)
+        if entry is None:
+            return None
+        if self._expired(entry[0], time.monotonic()):
+            del self.tasks[task_id]
+            self.evicted["ttl"] += 1
+            return None
+        return entry[1]
+
+    async def delete(self, task_id: str, context: ServerCallContext | None = None) -> None:
+        self.tasks.pop(task_id, None)
+
+    async def prune(self) -> int:
+        """Evict idle tasks, then the least recently saved ones while over the cap."""
+        now = time.monotonic()
+        evicted = 0
+        while self.tasks:
+            task_id, (saved, _) = next(iter(self.tasks.items()))
+            if self._expired(saved, now):
+                self.evicted["ttl"] += 1
+            elif self.max_tasks > 0 and len(self.tasks) > self.max_tasks:
+                self.evicted["size"] += 1
+            else:
+                break
+            del self.tasks[task_id]
+            evicted += 1
+        return evicted
+
+    async def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "tasks": len(self.tasks),
+            "max_tasks": self.max_tasks,
+            "ttl": self.ttl,
+            "evicted": self.evicted,
+        }
+
+
+class A2aTaskModel(TaskMixin, Base):
+    """The a2a SDK's task row plus the time it last changed."""
+
+    __tablename__ = "a2a_tasks"
+
+    # Set by SQLAlchemy on every INSERT / UPDATE the store's merge() issues
+    updated_at: Mapped[float] = mapped_column(Float, index=True, default=time.time, onupdate=time.time)
+
+
+class PrunedDatabaseTaskStore(DatabaseTaskStore):
+    """The a2a SDK's DatabaseTaskStore on a2a_tasks, pruned to the same limits."""
+
+    def __init__(self, engine, max_tasks: int = A2A_TASK_MAX, ttl: float = A2A_TASK_TTL):
+        super().__init__(engine)
+        self.task_model = A2aTaskModel
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        self.pruned = 0
+
+    async def prune(self) -> int:
+        """Delete tasks idle for longer than ttl, then the oldest beyond max_tasks."""
+        await self._ensure_initialized()
+        model = self.task_model
+        deleted = 0
+        async with self.async_session_maker.begin() as session:
+            if self.ttl > 0:
+                result = await session.execute(delete(model).where(model.updated_at < time.time() - self.ttl))
+                deleted += result.rowcount or 0
+            if self.max_tasks > 0:
+                # Update time of the newest task that doesn't fit
+                cutoff = await session.scalar(
+                    select(model.updated_at).order_by(model.updated_at.desc()).offset(self.max_tasks).limit(1)
+                )
+                if cutoff is not None:
+                    result = await session.execute(delete(model).where(model.updated_at <= cutoff))
+                    deleted += result.rowcount or 0
+        self.pruned += deleted
+        return deleted
+
+    async def stats(self) -> dict:
+        await self._ensure_initialized()
+        async with self.async_session_maker() as session:
+            tasks = await session.scalar(select(func.count()).select_from(self.task_model))
+        return {
+            "backend": "database",
+            "tasks": tasks,
+            "max_tasks": self.max_tasks,
+            "ttl": self.ttl,
+            "pruned": self.pruned,
+        }
+
+
+async def run_task_pruner(store: BoundedTaskStore | PrunedDatabaseTaskStore) -> None:
+    """Prune the task store every A2A_TASK_PRUNE_INTERVAL seconds (runs until cancelled)."""
+    # Jitter so the workers of a deployment don't all prune at the same moment
+    await asyncio.sleep(random.uniform(0, min(A2A_TASK_PRUNE_INTERVAL, 60)))
+    while True:
+        try:
+            pruned = await store.prune()
+            if pruned:
+                print(f"🧹 Pruned {pruned} A2A tasks")
+        except Exception as e:
+            print(f"⚠️ A2A task pruning failed: {e}")
+        await asyncio.sleep(A2A_TASK_PRUNE_INTERVAL)
+
+
+def task_store_lifespan(store: BoundedTaskStore | PrunedDatabaseTaskStore):
+    """Starlette lifespan that runs the store's pruner while the A2A app is up."""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        pruner = asyncio.create_task(run_task_pruner(store))
+        try:
+            yield
+        finally:
+            pruner.cancel()
+
+    return lifespan
+
+
+def create_task_store(database_url: str | None) -> BoundedTaskStore | PrunedDatabaseTaskStore:
+    """Task store from A2A_TASK_* environment variables."""
+    if A2A_TASK_STORE not in ("memory", "database"):
+        raise ValueError(f"Unknown A2A_TASK_STORE: {A2A_TASK_STORE}")
+    if A2A_TASK_STORE == "database":
+        if database_url:
+            from .db import get_engine
+
+            print(f"🗂️ A2A tasks in the database (max {A2A_TASK_MAX}, TTL {A2A_TASK_TTL:.0f}s)")
+            return PrunedDatabaseTaskStore(get_engine(database_url))
+        print("⚠️ A2A_TASK_STORE=database needs DATABASE_URL, keeping A2A tasks in memory")
+    print(f"🗂️ A2A tasks in memory (max {A2A_TASK_MAX}, TTL {A2A_TASK_TTL:.0f}s)")
+    return BoundedTaskStore()
+
+
+# ============================================
+# Executor
+# ============================================
+
+class SharedRunnerExecutor(A2aAgentExecutor):
+    """A2aAgentExecutor on a shared runner, with every turn wrapped by turn(user_id, session_id)."""
+
+    def __init__(self, runner: Runner, turn: Callable[[str, str], AsyncContextManager]):
+        super().__init__(runner=runner)
+        self.turn = turn
+
+    async def execute(self, context: RequestContext, event_queue: EventQueue) -> None:
+        if not context.message:
+            # Rejected by the base class
+            return await super().execute(context, event_queue)
+        # The ids the runner will use (the conversion only reads the request)
+        request = self._config.request_converter(context, self._config.a2a_part_converter)
+        async with self.turn(request.user_id, request.session_id):
+            await super().execute(context, event_queue)
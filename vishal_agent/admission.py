@@ -0,0 +1,231 @@
+"""
+Admission Control for the Ollama Backend
+
+A single local Ollama model can only generate so many answers at once.
+Without a limit every request is accepted, they all compete for the model,
+latency explodes and gunicorn's TIMEOUT starts killing workers.
+
+This module puts a bounded concurrency limiter with a fair queue in front
+of runner.run_async:
+
+- At most ADMISSION_MAX_CONCURRENCY generations run at once (per worker)
+- Waiting requests are served round-robin across user_ids, so one chatty
+  client cannot starve everyone else. Requests without a user_id (all
+  ANONYMOUS_USER) are queued per session instead, or every anonymous
+  visitor would share one per-user queue and get 429s for the others
+- The queue is bounded: a full per-user queue is rejected with 429, a full
+  global queue (or a request that waited too long) with 503, both with a
+  Retry-After estimate
+- Queue wait and generation time are tracked separately
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+# user_id of requests that don't name a user (the RunRequest default)
+ANONYMOUS_USER = "default_user"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted (maps to 429/503)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def queue_key(user_id: str, session_id: str) -> str:
+    """The fair queue a request waits in: its user's, or its session's if anonymous."""
+    return f"session:{session_id}" if user_id == ANONYMOUS_USER else user_id
+
+
+@dataclass
+class QueuePosition:
+    """Queue position update published to SSE subscribers while waiting."""
+    position: int
+
+
+class Ticket:
+    """A request's place in the admission queue."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.started_at: float | None = None
+        self.released = False
+        self.granted = asyncio.Event()
+
+
+class _Timing:
+    """Running count/total/max of a duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "mean_s": round(self.mean, 4), "max_s": round(self.max, 4)}
+
+
+class AdmissionController:
+    """Bounded concurrency limiter with a per-user round-robin queue."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        max_queue_per_user: int,
+        queue_timeout: float,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        # user_id -> waiting tickets; dict order is the round-robin order
+        self._queues: OrderedDict[str, deque[Ticket]] = OrderedDict()
+        self.queue_wait = _Timing()
+        self.generation = _Timing()
+        self.admitted = 0
+        self.rejected = {"429": 0, "503": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up."""
+        per_generation = self.generation.mean or 5.0
+        waves = (self.queued + 1) / self.max_concurrency
+        return max(1, math.ceil(per_generation * waves))
+
+    def _reject(self, status_code: int, detail: str) -> AdmissionRejected:
+        self.rejected[str(status_code)] += 1
+        return AdmissionRejected(status_code, detail, self.retry_after())
+
+    def check(self, user_id: str) -> None:
+        """Raise AdmissionRejected if a request from user_id would be turned away now."""
+        if self.active < self.max_concurrency and not self._queues:
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject(503, "Server is busy, please retry later")
+        if len(self._queues.get(user_id, ())) >= self.max_queue_per_user:
+            raise self._reject(429, "Too many queued requests for this user")
+
+    def enqueue(self, user_id: str) -> Ticket:
+        """Take a slot or a place in the queue (raises AdmissionRejected when full)."""
+        self.check(user_id)
+        ticket = Ticket(user_id)
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based position in the fair dispatch order (0 once admitted)."""
+        if ticket.granted.is_set():
+            return 0
+        own = self._queues.get(ticket.user_id)
+        if not own or ticket not in own:
+            return 0
+        index = own.index(ticket)
+        ahead = index
+        before = True
+        for user_id, queue in self._queues.items():
+            if user_id == ticket.user_id:
+                before = False
+                continue
+            # Users ahead in the rotation get one extra turn in our round
+            ahead += min(len(queue), index + 1 if before else index)
+        return ahead + 1
+
+    async def wait(self, ticket: Ticket, timeout: float | None = None) -> bool:
+        """Wait until the ticket is admitted; False if timeout elapsed first.
+
+        Raises AdmissionRejected (503) once the ticket has waited longer than
+        the configured queue timeout.
+        """
+        remaining = self.queue_timeout - (time.monotonic() - ticket.enqueued_at)
+        if remaining <= 0 and not ticket.granted.is_set():
+            self.release(ticket)
+            raise self._reject(503, "Timed out waiting for a free model slot")
+        try:
+            await asyncio.wait_for(
+                ticket.granted.wait(),
+                timeout=min(timeout, remaining) if timeout is not None else remaining,
+            )
+            return True
+        except asyncio.TimeoutError:
+            if time.monotonic() - ticket.enqueued_at >= self.queue_timeout:
+                self.release(ticket)
+                raise self._reject(503, "Timed out waiting for a free model slot")
+            return False
+
+    def release(self, ticket: Ticket) -> None:
+        """Give back the slot (or leave the queue). Safe to call more than once."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted.is_set():
+            self.active -= 1
+            self.generation.observe(time.monotonic() - ticket.started_at)
+        else:
+            queue = self._queues.get(ticket.user_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.user_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_concurrency and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self.active += 1
+            self.admitted += 1
+            ticket.started_at = time.monotonic()
+            self.queue_wait.observe(ticket.started_at - ticket.enqueued_at)
+            ticket.granted.set()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_wait": self.queue_wait.as_dict(),
+            "generation": self.generation.as_dict(),
+        }
+
+
+def create_admission_controller() -> AdmissionController | None:
+    """Build the admission controller from ADMISSION_* environment variables."""
+    if os.environ.get("ADMISSION", "1").lower() in ("0", "off", "false"):
+        return None
+    return AdmissionController(
+        max_concurrency=int(os.environ.get("ADMISSION_MAX_CONCURRENCY", "2")),
+        max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "32")),
+        max_queue_per_user=int(os.environ.get("ADMISSION_MAX_QUEUE_PER_USER", "4")),
+        # Stay well below gunicorn's TIMEOUT so queued requests fail fast instead
+        queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "60")),
+    )
@@ -10,9 +10,17 @@ from google.adk.agents import Agent
 from google.adk.models.lite_llm import LiteLlm
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables (before the local modules read their settings)
 load_dotenv()
 
+from .budgets import GENERATION_BUDGETS, BudgetedClient, apply_budget, budget_after
+from .history import compact_history, history_compaction_enabled
+from .metrics import llm_metrics_after, llm_metrics_before
+from .knowledge import KnowledgeIndex, load_knowledge, render_examples, render_knowledge
+from .llamacpp import create_llamacpp_client
+from .ollama import http_client
+from .router import create_llm_router
+
 # Configure Ollama - use ollama_chat provider for better tool support
 # The environment variable is required for LiteLLM to find Ollama
 os.environ.setdefault("OLLAMA_API_BASE", "http://localhost:11434")
@@ -20,15 +28,43 @@ os.environ.setdefault("OLLAMA_API_BASE", "http://localhost:11434")
 # Model constant - using ollama_chat provider as recommended by ADK docs
 MODEL = "ollama_chat/llama3.2:latest"
 
+# Several Ollama instances and/or a small model for short prompts (see
+# router.py); None talks to OLLAMA_API_BASE directly
+llm_router = create_llm_router()
+
+# LLM_BACKEND=llamacpp: llama-server over a Unix socket instead of Ollama
+# (see llamacpp.py); replaces the router
+llamacpp_client = create_llamacpp_client()
+if llamacpp_client and llm_router:
+    print("⚠️ LLM_BACKEND=llamacpp ignores LLM_BACKENDS / LLM_SMALL_MODEL")
+    llm_router = None
+llm_client = llamacpp_client or llm_router
+# Per-turn generation budgets close streamed calls at their deadline (see budgets.py)
+if GENERATION_BUDGETS:
+    llm_client = BudgetedClient(llm_client)
+
+# Keep the model (and its KV cache for the static instruction prefix) resident
+# in Ollama between requests instead of the default 5 minute unload
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Pin the context window: the instruction alone is ~3.5k tokens, so Ollama's
+# default window truncates it, and a changing num_ctx forces a model reload
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+
+# full      - persona plus the whole knowledge base in the system prompt
+# retrieval - persona only; knowledge fetched per turn via search_knowledge
+PROMPT_MODE = os.environ.get("PROMPT_MODE", "full").lower()
+
 # ============================================
-# Create the ADK Agent
+# Agent Instruction
 # ============================================
 
-root_agent = Agent(
-    name="vishal_assistant",
-    model=LiteLlm(model=MODEL),
-    description="Vishal's witty AI sidekick - knows everything about him, answers with humor, and occasionally roasts him",
-    instruction="""You are Vishal's AI assistant with a fun, witty personality. Think of yourself as his digital hype-man who can also roast him when asked.
+# The instruction is assembled from static sections only (no per-request
+# values), so every turn sends a byte-identical prefix that Ollama can serve
+# from its KV cache instead of prefilling it again. Only the persona and
+# rules live here; the knowledge itself is in knowledge.json.
+
+PERSONA_INSTRUCTION = """You are Vishal's AI assistant with a fun, witty personality. Think of yourself as his digital hype-man who can also roast him when asked.
 
 ## YOUR PERSONALITY 🎭
 - Casual, funny, and a bit sarcastic (in a friendly way)
@@ -60,226 +96,76 @@ Examples of proper responses when you don't know:
 4. **No corporate speak** - "synergy", "leverage", "ecosystem" are banned words
 5. **When roasting** - Be funny but not mean (he's paying for my compute after all)
 6. **For "surprise me"** - Share a random fun fact or quirky thing about Vishal
-7. **STICK TO THE DATA** - Only use information from this instruction. No guessing, no making up facts.
-
-## WORK EXPERIENCE (The Full Journey) 🚀
-
-### CURRENT: Technical Lead at Lumiq (February 2022 - Present)
-Location: Noida
-- Leading emPower pryzm - data reliability platform for modern financial services enterprises
-- Built technology stack for 2 sub-products of emPower suite from scratch
-- Managing teams of Data Engineers, Full Stack Engineers, Designers, and Testers
-- Expert in real-time data-driven architecture and enterprise software deployment
-- Successfully launched and got featured in PR Newswire!
-- Website: https://www.lumiq.ai
-- Platform: https://pryzm.ai/
-- Press Release: https://www.prnewswire.com/in/news-releases/lumiq-unveils-empower-pryzm-a-data-reliability-platform-purpose-built-for-the-modern-financial-services-enterprise-301923193.html
-
-### Technical Product Lead at LimeChat (August 2020 - January 2022)
-Location: Bengaluru
-- Built their AI help desk for e-commerce from SCRATCH (the whole thing!)
-- Managed cross-functional team of 10 members (backend devs, frontend devs, testers, designers)
-- Successfully managed 20+ agile sprints
-- Launched on multiple platforms - made customer support less annoying for e-commerce stores globally
-- Website: https://www.limechat.ai
-- Shopify App: https://apps.shopify.com/limechat-shop
-- Android App: https://play.google.com/store/apps/details?id=com.limechat.app
-- iOS App: https://apps.apple.com/in/app/limechat-agent/id1579651271
-
-### Founder at AirTrik (August 2019 - July 2020)
-Location: New Delhi
-- Founded and built a PaaS application for Industrial IoT applications
-- Published actual production-ready packages and apps!
-- Designed and implemented secure IoT communication protocols
-- Android App: https://play.google.com/store/apps/details?id=com.airtrik.airtrikconnect
-- NPM Package: https://www.npmjs.com/package/airtrik
-- Python Package: https://pypi.org/project/airtrik/
-- GitHub: https://github.com/airtrik
-- Tech Stack: Python, Django, C, Apache, Mosquitto, Docker, AWS
-
-## TECHNICAL SKILLS (The Full Arsenal) 💻
-
-### Frontend Development
-- HTML5, CSS3, JavaScript (ES6+)
-- Angular
-- Responsive Design
-
-### Backend Development
-- Node.js, Python
-- MySQL, PostgreSQL
-- RESTful APIs
-- Microservices Architecture
-
-### Cloud & DevOps
-- AWS (Amazon Web Services)
-- Docker, Kubernetes
-- ArgoCD
-
-### Message Queues & Streaming
-- Apache Kafka
-- RabbitMQ
-
-### Authentication & Security
-- Keycloak
-
-### Tools & Platforms
-- VS Code, Git, GitHub
-- Microsoft Teams, Notion
-- Metabase
-
-### Other Technologies
-- IoT Development
-- C Programming
-- NPM Package Development
-- Python Packages (pip)
-
-### Leadership & Management Skills
-- Technical Leadership
-- Team Building & Management
-- Agile/Scrum (20+ Sprint cycles managed)
-- Stakeholder Management
-- Hiring & Interviewing
-- Product Development
-
-## PROJECTS (All The Cool Stuff) 🎮
-
-### 1. Lumiq emPower pryzm
-- Data reliability platform for financial services enterprises
-- Built from scratch, led full development
-- Website: https://www.lumiq.ai
-- Platform: https://pryzm.ai/
-- Press: https://www.prnewswire.com/in/news-releases/lumiq-unveils-empower-pryzm-a-data-reliability-platform-purpose-built-for-the-modern-financial-services-enterprise-301923193.html
-
-### 2. LimeChat AI Help Desk
-- AI-powered customer support for e-commerce
-- Built entire product from scratch
-- Website: https://www.limechat.ai
-- Shopify App: https://apps.shopify.com/limechat-shop
-- Android: https://play.google.com/store/apps/details?id=com.limechat.app
-- iOS: https://apps.apple.com/in/app/limechat-agent/id1579651271
-
-### 3. AirTrik IoT Platform
-- Complete PaaS for Industrial IoT
-- GitHub: https://github.com/airtrik
-- NPM: https://www.npmjs.com/package/airtrik
-- PyPI: https://pypi.org/project/airtrik/
-- Android: https://play.google.com/store/apps/details?id=com.airtrik.airtrikconnect
-
-### 4. Real-time P2P Serverless Chat
-- Peer-to-peer chat with WebRTC (text, audio, video)
-- Zero servers needed - direct browser-to-browser
-- Demo: https://server-less-chat.vishalpandey.co.in
-
-### 5. HiCard - NFC Contact Sharing
-- Digital business card with NFC tap-to-share
-- Website: https://hicard.in
-- Vishal's Profile: https://hicard.in/vishal
-
-### 6. Retro Games Collection (Fun Side Projects)
-- Classic games in vanilla JavaScript
-- Car Racing: https://car-racing.vishalpandey.co.in/
-- Tetris: https://tetris.vishalpandey.co.in/
-- Rock Paper Scissors: https://rock-paper-scissor.vishalpandey.co.in/
-
-## EDUCATION 📚
-
-### B.Tech + M.Tech (Integrated) - Computer Science Engineering
-- University: Gautam Buddha University, Greater Noida
-- Duration: August 2015 - August 2020
-- M.Tech Specialization: Artificial Intelligence and Robotics
-- CGPA: 8.0/10.0
-
-### Higher Secondary (12th)
-- School: R.P.V.V No.1, Raj Niwas Marg, Delhi
-- Duration: April 2013 - May 2014
-- Marks: 85.6%
-
-## CONTACT INFORMATION 📱
-- Email: contact@vishalpandey.co.in
-- Phone: +91 97171 30893
-- Website: https://www.vishalpandey.co.in
-- LinkedIn: https://linkedin.com/in/thevishalpandey
-- GitHub: https://github.com/vishal-pandey
-- YouTube: https://www.youtube.com/@pandeyvishal
-
-## AVAILABILITY (Open For)
-- Technical Leadership Roles
-- Consulting & Advisory
-- Product Development
-- Speaking Engagements
-- Collaborations
-- Mentorship
-
-## HOBBIES & INTERESTS 🎯
-- Photography & Videography (the artsy side)
-- YouTube content creation
-- Game development
-- Building fun web experiments at 3am
-- Exploring emerging technologies
-- Mass producing projects (most work, some don't, we don't talk about those)
-- Mass refactoring code at ungodly hours
-
-## FUN FACTS FOR "SURPRISE ME" 🎲
-- This AI runs on a MacBook hiding in his closet (the "homelab")
-- He's mass produced more projects than he can count
-- Built a neural network in pure JavaScript because... kuch bhi
-- Has refactored codebases at 3am with zero regrets (okay, some regrets)
-- Started a startup from his college room - mass chaos, mass fun
-- Looking for help with: Money. Paise chahiye bhai dedo (jk... unless?)
-
-## ROAST MATERIAL 🔥 (Use Wisely)
-- 5 years of experience but still googles how to center a div
-- Has a "homelab" that's literally one MacBook in a closet
-- Specialized in AI & Robotics, ended up making to-do apps
-- Founded a startup, didn't become a billionaire, still writes code (tragic)
-- Mass builds projects, mass abandons them - the graveyard of side projects
-- "Technical Lead" = fancy way of saying "the one who fixes everyone's bugs"
-- Integrated B.Tech + M.Tech = couldn't decide when to leave college
-
-## EXAMPLE RESPONSES (Match This Vibe):
-
-Q: "Who is Vishal?" 
-A: Technical Lead at Lumiq who builds data platforms by day and retro games by night. 5+ years of experience, founded a startup, and mass produces code like it's going out of style. 🚀
-
-Q: "What's his tech stack?"
-A: Node.js, Python, Angular for code; AWS, Docker, Kubernetes for cloud; Kafka, RabbitMQ for streaming. Full-stack plus cloud-native - ek dum pro setup.
-
-Q: "Tell me about his work experience"
-A: Started with his own IoT startup AirTrik (2019-20), then built LimeChat's AI help desk from scratch as Technical Product Lead (2020-22), and now leads emPower pryzm at Lumiq. Basically went from founder to tech lead - the classic journey!
-
-Q: "What projects has he built?"
-A: Professionally - data platforms at Lumiq, AI help desk at LimeChat, IoT platform at AirTrik. For fun - P2P serverless chat, NFC business cards (HiCard), and retro games. The man doesn't stop building.
-
-Q: "Roast him"
-A: Bhai ne IoT startup banaya college mein, AI mein specialization kiya, aur ab data platforms bana raha hai. Career choices went for a full 360. Still googles how to center a div after 5 years! 😂
-
-Q: "Tell me something fun/surprise me"
-A: This AI is literally running on a MacBook stuffed in Vishal's closet. That's his entire "homelab". Peak engineering right there.
-
-Q: "What's his education?"
-A: B.Tech + M.Tech (Integrated) from Gautam Buddha University (2015-2020) with specialization in AI & Robotics. CGPA 8.0 - consistent performer, not a topper.
-
-Q: "How can I contact him?"
-A: Email: contact@vishalpandey.co.in | Phone: +91 97171 30893 | LinkedIn: linkedin.com/in/thevishalpandey | GitHub: github.com/vishal-pandey
-
-Q: "Email?" / "Phone?" / "LinkedIn?"
-A: contact@vishalpandey.co.in (just give the direct answer, no extra text)
-
-Q: "Hi" / "Hello"
-A: Hey! Ask me anything about Vishal - his work, projects, skills, or I can roast him for you. Your call! 👋
-
-Q: "What weird projects has he built?"
-A: Made Tetris and Car Racing in vanilla JS, a P2P serverless chat that needs zero backend, and NFC business cards. Procrastination hits different when you're a developer.
-
-Q: "Tell me about LimeChat"
-A: At LimeChat, Vishal was Technical Product Lead where he built their entire AI help desk from scratch. Managed 10 people, ran 20+ sprints, and launched on Shopify, Android, and iOS. The product helps e-commerce stores handle customer support with AI. 💼
-
-Q: "Tell me about Lumiq"
-A: He's currently Technical Lead at Lumiq, building emPower pryzm - a data reliability platform for banks and financial services. Built the tech stack for 2 products from scratch, leads multiple teams. Even got featured in PR Newswire!
-
-Q: "What are his skills?" (detailed version)
-A: Full-stack dev (Node.js, Python, Angular), cloud-native (AWS, Docker, K8s, ArgoCD), real-time streaming (Kafka, RabbitMQ), plus leadership skills - managed 10+ people teams, ran 20+ sprints. Oh and he can write IoT firmware in C too!
-""",
+7. **STICK TO THE DATA** - Only use information from this instruction. No guessing, no making up facts."""
+
+RETRIEVAL_INSTRUCTION = """## KNOWLEDGE BASE 🔎
+Everything you know about Vishal - work experience, skills, projects, education, contact details, hobbies, fun facts, roast material and example answers - is in his knowledge base, not in this instruction.
+
+- ALWAYS call the `search_knowledge` tool with the user's question before answering anything about Vishal
+- Treat the returned snippets as "the data" from the rules above: only state facts that appear in them
+- Snippets titled "Example answer" show the expected tone and length - match that vibe
+- If the snippets don't cover the question, say you don't have that information
+"""
+
+# Vishal's bio, skills, projects and example Q&A live in knowledge.json
+KNOWLEDGE = load_knowledge()
+KNOWLEDGE_INSTRUCTION = render_knowledge(KNOWLEDGE)
+EXAMPLES_INSTRUCTION = render_examples(KNOWLEDGE)
+
+FULL_INSTRUCTION = "\n\n".join([PERSONA_INSTRUCTION, KNOWLEDGE_INSTRUCTION, EXAMPLES_INSTRUCTION])
+
+KNOWLEDGE_TOP_K = int(os.environ.get("KNOWLEDGE_TOP_K", "4"))
+
+if PROMPT_MODE == "retrieval":
+    # Built once at startup; with gunicorn --preload the workers share it
+    knowledge_index = KnowledgeIndex(
+        KNOWLEDGE,
+        embed_model=os.environ.get("KNOWLEDGE_EMBED_MODEL") or None,
+    )
+    
+    async def search_knowledge(query: str) -> dict:
+        """Search Vishal's knowledge base (experience, skills, projects, education, contact, fun facts, example answers).
+
+        Args:
+            query: The user's question, in their own words.
+
+        Returns:
+            A dict with the most relevant knowledge snippets.
+        """
+        docs = await knowledge_index.asearch(query, top_k=KNOWLEDGE_TOP_K)
+        return {"snippets": [{"title": doc.title, "text": doc.text} for doc in docs]}
+    
+    INSTRUCTION = "\n\n".join([PERSONA_INSTRUCTION, RETRIEVAL_INSTRUCTION])
+    TOOLS = [search_knowledge]
+else:
+    INSTRUCTION = FULL_INSTRUCTION
+    TOOLS = []
+
+# ============================================
+# Create the ADK Agent
+# ============================================
+
+root_agent = Agent(
+    name="vishal_assistant",
+    model=LiteLlm(
+        model=MODEL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        # One long-lived connection pool per worker (see ollama.py)
+        client=http_client(),
+        **({"llm_client": llm_client} if llm_client else {}),
+    ),
+    description="Vishal's witty AI sidekick - knows everything about him, answers with humor, and occasionally roasts him",
+    instruction=INSTRUCTION,
+    tools=TOOLS,
+    # Bound the replayed session history (see history.py), time model calls (see metrics.py),
+    # apply the turn's generation budget (see budgets.py)
+    before_model_callback=[
+        *([compact_history] if history_compaction_enabled() else []),
+        llm_metrics_before,
+        *([apply_budget] if GENERATION_BUDGETS else []),
+    ],
+    after_model_callback=[llm_metrics_after, *([budget_after] if GENERATION_BUDGETS else [])],
 )
 
 # ============================================
@@ -288,20 +174,27 @@ A: Full-stack dev (Node.js, Python, Angular), cloud-native (AWS, Docker, K8s, Ar
 
 # This creates an A2A-compatible ASGI app that can be served via uvicorn
 # The agent card is auto-generated from the agent's name, description, etc.
-def create_a2a_app(port: int = 8001):
+def create_a2a_app(port: int = 8001, url: str | None = None, runner=None, task_store=None, agent_executor_factory=None, lifespan=None):
     """Create an A2A application for this agent.
     
+    The API server passes its own runner, task store and executor (see
+    a2a_service.py) and the /a2a/ URL for the agent card. Standalone, the
+    app gets a runner with in-memory sessions and a bounded task store, and
+    the card advertises A2A_PUBLIC_URL or http://localhost:<port>/.
+    
     Usage:
         uvicorn vishal_agent.agent:a2a_app --host localhost --port 8001
     """
     from google.adk.a2a.utils.agent_to_a2a import to_a2a
     from a2a.types import AgentCard, AgentCapabilities
+    from .a2a_service import A2A_PUBLIC_URL, create_task_store, task_store_lifespan
+    from .db import database_url
     
     # Create agent card with streaming enabled
     agent_card = AgentCard(
         name=root_agent.name,
         description=root_agent.description,
-        url=f"http://localhost:{port}",
+        url=url or A2A_PUBLIC_URL or f"http://localhost:{port}/",
         version="1.0.0",
         capabilities=AgentCapabilities(
             streaming=True,
@@ -313,7 +206,25 @@ def create_a2a_app(port: int = 8001):
         skills=[],
     )
     
-    return to_a2a(root_agent, port=port, agent_card=agent_card)
+    if task_store is None:
+        task_store = create_task_store(database_url())
+        lifespan = lifespan or task_store_lifespan(task_store)
+    
+    return to_a2a(
+        root_agent,
+        port=port,
+        agent_card=agent_card,
+        runner=runner,
+        task_store=task_store,
+        agent_executor_factory=agent_executor_factory,
+        lifespan=lifespan,
+    )
 
-# Create the A2A app instance for uvicorn
-a2a_app = create_a2a_app()
+# The A2A app instance for uvicorn, built on first access so importing the
+# agent (ADK web, the API server) doesn't pull in the A2A stack
+def __getattr__(name: str):
+    if name == "a2a_app":
+        app = create_a2a_app()
+        globals()["a2a_app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,352 @@
+"""
+Generation Budgets
+
+The instruction asks llama3.2 for 1-2 sentence answers, but nothing made it
+stop: a rambling answer kept the model (and everyone queued behind it) busy
+for as long as it liked. Every model-generated turn now gets a budget:
+
+- max_tokens: sent as max_output_tokens (num_predict for Ollama,
+  max_completion_tokens for llama-server), so the backend itself stops
+- deadline: wall-clock seconds from the moment the turn got its admission
+  slot. The model call's stream is closed at the first chunk past the
+  deadline, which also ends the request to the backend; the answer so far
+  is the turn's answer. A call with no first chunk (or, not streamed, no
+  response) by the deadline has no answer to keep: it is cancelled and
+  fails with a TimeoutError
+- stop: stop sequences, by default the fake next turns a small model tends
+  to invent ("\\nUser:")
+
+Budgets per request class:
+
+- Per endpoint: BUDGET_MAX_TOKENS / BUDGET_DEADLINE / BUDGET_STOP, with
+  overrides per endpoint in BUDGET_ENDPOINTS (JSON, e.g. a larger budget
+  for run_batch)
+- Per intent: a message close to one of the curated example questions
+  (score >= BUDGET_INTENT_THRESHOLD) gets BUDGET_INTENT_FACTOR times the
+  length of the curated answer, or what BUDGET_INTENTS sets for the intent
+- Under load: with N requests waiting for an admission slot, max_tokens and
+  the deadline shrink linearly down to BUDGET_MIN_SCALE at
+  BUDGET_TIGHTEN_QUEUE waiting requests, so the queue drains faster
+
+The budget travels in RunConfig.custom_metadata (and so ends up on the
+turn's events); the callbacks below apply it to each model call. Turns
+without one (A2A, adk web) get the default budget. A cut answer's final
+event carries custom_metadata["truncated"] = "max_tokens" | "deadline", and
+the endpoints report it as "truncated" / "truncated_by". Truncated answers
+are not stored in the response cache.
+
+Tokens saved are estimated per cut call: a call closed at the deadline
+saves what was left of its max_tokens, a call cut at max_tokens saves
+BUDGET_TAIL_TOKENS (how much longer a cut answer would have run; measure
+it with benchmarks/budgets.py). They are counted in
+agent_generation_tokens_saved_total and under "tokens_saved" in /stats.
+
+GENERATION_BUDGETS=0 turns all of this off.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from google.adk.models.lite_llm import LiteLLMClient
+from google.genai import types
+
+from .faq import FaqIndex
+from .history import estimate_tokens
+from .metrics import (
+    GENERATION_BUDGET_TOKENS,
+    GENERATION_SECONDS,
+    GENERATION_TOKENS,
+    GENERATION_TOKENS_SAVED,
+    GENERATION_TRUNCATIONS,
+)
+
+GENERATION_BUDGETS = os.environ.get("GENERATION_BUDGETS", "1").lower() not in ("0", "off", "false")
+BUDGET_MAX_TOKENS = int(os.environ.get("BUDGET_MAX_TOKENS", "320"))
+BUDGET_MIN_TOKENS = int(os.environ.get("BUDGET_MIN_TOKENS", "48"))
+BUDGET_DEADLINE = float(os.environ.get("BUDGET_DEADLINE", "60"))
+BUDGET_STOP = json.loads(os.environ.get("BUDGET_STOP") or '["\\nUser:", "\\nVisitor:"]')
+BUDGET_ENDPOINTS = json.loads(os.environ.get("BUDGET_ENDPOINTS") or '{"run_batch": {"max_tokens": 512, "deadline": 120}}')
+BUDGET_INTENTS = json.loads(os.environ.get("BUDGET_INTENTS") or "{}")
+BUDGET_INTENT_THRESHOLD = float(os.environ.get("BUDGET_INTENT_THRESHOLD", "0.5"))
+BUDGET_INTENT_FACTOR = float(os.environ.get("BUDGET_INTENT_FACTOR", "3"))
+BUDGET_MIN_SCALE = float(os.environ.get("BUDGET_MIN_SCALE", "0.5"))
+BUDGET_TIGHTEN_QUEUE = int(os.environ.get("BUDGET_TIGHTEN_QUEUE", "8"))
+BUDGET_TAIL_TOKENS = int(os.environ.get("BUDGET_TAIL_TOKENS", "160"))
+
+# Endpoint label for turns that didn't come with a budget
+OTHER_ENDPOINT = "other"
+
+
+@dataclass
+class Budget:
+    name: str
+    endpoint: str
+    max_tokens: int
+    deadline: float
+    stop: list[str] = field(default_factory=list)
+    scale: float = 1.0
+
+    def metadata(self) -> dict:
+        """RunConfig.custom_metadata["budget"] (JSON, it is stored with the events)."""
+        return {
+            "class": self.name,
+            "endpoint": self.endpoint,
+            "max_tokens": self.max_tokens,
+            "deadline_at": round(time.time() + self.deadline, 3),
+            "stop": self.stop,
+            "scale": round(self.scale, 3),
+        }
+
+
+def endpoint_budget(endpoint: str) -> Budget:
+    """The default budget with the BUDGET_ENDPOINTS overrides of an endpoint."""
+    override = BUDGET_ENDPOINTS.get(endpoint, {})
+    return Budget(
+        name=endpoint,
+        endpoint=endpoint,
+        max_tokens=int(override.get("max_tokens", BUDGET_MAX_TOKENS)),
+        deadline=float(override.get("deadline", BUDGET_DEADLINE)),
+        stop=list(override.get("stop", BUDGET_STOP)),
+    )
+
+
+def load_scale(queued: int) -> float:
+    """1.0 with an empty queue, BUDGET_MIN_SCALE from BUDGET_TIGHTEN_QUEUE waiting requests on."""
+    if BUDGET_TIGHTEN_QUEUE <= 0 or queued <= 0:
+        return 1.0
+    return 1.0 - (1.0 - BUDGET_MIN_SCALE) * min(1.0, queued / BUDGET_TIGHTEN_QUEUE)
+
+
+class BudgetStats:
+    """Per-worker counters for /stats."""
+
+    def __init__(self):
+        self.classes: Counter = Counter()
+        self.tightened = 0
+        self.calls = 0
+        self.truncated: Counter = Counter()
+        self.tokens_out = 0
+        self.tokens_saved = 0
+
+    def granted(self, budget: Budget) -> None:
+        self.classes[budget.name] += 1
+        if budget.scale < 1.0:
+            self.tightened += 1
+
+    def observe(self, tokens: int, reason: str | None, saved: int = 0) -> None:
+        self.calls += 1
+        self.tokens_out += tokens
+        self.tokens_saved += saved
+        if reason:
+            self.truncated[reason] += 1
+
+    def stats(self) -> dict:
+        return {
+            "turns": sum(self.classes.values()),
+            "tightened": self.tightened,
+            "classes": dict(self.classes.most_common(20)),
+            "calls": self.calls,
+            "truncated": dict(self.truncated),
+            "mean_tokens_out": round(self.tokens_out / self.calls, 1) if self.calls else None,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+budget_stats = BudgetStats()
+
+
+class GenerationBudgets:
+    """Picks a turn's budget from its endpoint, its intent and the queue."""
+
+    def __init__(self, faq_index: FaqIndex):
+        self.faq_index = faq_index
+
+    def intent_max_tokens(self, user_text: str, limit: int) -> tuple[str, int] | None:
+        nearest = self.faq_index.nearest(user_text)
+        if nearest is None or nearest.score < BUDGET_INTENT_THRESHOLD:
+            return None
+        intent = nearest.intent
+        if intent.id in BUDGET_INTENTS:
+            return intent.id, int(BUDGET_INTENTS[intent.id]["max_tokens"])
+        expected = BUDGET_INTENT_FACTOR * estimate_tokens(intent.answer)
+        return intent.id, int(min(limit, max(BUDGET_MIN_TOKENS, expected)))
+
+    def for_request(self, endpoint: str, user_text: str, queued: int = 0) -> Budget:
+        budget = endpoint_budget(endpoint)
+        intent = self.intent_max_tokens(user_text, budget.max_tokens)
+        if intent is not None:
+            budget.name = f"intent:{intent[0]}"
+            budget.max_tokens = intent[1]
+        budget.scale = load_scale(queued)
+        if budget.scale < 1.0:
+            budget.max_tokens = max(BUDGET_MIN_TOKENS, round(budget.max_tokens * budget.scale))
+            budget.deadline *= budget.scale
+        budget_stats.granted(budget)
+        GENERATION_BUDGET_TOKENS.labels(endpoint).observe(budget.max_tokens)
+        return budget
+
+    def stats(self) -> dict:
+        return {
+            "max_tokens": BUDGET_MAX_TOKENS,
+            "deadline": BUDGET_DEADLINE,
+            "endpoints": BUDGET_ENDPOINTS,
+            "tighten_queue": BUDGET_TIGHTEN_QUEUE,
+            "min_scale": BUDGET_MIN_SCALE,
+            "tail_tokens": BUDGET_TAIL_TOKENS,
+            **budget_stats.stats(),
+        }
+
+
+def create_generation_budgets(examples: list[dict], faq_index: FaqIndex | None) -> GenerationBudgets | None:
+    """Budgets from BUDGET_* environment variables, or None with GENERATION_BUDGETS=0."""
+    if not GENERATION_BUDGETS:
+        return None
+    return GenerationBudgets(faq_index or FaqIndex(examples, threshold=1.0))
+
+
+def truncation_flags(event) -> dict:
+    """{"truncated": ...} for a final event of a budgeted turn, {} otherwise (canned answers)."""
+    metadata = getattr(event, "custom_metadata", None) or {}
+    if "budget" not in metadata:
+        return {}
+    reason = metadata.get("truncated")
+    return {"truncated": True, "truncated_by": reason} if reason else {"truncated": False}
+
+
+# ============================================
+# Model call callbacks and deadline
+# ============================================
+
+class _BudgetCall:
+    def __init__(self, budget: dict, max_tokens: int):
+        self.endpoint = budget["endpoint"]
+        self.max_tokens = max_tokens
+        self.deadline_at = budget["deadline_at"]
+        self.start = time.perf_counter()
+        self.deadline_hit = False
+
+
+_budget_call: ContextVar[_BudgetCall | None] = ContextVar("budget_call", default=None)
+
+
+def apply_budget(callback_context, llm_request):
+    """before_model_callback: the turn's max tokens and stop sequences on the request."""
+    run_config = callback_context.run_config
+    budget = (run_config.custom_metadata or {}).get("budget") if run_config else None
+    if budget is None:
+        budget = endpoint_budget(OTHER_ENDPOINT).metadata()
+    config = llm_request.config
+    config.max_output_tokens = min(config.max_output_tokens or budget["max_tokens"], budget["max_tokens"])
+    if budget["stop"]:
+        config.stop_sequences = list(dict.fromkeys([*(config.stop_sequences or []), *budget["stop"]]))
+    _budget_call.set(_BudgetCall(budget, config.max_output_tokens))
+    return None
+
+
+def tokens_saved(call: _BudgetCall, tokens: int, reason: str) -> int:
+    """Estimated tokens a cut call didn't generate (see the module docstring)."""
+    if reason == "deadline":
+        return max(0, call.max_tokens - tokens)
+    return BUDGET_TAIL_TOKENS
+
+
+def record_cut(call: _BudgetCall, tokens: int, reason: str) -> None:
+    saved = tokens_saved(call, tokens, reason)
+    GENERATION_TRUNCATIONS.labels(call.endpoint, reason).inc()
+    GENERATION_TOKENS_SAVED.labels(call.endpoint, reason).inc(saved)
+    budget_stats.observe(tokens, reason, saved)
+
+
+def budget_after(callback_context, llm_response):
+    """after_model_callback: mark cut answers and record what the call produced."""
+    call = _budget_call.get()
+    if call is None or llm_response.partial:
+        return None
+    _budget_call.set(None)
+    reason = None
+    if call.deadline_hit:
+        reason = "deadline"
+    elif llm_response.finish_reason == types.FinishReason.MAX_TOKENS:
+        reason = "max_tokens"
+        # Hitting the budget is the expected outcome, not a failed call
+        llm_response.error_code = None
+        llm_response.error_message = None
+    if reason:
+        llm_response.custom_metadata = {**(llm_response.custom_metadata or {}), "truncated": reason}
+
+    usage = llm_response.usage_metadata
+    if usage is not None and usage.candidates_token_count:
+        tokens = usage.candidates_token_count
+    else:
+        # A closed stream never reports usage
+        parts = llm_response.content.parts if llm_response.content else None
+        tokens = estimate_tokens("".join(part.text or "" for part in parts or []))
+    truncated = "true" if reason else "false"
+    GENERATION_TOKENS.labels(call.endpoint, truncated).observe(tokens)
+    GENERATION_SECONDS.labels(call.endpoint, truncated).observe(time.perf_counter() - call.start)
+    if reason:
+        record_cut(call, tokens, reason)
+    else:
+        budget_stats.observe(tokens, None)
+    return None
+
+
+class BudgetedClient(LiteLLMClient):
+    """LiteLLM client that holds a model call to the turn's deadline.
+
+    Wraps the router / llama.cpp client, or LiteLLM itself when there is none.
+    """
+
+    def __init__(self, inner: LiteLLMClient | None = None):
+        self.inner = inner
+
+    async def _acompletion(self, model: Any, messages: Any, tools: Any, **kwargs: Any):
+        if self.inner is not None:
+            return await self.inner.acompletion(model, messages, tools, **kwargs)
+        return await super().acompletion(model, messages, tools, **kwargs)
+
+    async def acompletion(self, model: Any, messages: Any, tools: Any, **kwargs: Any):
+        call = _budget_call.get()
+        if call is None:
+            return await self._acompletion(model, messages, tools, **kwargs)
+
+        response = None
+        try:
+            # Until there is a response (or first chunk) there is nothing to keep
+            async with asyncio.timeout(call.deadline_at - time.time()):
+                response = await self._acompletion(model, messages, tools, **kwargs)
+                if not kwargs.get("stream"):
+                    return response
+                chunks = response.__aiter__()
+                first = await chunks.__anext__()
+        except StopAsyncIteration:
+            return self._until_deadline(response, chunks, None, call)
+        except TimeoutError:
+            if response is not None and hasattr(response, "aclose"):
+                await response.aclose()
+            call.deadline_hit = True
+            record_cut(call, 0, "deadline")
+            raise TimeoutError(f"No answer within the {call.endpoint} deadline") from None
+        return self._until_deadline(response, chunks, first, call)
+
+    async def _until_deadline(self, stream, chunks, first, call: _BudgetCall):
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in chunks:
+                # Checked per chunk: precise to one inter-token gap, no timer per token
+                if time.time() >= call.deadline_at:
+                    call.deadline_hit = True
+                    return
+                yield chunk
+        finally:
+            # Ends the request, so the backend stops generating too
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
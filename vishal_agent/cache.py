@@ -0,0 +1,317 @@
+"""
+Response Cache for Repeated Portfolio Questions
+
+Most traffic is the same handful of questions ("what are his skills?",
+"where does he work?"). This module caches final answers so repeated
+questions skip the Ollama generation entirely.
+
+Lookup tiers:
+1. Exact - sha256 of the normalized message + a fingerprint of the agent
+   instruction and model (so editing the prompt invalidates the cache)
+2. Near-duplicate - character trigram Jaccard similarity against cached
+   questions, above RESPONSE_CACHE_SIMILARITY
+
+Backends:
+- memory   - per-process LRU with TTL (default)
+- postgres - shared table in DATABASE_URL, so all gunicorn workers share hits
+- off      - disable caching
+"""
+
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+# ============================================
+# Normalization & Similarity
+# ============================================
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace."""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def trigrams(normalized: str) -> frozenset[str]:
+    """Character trigrams of a normalized message (padded so short words count)."""
+    padded = f"  {normalized} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a: frozenset[str], b: frozenset[str]) -> float:
+    """Jaccard similarity between two trigram sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def prompt_fingerprint(instruction: str, model: str) -> str:
+    """Short hash identifying the prompt/model pair an answer was produced by."""
+    digest = hashlib.sha256(f"{model}\n{instruction}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def replay_chunks(text: str) -> list[str]:
+    """Split a cached answer into token-like pieces for SSE replay."""
+    return re.findall(r"\s*\S+", text) or [text]
+
+
+# ============================================
+# Backends
+# ============================================
+
+@dataclass
+class CacheEntry:
+    key: str
+    normalized: str
+    response: str
+    created_at: float = field(default_factory=time.time)
+    grams: frozenset[str] = field(default=frozenset(), compare=False)
+
+    def __post_init__(self):
+        if not self.grams:
+            self.grams = trigrams(self.normalized)
+
+
+class MemoryCacheBackend:
+    """Per-process LRU with TTL (not shared between workers)."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.ttl > 0 and time.time() - entry.created_at > self.ttl
+
+    async def get(self, key: str) -> CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, entry: CacheEntry) -> None:
+        self._entries[entry.key] = entry
+        self._entries.move_to_end(entry.key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def candidates(self) -> list[CacheEntry]:
+        for key in [k for k, e in self._entries.items() if self._expired(e)]:
+            del self._entries[key]
+        return list(self._entries.values())
+
+    async def size(self) -> int:
+        return len(self._entries)
+
+
+class PostgresCacheBackend:
+    """Shared cache table in the session database (all workers see each other's hits)."""
+
+    TABLE = "response_cache"
+
+    def __init__(self, db_url: str, fingerprint: str, max_entries: int, ttl: float):
+        from .db import get_engine
+
+        self.engine = get_engine(db_url)
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._ready = False
+
+    async def _prepare(self, conn) -> None:
+        from sqlalchemy import text
+
+        if self._ready:
+            return
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+            " cache_key TEXT PRIMARY KEY,"
+            " fingerprint TEXT NOT NULL,"
+            " normalized TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at DOUBLE PRECISION NOT NULL,"
+            " last_hit_at DOUBLE PRECISION NOT NULL)"
+        ))
+        self._ready = True
+
+    def _cutoff(self) -> float:
+        return time.time() - self.ttl if self.ttl > 0 else 0.0
+
+    async def get(self, key: str) -> CacheEntry | None:
+        from sqlalchemy import text
+
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            row = (await conn.execute(
+                text(
+                    f"UPDATE {self.TABLE} SET last_hit_at = :now"
+                    " WHERE cache_key = :key AND created_at > :cutoff"
+                    " RETURNING cache_key, normalized, response, created_at"
+                ),
+                {"key": key, "now": time.time(), "cutoff": self._cutoff()},
+            )).first()
+        return CacheEntry(*row) if row else None
+
+    async def set(self, entry: CacheEntry) -> None:
+        from sqlalchemy import text
+
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            await conn.execute(
+                text(
+                    f"INSERT INTO {self.TABLE}"
+                    " (cache_key, fingerprint, normalized, response, created_at, last_hit_at)"
+                    " VALUES (:key, :fp, :normalized, :response, :now, :now)"
+                    " ON CONFLICT (cache_key) DO UPDATE SET"
+                    " response = EXCLUDED.response, created_at = EXCLUDED.created_at,"
+                    " last_hit_at = EXCLUDED.last_hit_at"
+                ),
+                {
+                    "key": entry.key,
+                    "fp": self.fingerprint,
+                    "normalized": entry.normalized,
+                    "response": entry.response,
+                    "now": entry.created_at,
+                },
+            )
+            # Evict expired rows, rows from older prompts, and the LRU tail
+            await conn.execute(
+                text(
+                    f"DELETE FROM {self.TABLE} WHERE fingerprint <> :fp"
+                    " OR created_at <= :cutoff"
+                    f" OR cache_key IN (SELECT cache_key FROM {self.TABLE}"
+                    " ORDER BY last_hit_at DESC OFFSET :max_entries)"
+                ),
+                {"fp": self.fingerprint, "cutoff": self._cutoff(), "max_entries": self.max_entries},
+            )
+
+    async def candidates(self) -> list[CacheEntry]:
+        from sqlalchemy import text
+
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            rows = (await conn.execute(
+                text(
+                    f"SELECT cache_key, normalized, response, created_at FROM {self.TABLE}"
+                    " WHERE fingerprint = :fp AND created_at > :cutoff"
+                    " ORDER BY last_hit_at DESC LIMIT :max_entries"
+                ),
+                {"fp": self.fingerprint, "cutoff": self._cutoff(), "max_entries": self.max_entries},
+            )).all()
+        return [CacheEntry(*row) for row in rows]
+
+    async def size(self) -> int:
+        from sqlalchemy import text
+
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            return (await conn.execute(text(f"SELECT COUNT(*) FROM {self.TABLE}"))).scalar_one()
+
+
+# ============================================
+# Response Cache
+# ============================================
+
+class ResponseCache:
+    """Exact + near-duplicate answer cache for stateless (first-turn) questions."""
+
+    def __init__(self, backend, fingerprint: str, similarity_threshold: float = 0.85):
+        self.backend = backend
+        self.fingerprint = fingerprint
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def key_for(self, normalized: str) -> str:
+        return hashlib.sha256(f"{self.fingerprint}:{normalized}".encode("utf-8")).hexdigest()
+
+    async def lookup(self, text: str) -> str | None:
+        """Return a cached answer for this message, or None on a miss."""
+        normalized = normalize_message(text)
+        if not normalized:
+            return None
+        try:
+            entry = await self.backend.get(self.key_for(normalized))
+            if entry is not None:
+                self.hits += 1
+                return entry.response
+
+            if self.similarity_threshold > 0:
+                grams = trigrams(normalized)
+                best, best_score = None, 0.0
+                for candidate in await self.backend.candidates():
+                    score = similarity(grams, candidate.grams)
+                    if score > best_score:
+                        best, best_score = candidate, score
+                if best is not None and best_score >= self.similarity_threshold:
+                    self.near_hits += 1
+                    return best.response
+        except Exception as e:
+            # A broken cache must never take down the request path
+            self.errors += 1
+            print(f"⚠️ Response cache lookup failed: {e}")
+            return None
+
+        self.misses += 1
+        return None
+
+    async def store(self, text: str, response: str) -> None:
+        normalized = normalize_message(text)
+        if not normalized or not response:
+            return
+        try:
+            await self.backend.set(CacheEntry(self.key_for(normalized), normalized, response))
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Response cache store failed: {e}")
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.misses
+        try:
+            entries = await self.backend.size()
+        except Exception:
+            entries = None
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": entries,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def create_response_cache(instruction: str, model: str, database_url: str | None) -> ResponseCache | None:
+    """Build the response cache from RESPONSE_CACHE* environment variables."""
+    mode = os.environ.get("RESPONSE_CACHE", "memory").lower()
+    if mode in ("off", "none", "0", "false"):
+        return None
+
+    max_entries = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+    ttl = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+    threshold = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0.85"))
+    fingerprint = prompt_fingerprint(instruction, model)
+
+    if mode == "postgres":
+        if not database_url:
+            print("⚠️ RESPONSE_CACHE=postgres but DATABASE_URL is not set, using memory cache")
+        else:
+            backend = PostgresCacheBackend(database_url, fingerprint, max_entries, ttl)
+            return ResponseCache(backend, fingerprint, threshold)
+
+    return ResponseCache(MemoryCacheBackend(max_entries, ttl), fingerprint, threshold)
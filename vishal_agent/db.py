@@ -0,0 +1,105 @@
+"""
+Database Engine and Connection Pool
+
+One async SQLAlchemy engine per worker, shared by the session store, the
+Postgres response cache and the cross-worker single-flight lock, so the
+connection budget is easy to reason about:
+
+    connections = replicas x WORKERS x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+which has to stay below Postgres' max_connections (100 by default).
+
+Pool settings come from DB_* environment variables. With asyncpg, statement
+caching is configurable too (set DB_STATEMENT_CACHE_SIZE=0 behind pgbouncer
+in transaction mode, which cannot keep prepared statements).
+
+SESSION_STORE=sqlite runs the same code path against a local SQLite file
+(aiosqlite) when there is no Postgres, e.g. for load tests on a laptop.
+"""
+
+import os
+import time
+from functools import cache
+
+SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH", "sessions.db")
+
+
+def database_url() -> str | None:
+    """DATABASE_URL, or the SQLite stand-in when SESSION_STORE=sqlite."""
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return url
+    if os.environ.get("SESSION_STORE", "").lower() == "sqlite":
+        return f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    return None
+
+
+def engine_options(url: str) -> dict:
+    """create_async_engine keyword arguments from DB_* environment variables."""
+    options = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "5")),
+        # Fail fast instead of piling up behind gunicorn's TIMEOUT
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+        # Recycle before Postgres / load balancer idle timeouts cut connections
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1").lower() not in ("0", "off", "false"),
+    }
+    if url.startswith("postgresql+asyncpg"):
+        statement_cache = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "256"))
+        options["connect_args"] = {
+            # SQLAlchemy's per-connection cache of asyncpg prepared statements
+            "prepared_statement_cache_size": statement_cache,
+            # asyncpg's own statement cache (must also be 0 behind pgbouncer)
+            "statement_cache_size": statement_cache,
+        }
+    elif url.startswith("sqlite"):
+        # Wait for the file lock instead of failing under concurrent writers
+        options["connect_args"] = {"timeout": 30}
+    return options
+
+
+@cache
+def get_engine(url: str):
+    """The shared async engine for url (created once per worker)."""
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from .metrics import instrument_engine
+
+    engine = create_async_engine(url, **engine_options(url))
+    instrument_engine(engine)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine.sync_engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+    return engine
+
+
+async def pool_health(engine) -> dict:
+    """Pool occupancy plus a round-trip check against the database."""
+    from sqlalchemy import text
+
+    pool = engine.pool
+    health = {
+        "dialect": engine.dialect.name,
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "max_overflow": getattr(pool, "_max_overflow", None),
+    }
+    start = time.perf_counter()
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        health["status"] = "healthy"
+    except Exception as e:
+        health["status"] = "unhealthy"
+        health["error"] = str(e)
+    health["ping_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return health
@@ -0,0 +1,229 @@
+"""
+Event Loop Diagnostics
+
+Everything a worker serves runs on one event loop, so any synchronous work
+on it (prints, json.dumps and model_dump() per event, a blocking call inside
+LiteLLM or a callback) stalls every other stream of that worker. Three
+tools, cheap enough to leave on in production:
+
+- Lag monitor: a task sleeps LOOP_MONITOR_INTERVAL seconds at a time and
+  records how late it wakes up (agent_event_loop_lag_seconds). Lag means
+  something held the loop
+- Stall watchdog: a thread checks the monitor's heartbeat. When the loop
+  has not run it for LOOP_STALL_THRESHOLD seconds, it logs the loop
+  thread's stack while the stall is still going on, so the log shows what
+  blocked it (at most one stack per LOOP_STALL_LOG_INTERVAL seconds; every
+  stall is counted in agent_event_loop_stalls_total and the latest are in
+  /stats)
+- Sampling profiler: GET /admin/profile?seconds=10 samples the stacks of a
+  live worker every interval_ms for a bounded time (PROFILE_MAX_SECONDS) and
+  returns them in the collapsed format flamegraph.pl, speedscope and
+  inferno read. One profile at a time per worker; the endpoint needs
+  ADMIN_TOKEN (X-Admin-Token header) and is off without it
+
+The sampler and the watchdog only read sys._current_frames() from their own
+thread; nothing is traced or instrumented on the loop itself.
+
+    curl -H "X-Admin-Token: $ADMIN_TOKEN" "localhost:8000/admin/profile?seconds=15" > worker.folded
+    flamegraph.pl worker.folded > worker.svg
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from functools import lru_cache
+
+from .metrics import LOOP_LAG_SECONDS, LOOP_STALLS
+
+LOOP_MONITOR = os.environ.get("LOOP_MONITOR", "1").lower() not in ("0", "off", "false")
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "0.25"))
+LOOP_STALL_LOG_INTERVAL = float(os.environ.get("LOOP_STALL_LOG_INTERVAL", "10"))
+LOOP_STALL_STACK_DEPTH = int(os.environ.get("LOOP_STALL_STACK_DEPTH", "30"))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Innermost Python frames of a loop waiting for I/O (uvloop waits in C, below
+# the frame that started the loop)
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("runners.py", "run"),
+    ("base_events.py", "run_forever"),
+    ("base_events.py", "run_until_complete"),
+}
+
+
+@lru_cache(maxsize=4096)
+def short_path(filename: str) -> str:
+    """A file name relative to the sys.path entry it was imported from."""
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    return filename[len(best):].lstrip(os.sep) if best else filename
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({short_path(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapsed_stack(frame) -> list[str]:
+    """Frame labels from the outermost call to frame."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+# ============================================
+# Lag monitor and stall watchdog
+# ============================================
+
+class LoopMonitor:
+    """Measures the worker's event loop lag and dumps the stack of long stalls."""
+
+    def __init__(
+        self,
+        interval: float = LOOP_MONITOR_INTERVAL,
+        stall_threshold: float = LOOP_STALL_THRESHOLD,
+        log_interval: float = LOOP_STALL_LOG_INTERVAL,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.log_interval = log_interval
+        self.thread_id: int | None = None
+        self.heartbeat = time.monotonic()
+        self.max_lag = 0.0
+        self.lag_total = 0.0
+        self.ticks = 0
+        self.stalls = 0
+        self.stacks_logged = 0
+        self.recent: deque[dict] = deque(maxlen=10)
+        # Where the loop was when the watchdog caught the current stall
+        self._caught: str | None = None
+        self._last_log = float("-inf")
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start on the running loop (server lifespan)."""
+        self.thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._tick())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _tick(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - start - self.interval, 0.0)
+            self.heartbeat = now
+            self.ticks += 1
+            self.lag_total += lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.stall_threshold:
+                self.stalls += 1
+                LOOP_STALLS.inc()
+                self.recent.append({"at": round(time.time(), 3), "seconds": round(lag, 3), "where": self._caught})
+            self._caught = None
+
+    def _watch(self) -> None:
+        """Watchdog thread: catch the loop thread's stack while a stall is going on."""
+        while not self._stop.wait(self.stall_threshold / 2):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled < self.stall_threshold or self._caught is not None:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self._caught = frame_label(frame)
+            now = time.monotonic()
+            if now - self._last_log < self.log_interval:
+                continue
+            self._last_log = now
+            self.stacks_logged += 1
+            stack = "".join(traceback.format_stack(frame, limit=LOOP_STALL_STACK_DEPTH))
+            print(f"🐢 Event loop blocked for {stalled:.2f}s+, loop thread is at:\n{stack}", flush=True)
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "stall_threshold": self.stall_threshold,
+            "mean_lag_ms": round(self.lag_total / self.ticks * 1000, 3) if self.ticks else None,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "stalls": self.stalls,
+            "stacks_logged": self.stacks_logged,
+            "recent_stalls": list(self.recent),
+        }
+
+
+def create_loop_monitor() -> LoopMonitor | None:
+    """Lag monitor and stall watchdog, or None with LOOP_MONITOR=0."""
+    if not LOOP_MONITOR:
+        return None
+    return LoopMonitor()
+
+
+# ============================================
+# Sampling profiler
+# ============================================
+
+class ProfileBusy(Exception):
+    """Another profile is running in this worker."""
+
+
+_profile_lock = threading.Lock()
+
+
+def sample_stacks(thread_ids: set[int] | None, seconds: float, interval: float, idle: bool) -> tuple[Counter, dict]:
+    """Sample thread stacks (None: all but the sampler) for seconds; (collapsed stacks, counts).
+
+    Runs in its own thread. Stacks are keyed by "thread;outer;...;inner".
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfileBusy("A profile is already running in this worker")
+    try:
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter = Counter()
+        counts = {"samples": 0, "idle": 0}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or (thread_ids is not None and thread_id not in thread_ids):
+                    continue
+                counts["samples"] += 1
+                if is_idle(frame):
+                    counts["idle"] += 1
+                    if not idle:
+                        continue
+                thread = names.get(thread_id) or f"thread-{thread_id}"
+                stacks[";".join([thread, *collapsed_stack(frame)])] += 1
+            time.sleep(interval)
+        return stacks, counts
+    finally:
+        _profile_lock.release()
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed format: one "frame;frame;frame count" line per stack."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
@@ -0,0 +1,287 @@
+"""
+Speculative Drafts
+
+On CPU, llama3.2 spends seconds prefilling the agent instruction before its
+first token, and that wait is what visitors of the portfolio widget notice.
+With drafting on, a streamed answer starts with a draft from a cheaper
+source while the full model is still prefilling:
+
+- faq - the first sentence of the closest FAQ answer, if it is at least
+  DRAFT_FAQ_THRESHOLD similar (closer matches are answered outright by the
+  FAQ fast path)
+- model - a small local model (DRAFT_MODEL) with a short instruction and the
+  closest FAQ answer as context, at most DRAFT_MAX_TOKENS tokens. It is a
+  second generation, so it counts against the turn's admission slot: the
+  draft model is only called once the turn holds its slot, and never runs
+  for a turn that is still queued (or rejected)
+
+DRAFT_SOURCES lists the sources in order of preference (the first one with a
+draft is used), DRAFT_ENDPOINTS the endpoints that draft. A request can opt
+in or out with "draft": true / false.
+
+Draft text is streamed as {"text": ..., "draft": true}. Once the model's
+text arrives the draft stops, and the two are compared word by word:
+
+- the model's answer starts with the draft: {"draft": "accepted"} and the
+  model's text continues where the draft ends, so the answer reads as one
+- otherwise {"draft": "rejected"}: clients drop the draft text, and the
+  model's answer is streamed from its start
+
+The final event always carries the model's complete answer, and drafts
+never enter the session history. agent_drafts_total counts outcomes,
+agent_draft_lead_seconds measures how much earlier the draft's first text
+arrived than the model's; agent_ttft_seconds is the TTFT visitors see.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from typing import AsyncGenerator, AsyncIterator, Callable
+
+from google.adk.events import Event
+from google.genai import types
+
+from .faq import FaqIndex
+from .metrics import DRAFT_LEAD_SECONDS, DRAFTS
+from .ollama import http_client
+
+DRAFT_SOURCES = [s.strip().lower() for s in os.environ.get("DRAFT_SOURCES", "").split(",") if s.strip()]
+DRAFT_ENDPOINTS = {e.strip() for e in os.environ.get("DRAFT_ENDPOINTS", "run_sse").split(",") if e.strip()}
+DRAFT_MODEL = os.environ.get("DRAFT_MODEL", "qwen2.5:0.5b")
+DRAFT_API_BASE = os.environ.get("DRAFT_API_BASE") or os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")
+DRAFT_MAX_TOKENS = int(os.environ.get("DRAFT_MAX_TOKENS", "32"))
+DRAFT_TIMEOUT = float(os.environ.get("DRAFT_TIMEOUT", "10"))
+DRAFT_FAQ_THRESHOLD = float(os.environ.get("DRAFT_FAQ_THRESHOLD", "0.45"))
+
+DRAFT_INSTRUCTION = (
+    "You are the assistant on Vishal Pandey's portfolio website. Answer the visitor's "
+    "question about Vishal in one or two short sentences, in plain text."
+)
+
+SOURCES = ("faq", "model")
+WORD = re.compile(r"\S+")
+SENTENCE = re.compile(r".+?[.!?](?=\s|$)", re.S)
+
+# Pump sentinel: the source is exhausted
+_END = object()
+
+
+def first_sentence(text: str) -> str:
+    match = SENTENCE.match(text.strip())
+    return match.group(0) if match else text.strip()
+
+
+def judge(draft: str, model: str, complete: bool) -> bool | None:
+    """Whether the model's text starts with the draft (None: can't tell yet)."""
+    drafted = draft.split()
+    words = model.split()
+    # The model's last word may still be growing
+    if not complete and words and not model[-1:].isspace():
+        words = words[:-1]
+    for drafted_word, word in zip(drafted, words):
+        if drafted_word != word:
+            return False
+    if len(words) >= len(drafted):
+        return True
+    return False if complete else None
+
+
+def remainder(draft: str, model: str) -> str:
+    """The model's text after the words the draft already showed."""
+    count = len(draft.split())
+    if not count:
+        return model
+    ends = [match.end() for match in WORD.finditer(model)]
+    rest = model[ends[count - 1]:]
+    # Don't repeat the space the draft already ended with
+    return rest.lstrip() if draft[-1:].isspace() else rest
+
+
+def _event_text(event: Event) -> str | None:
+    if not event.content or not event.content.parts:
+        return None
+    return "".join(part.text for part in event.content.parts if getattr(part, "text", None)) or None
+
+
+async def _once(text: str) -> AsyncGenerator[str, None]:
+    yield text
+
+
+async def _pump(queue: asyncio.Queue, tag: str, items: AsyncIterator) -> None:
+    """Forward a source's items (then _END, or the exception it raised) to the queue."""
+    try:
+        async for item in items:
+            queue.put_nowait((tag, item))
+        queue.put_nowait((tag, _END))
+    except Exception as e:
+        queue.put_nowait((tag, e))
+
+
+class Drafter:
+    """Picks a draft source per request and merges the draft into the model's stream."""
+
+    def __init__(self, sources: list[str], endpoints: set[str], faq_index: FaqIndex, keep_alive: str | None = None):
+        self.sources = sources
+        self.endpoints = endpoints
+        self.faq_index = faq_index
+        self.keep_alive = keep_alive
+        self.failures = 0
+
+    def enabled(self, endpoint: str, requested: bool | None = None) -> bool:
+        if requested is not None:
+            return requested
+        return endpoint in self.endpoints
+
+    def source_for(self, user_text: str) -> tuple[str, Callable[[asyncio.Event], AsyncIterator[str]]] | None:
+        """(source name, draft stream factory taking the turn's slot event) for a message, or None."""
+        nearest = self.faq_index.nearest(user_text)
+        context = nearest.intent.answer if nearest and nearest.score >= DRAFT_FAQ_THRESHOLD else None
+        for source in self.sources:
+            if source == "faq" and context:
+                return source, lambda granted: _once(first_sentence(context))
+            if source == "model":
+                return source, lambda granted: self.model_draft(user_text, context, granted)
+        return None
+
+    async def model_draft(self, user_text: str, context: str | None, granted: asyncio.Event) -> AsyncGenerator[str, None]:
+        """Stream a short answer from the draft model, once the turn has its admission slot."""
+        await granted.wait()
+        instruction = DRAFT_INSTRUCTION + (f"\n\nContext: {context}" if context else "")
+        body = {
+            "model": DRAFT_MODEL,
+            "messages": [{"role": "system", "content": instruction}, {"role": "user", "content": user_text}],
+            "stream": True,
+            "options": {"num_predict": DRAFT_MAX_TOKENS},
+        }
+        if self.keep_alive:
+            body["keep_alive"] = self.keep_alive
+        async with http_client().client.stream(
+            "POST", f"{DRAFT_API_BASE}/api/chat", json=body, timeout=DRAFT_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                text = (chunk.get("message") or {}).get("content")
+                if text:
+                    yield text
+                if chunk.get("done"):
+                    return
+
+    async def speculate(
+        self,
+        endpoint: str,
+        source: str,
+        draft: Callable[[asyncio.Event], AsyncIterator[str]],
+        producer: Callable[[asyncio.Event], AsyncIterator],
+    ) -> AsyncGenerator:
+        """The model's stream items, preceded by draft text until the model's own text arrives.
+
+        producer sets the event once the turn holds its admission slot.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        granted = asyncio.Event()
+        tasks = [
+            asyncio.create_task(_pump(queue, "draft", draft(granted))),
+            asyncio.create_task(_pump(queue, "model", producer(granted))),
+        ]
+        drafted = ""
+        draft_at = None
+        judging = False
+        outcome = None
+        held: list[Event] = []
+        model_text = ""
+
+        def decide(accepted: bool) -> list:
+            """Items that settle the draft: the verdict, then the model's text so far."""
+            nonlocal outcome
+            outcome = "accepted" if accepted else "rejected"
+            DRAFTS.labels(endpoint, source, outcome).inc()
+            if not accepted:
+                return [{"draft": "rejected"}, *held]
+            rest = remainder(drafted, model_text)
+            settled: list = [{"draft": "accepted"}]
+            if rest and held:
+                settled.append(held[-1].model_copy(update={
+                    "content": types.Content(role="model", parts=[types.Part(text=rest)]),
+                }))
+            return settled
+
+        try:
+            while True:
+                tag, item = await queue.get()
+                if tag == "draft":
+                    if isinstance(item, Exception):
+                        self.failures += 1
+                        print(f"⚠️ Draft from {source} failed: {item}")
+                    elif item is not _END and not judging and outcome is None:
+                        draft_at = draft_at or time.perf_counter()
+                        drafted += item
+                        yield {"text": item, "draft": True}
+                    continue
+
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                text = _event_text(item) if isinstance(item, Event) else None
+                if outcome is not None or text is None:
+                    # Settled, or not answer text (queue updates, tool calls, errors)
+                    yield item
+                    continue
+
+                if not judging:
+                    judging = True
+                    tasks[0].cancel()
+                    if not drafted:
+                        # The model beat the draft
+                        outcome = "none"
+                        DRAFTS.labels(endpoint, source, outcome).inc()
+                        yield item
+                        continue
+                    DRAFT_LEAD_SECONDS.labels(endpoint).observe(time.perf_counter() - draft_at)
+
+                if item.partial:
+                    held.append(item)
+                    model_text += text
+                    verdict = judge(drafted, model_text, complete=False)
+                    if verdict is not None:
+                        for settled in decide(verdict):
+                            yield settled
+                else:
+                    # Complete answer before the partial text covered the draft
+                    for settled in decide(bool(judge(drafted, text, complete=True))):
+                        yield settled
+                    yield item
+
+            if outcome is None and drafted:
+                # The model produced no text (error, cancelled turn)
+                for settled in decide(False):
+                    yield settled
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "sources": self.sources,
+            "endpoints": sorted(self.endpoints),
+            "model": DRAFT_MODEL if "model" in self.sources else None,
+            "failures": self.failures,
+        }
+
+
+def create_drafter(examples: list[dict], faq_index: FaqIndex | None, keep_alive: str | None = None) -> Drafter | None:
+    """Drafter from DRAFT_* environment variables, or None when DRAFT_SOURCES is empty."""
+    unknown = set(DRAFT_SOURCES) - set(SOURCES)
+    if unknown:
+        raise ValueError(f"Unknown DRAFT_SOURCES: {', '.join(sorted(unknown))}")
+    if not DRAFT_SOURCES:
+        return None
+    # The FAQ fast path may be off; the draft sources still use its index
+    index = faq_index or FaqIndex(examples, threshold=1.0)
+    return Drafter(DRAFT_SOURCES, DRAFT_ENDPOINTS, index, keep_alive=keep_alive)
@@ -0,0 +1,116 @@
+"""
+FAQ Fast Path
+
+The knowledge base already contains a curated list of example Q/A pairs
+("Who is Vishal?", "What are his skills?", ...). Messages that match one of
+those questions closely enough are answered with the stored answer straight
+away, without touching Ollama - milliseconds instead of seconds.
+
+The intent index is compiled once at startup:
+- exact lookup on the normalized question text
+- character trigram similarity (same measure as the response cache) for
+  near matches, accepted above FAQ_THRESHOLD
+
+Examples marked "faq": false in knowledge.json (answers that are really
+instructions for the model) are never served directly.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+
+from .cache import normalize_message, similarity, trigrams
+
+
+@dataclass
+class Intent:
+    id: str
+    questions: list[str]
+    answer: str
+
+
+@dataclass
+class FaqMatch:
+    intent: Intent
+    score: float
+
+
+def example_questions(raw: str) -> list[str]:
+    """Question variants of an example: '"Hi" / "Hello"' -> ['Hi', 'Hello']."""
+    quoted = re.findall(r'"([^"]+)"', raw) or [raw]
+    return [variant.strip() for q in quoted for variant in q.split("/") if variant.strip()]
+
+
+def _slug(text: str) -> str:
+    return normalize_message(text).replace(" ", "-")
+
+
+class FaqIndex:
+    """Precompiled question -> canned answer index."""
+
+    def __init__(self, examples: list[dict], threshold: float):
+        self.threshold = threshold
+        self.intents: list[Intent] = []
+        self._exact: dict[str, Intent] = {}
+        self._grams: list[tuple[frozenset[str], Intent]] = []
+        self.hits: dict[str, int] = {}
+        self.misses = 0
+
+        for example in examples:
+            if not example.get("faq", True):
+                continue
+            questions = example_questions(example["question"])
+            intent = Intent(_slug(questions[0]), questions, example["answer"])
+            self.intents.append(intent)
+            self.hits[intent.id] = 0
+            for question in questions:
+                normalized = normalize_message(question)
+                self._exact[normalized] = intent
+                self._grams.append((trigrams(normalized), intent))
+
+    def nearest(self, text: str) -> FaqMatch | None:
+        """The closest intent for a message, however weak (not counted in the stats)."""
+        normalized = normalize_message(text)
+        return self._nearest(normalized) if normalized else None
+
+    def _nearest(self, normalized: str) -> FaqMatch | None:
+        intent = self._exact.get(normalized)
+        if intent is not None:
+            return FaqMatch(intent, 1.0)
+
+        grams = trigrams(normalized)
+        best, best_score = None, 0.0
+        for intent_grams, intent in self._grams:
+            score = similarity(grams, intent_grams)
+            if score > best_score:
+                best, best_score = intent, score
+        return FaqMatch(best, best_score) if best is not None else None
+
+    def match(self, text: str) -> FaqMatch | None:
+        """Return the best intent for a message if it clears the threshold."""
+        normalized = normalize_message(text)
+        if not normalized:
+            return None
+
+        best = self._nearest(normalized)
+        if best is not None and best.score >= self.threshold:
+            self.hits[best.intent.id] += 1
+            return best
+
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "intents": len(self.intents),
+            "hits": dict(self.hits),
+            "misses": self.misses,
+        }
+
+
+def create_faq_index(examples: list[dict]) -> FaqIndex | None:
+    """Build the FAQ index from FAQ_* environment variables."""
+    if os.environ.get("FAQ_FAST_PATH", "1").lower() in ("0", "off", "false"):
+        return None
+    return FaqIndex(examples, threshold=float(os.environ.get("FAQ_THRESHOLD", "0.8")))
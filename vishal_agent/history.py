@@ -0,0 +1,175 @@
+"""
+Session History Compaction
+
+ADK replays the whole session into every model call, so long chats get
+slower turn after turn on CPU inference (every replayed token has to be
+prefilled again). compact_history runs as the agent's before_model_callback
+and bounds what is sent:
+
+- The last HISTORY_KEEP_TURNS turns are kept verbatim (a turn starts at a
+  user message and includes any tool calls and the answer)
+- Older turns are folded into a short extractive summary (question + first
+  sentence of the answer), or dropped with HISTORY_COMPACTION=drop
+- Everything is kept under HISTORY_TOKEN_BUDGET (estimated tokens); if the
+  recent turns alone exceed it the oldest ones go first, the current turn
+  is always kept
+
+The summary is sent as the first user message rather than appended to the
+system instruction, so the static instruction prefix stays warm in Ollama's
+KV cache. Session storage is never modified; compaction only shapes the
+prompt.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+
+from google.genai import types
+
+HISTORY_COMPACTION = os.environ.get("HISTORY_COMPACTION", "summary").lower()
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", "4"))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_SUMMARY_TOKENS = int(os.environ.get("HISTORY_SUMMARY_TOKENS", "300"))
+
+SUMMARY_HEADER = "Summary of the earlier conversation (older turns, condensed):"
+
+_SENTENCE = re.compile(r"(.+?[.!?])(\s|$)", re.S)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def content_text(content: types.Content) -> str:
+    return " ".join(part.text for part in content.parts or [] if part.text)
+
+
+def content_tokens(content: types.Content) -> int:
+    tokens = 0
+    for part in content.parts or []:
+        if part.text:
+            tokens += estimate_tokens(part.text)
+        elif part.function_call or part.function_response:
+            tokens += estimate_tokens(str(part.function_call or part.function_response))
+    return tokens
+
+
+def _starts_turn(content: types.Content) -> bool:
+    """A user message with text (function responses also use the user role)."""
+    return content.role == "user" and any(
+        part.text and not part.function_response for part in content.parts or []
+    )
+
+
+def split_turns(contents: list[types.Content]) -> list[list[types.Content]]:
+    turns: list[list[types.Content]] = []
+    for content in contents:
+        if _starts_turn(content) or not turns:
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def summarize_turn(turn: list[types.Content]) -> str:
+    """One summary line: the question and the first sentence of the answer."""
+    question = content_text(turn[0]).strip()
+    answer = ""
+    for content in reversed(turn[1:]):
+        if content.role == "model" and content_text(content).strip():
+            answer = content_text(content).strip()
+            break
+    match = _SENTENCE.match(answer)
+    answer = match.group(1) if match else answer
+    return f"- User: {question[:200]} / Assistant: {answer[:200]}"
+
+
+@dataclass
+class CompactionResult:
+    contents: list[types.Content]
+    tokens_before: int
+    tokens_after: int
+    turns_folded: int
+
+
+def compact_contents(
+    contents: list[types.Content],
+    keep_turns: int = HISTORY_KEEP_TURNS,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    mode: str = HISTORY_COMPACTION,
+    summary_tokens: int = HISTORY_SUMMARY_TOKENS,
+) -> CompactionResult:
+    """Keep the recent turns verbatim and fold or drop the older ones."""
+    tokens_before = sum(content_tokens(c) for c in contents)
+    turns = split_turns(contents)
+    if len(turns) <= keep_turns + 1 and tokens_before <= token_budget:
+        return CompactionResult(contents, tokens_before, tokens_before, 0)
+
+    # The current turn (last) is always kept
+    recent = turns[-(keep_turns + 1):]
+    older = turns[:-(keep_turns + 1)]
+    while len(recent) > 1 and sum(content_tokens(c) for t in recent for c in t) > token_budget:
+        older.append(recent.pop(0))
+
+    compacted = [c for turn in recent for c in turn]
+    if mode == "summary" and older:
+        lines, used = [], estimate_tokens(SUMMARY_HEADER)
+        # Newest first, so the most recent context survives the summary budget
+        for turn in reversed(older):
+            line = summarize_turn(turn)
+            if used + estimate_tokens(line) > summary_tokens:
+                break
+            lines.insert(0, line)
+            used += estimate_tokens(line)
+        if lines:
+            summary = "\n".join([SUMMARY_HEADER, *lines])
+            compacted.insert(0, types.Content(role="user", parts=[types.Part(text=summary)]))
+
+    tokens_after = sum(content_tokens(c) for c in compacted)
+    return CompactionResult(compacted, tokens_before, tokens_after, len(older))
+
+
+class HistoryStats:
+    """Per-worker counters for /stats."""
+
+    def __init__(self):
+        self.requests = 0
+        self.compacted = 0
+        self.turns_folded = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def observe(self, result: CompactionResult) -> None:
+        self.requests += 1
+        self.tokens_before += result.tokens_before
+        self.tokens_after += result.tokens_after
+        if result.turns_folded:
+            self.compacted += 1
+            self.turns_folded += result.turns_folded
+
+    def stats(self) -> dict:
+        return {
+            "mode": HISTORY_COMPACTION,
+            "keep_turns": HISTORY_KEEP_TURNS,
+            "token_budget": HISTORY_TOKEN_BUDGET,
+            "model_calls": self.requests,
+            "compacted_calls": self.compacted,
+            "turns_folded": self.turns_folded,
+            "history_tokens_before": self.tokens_before,
+            "history_tokens_after": self.tokens_after,
+        }
+
+
+history_stats = HistoryStats()
+
+
+def compact_history(callback_context, llm_request):
+    """before_model_callback: bound the replayed history of the session."""
+    result = compact_contents(llm_request.contents)
+    history_stats.observe(result)
+    llm_request.contents = result.contents
+    return None
+
+
+def history_compaction_enabled() -> bool:
+    return HISTORY_COMPACTION in ("summary", "drop")
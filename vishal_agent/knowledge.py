@@ -0,0 +1,257 @@
+"""
+Knowledge Base and Retrieval Index
+
+Vishal's bio, skills, projects and example answers live in knowledge.json
+instead of being hard-coded in the agent instruction. The file is rendered
+back into the system prompt for PROMPT_MODE=full, and indexed for
+PROMPT_MODE=retrieval, where the agent calls the search_knowledge tool to
+fetch only the top-k relevant snippets per turn.
+
+Index:
+- BM25 over section/subsection chunks and example answers, built once at
+  startup (pure Python, the corpus is small)
+- Optional dense vectors from a local Ollama embedding model
+  (KNOWLEDGE_EMBED_MODEL, e.g. nomic-embed-text). Vectors are computed once,
+  stored as a float32 file and memory-mapped, so gunicorn workers share the
+  pages instead of each holding a copy. Scores are blended with BM25.
+  The query is embedded per search; the search_knowledge tool awaits it
+  (asearch) on the worker's pooled Ollama client instead of blocking the
+  event loop.
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+KNOWLEDGE_PATH = Path(os.environ.get("KNOWLEDGE_PATH", Path(__file__).with_name("knowledge.json")))
+
+
+# ============================================
+# Knowledge File
+# ============================================
+
+def load_knowledge(path: Path = KNOWLEDGE_PATH) -> dict:
+    """Load the structured knowledge base."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def render_knowledge(kb: dict) -> str:
+    """Render the knowledge sections as the markdown block used in the prompt."""
+    return "\n\n".join(f"## {section['heading']}\n{section['body']}" for section in kb["sections"])
+
+
+def render_examples(kb: dict) -> str:
+    """Render the example Q&A block used in the prompt."""
+    pairs = "\n\n".join(f"Q: {e['question']}\nA: {e['answer']}" for e in kb["examples"])
+    return f"## {kb['examples_heading']}\n\n{pairs}\n"
+
+
+@dataclass
+class Document:
+    id: str
+    title: str
+    text: str
+
+
+def knowledge_documents(kb: dict) -> list[Document]:
+    """Split the knowledge base into retrievable chunks (one per ### subsection)."""
+    docs = []
+    for i, section in enumerate(kb["sections"]):
+        parts = re.split(r"(?m)^### ", section["body"])
+        preamble, subsections = parts[0].strip(), parts[1:]
+        if preamble or not subsections:
+            docs.append(Document(f"s{i}", section["heading"], preamble))
+        for j, sub in enumerate(subsections):
+            heading, _, body = sub.partition("\n")
+            docs.append(Document(f"s{i}.{j}", f"{section['heading']} / {heading}", body.strip()))
+    for i, example in enumerate(kb["examples"]):
+        docs.append(Document(
+            f"e{i}",
+            f"Example answer to {example['question']}",
+            f"Q: {example['question']}\nA: {example['answer']}",
+        ))
+    return docs
+
+
+# ============================================
+# BM25
+# ============================================
+
+_TOKEN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from had has have he her his how i in is it "
+    "me my of on or so tell that the their them this to was what where which who why with "
+    "you your about him".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed document list."""
+
+    def __init__(self, docs: list[Document], k1: float = 1.5, b: float = 0.75):
+        self.docs = docs
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.lengths = []
+        for idx, doc in enumerate(docs):
+            # Titles carry a lot of signal ("Tell me about LimeChat"), count them twice
+            counts = Counter(tokenize(f"{doc.title} {doc.title} {doc.text}"))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((idx, tf))
+        self.avg_length = sum(self.lengths) / max(len(self.lengths), 1)
+        n = len(docs)
+        self.idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+
+    def scores(self, query: str) -> dict[int, float]:
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[term]:
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[idx] / self.avg_length)
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return scores
+
+
+# ============================================
+# Optional dense vectors (memory-mapped)
+# ============================================
+
+def _embed(texts: list[str], model: str) -> list[list[float]]:
+    """Embed texts with a local Ollama embedding model."""
+    import httpx
+
+    base = os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")
+    response = httpx.post(f"{base}/api/embed", json={"model": model, "input": texts}, timeout=120)
+    response.raise_for_status()
+    return response.json()["embeddings"]
+
+
+async def _aembed(texts: list[str], model: str) -> list[list[float]]:
+    """_embed without blocking the event loop, on the worker's Ollama connection pool."""
+    from .ollama import http_client
+
+    base = os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")
+    response = await http_client().client.post(f"{base}/api/embed", json={"model": model, "input": texts}, timeout=120)
+    response.raise_for_status()
+    return response.json()["embeddings"]
+
+
+def _normalize(vector: list[float]) -> list[float]:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class VectorIndex:
+    """Unit-normalized document vectors, memory-mapped from a float32 file."""
+
+    def __init__(self, docs: list[Document], model: str, cache_dir: Path):
+        self.model = model
+        digest = hashlib.sha256(
+            (model + "\0" + "\0".join(d.text for d in docs)).encode("utf-8")
+        ).hexdigest()[:16]
+        path = cache_dir / f"knowledge-{digest}.f32"
+
+        if not path.exists():
+            vectors = _embed([f"{d.title}\n{d.text}" for d in docs], model)
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                array("f", [v for vector in vectors for v in _normalize(vector)]).tofile(f)
+            os.replace(tmp, path)
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.vectors = memoryview(self._mmap).cast("f")
+        self.count = len(docs)
+        self.dim = len(self.vectors) // self.count
+
+    def scores(self, query: str) -> dict[int, float]:
+        return self._similarities(_embed([query], self.model)[0])
+
+    async def ascores(self, query: str) -> dict[int, float]:
+        return self._similarities((await _aembed([query], self.model))[0])
+
+    def _similarities(self, query_vector: list[float]) -> dict[int, float]:
+        q = _normalize(query_vector)
+        dim = self.dim
+        return {
+            idx: sum(a * b for a, b in zip(q, self.vectors[idx * dim:(idx + 1) * dim]))
+            for idx in range(self.count)
+        }
+
+
+# ============================================
+# Knowledge Index
+# ============================================
+
+class KnowledgeIndex:
+    """Hybrid BM25 (+ optional dense) search over the knowledge base."""
+
+    def __init__(self, kb: dict, embed_model: str | None = None, dense_weight: float = 0.5):
+        self.docs = knowledge_documents(kb)
+        self.bm25 = BM25Index(self.docs)
+        self.vectors = None
+        self.dense_weight = dense_weight
+        if embed_model:
+            cache_dir = Path(os.environ.get(
+                "KNOWLEDGE_EMBED_CACHE", Path.home() / ".cache" / "vishal_agent"
+            ))
+            try:
+                self.vectors = VectorIndex(self.docs, embed_model, cache_dir)
+            except Exception as e:
+                print(f"⚠️ Knowledge embeddings unavailable, using BM25 only: {e}")
+
+    def search(self, query: str, top_k: int = 4) -> list[Document]:
+        dense = None
+        if self.vectors is not None:
+            try:
+                dense = self.vectors.scores(query)
+            except Exception as e:
+                print(f"⚠️ Knowledge embedding query failed: {e}")
+        return self._rank(query, dense, top_k)
+
+    async def asearch(self, query: str, top_k: int = 4) -> list[Document]:
+        """search() for the event loop: the query embedding is awaited."""
+        dense = None
+        if self.vectors is not None:
+            try:
+                dense = await self.vectors.ascores(query)
+            except Exception as e:
+                print(f"⚠️ Knowledge embedding query failed: {e}")
+        return self._rank(query, dense, top_k)
+
+    def _rank(self, query: str, dense: dict[int, float] | None, top_k: int) -> list[Document]:
+        scores = self.bm25.scores(query)
+        if scores:
+            # Scale BM25 to [0, 1] so it can be blended with cosine similarity
+            best = max(scores.values())
+            scores = {idx: s / best for idx, s in scores.items()}
+
+        if dense is not None:
+            w = self.dense_weight
+            scores = {
+                idx: (1 - w) * scores.get(idx, 0.0) + w * dense.get(idx, 0.0)
+                for idx in set(scores) | set(dense)
+            }
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [self.docs[idx] for idx, score in ranked[:top_k] if score > 0]
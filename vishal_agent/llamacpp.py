@@ -0,0 +1,187 @@
+"""
+llama.cpp Backend
+
+With LLM_BACKEND=llamacpp the agent's model calls go to llama.cpp's
+llama-server instead of Ollama. One llama-server process per host loads the
+GGUF model (LLAMACPP_MODEL) and serves all gunicorn workers over a Unix
+socket, so there is no TCP hop and no Ollama scheduler in between:
+
+- Continuous batching over LLAMACPP_PARALLEL slots: concurrent requests are
+  decoded together instead of queueing behind each other. Each slot gets
+  LLAMACPP_CTX tokens of context
+- KV-cache reuse: every request sets cache_prompt, so a slot only prefills
+  what follows the longest prefix it already holds - the static agent
+  instruction after the first turn. llama-server sends a request to the slot
+  whose cached prompt matches best, and the warm-up (server lifespan)
+  prefills the instruction into every slot
+- LLAMACPP_THREADS / LLAMACPP_BATCH_THREADS CPU threads for generation and
+  prefill (default: all cores)
+
+gunicorn.conf.py starts llama-server before the workers when LLAMACPP_MODEL
+is set and LLAMACPP_URL is a unix: socket, and stops it on exit. Without
+gunicorn, start it by hand:
+
+    python vishal_agent/llamacpp.py
+
+LLAMACPP_URL may also point at a llama-server elsewhere
+(http://host:8080). Calls go through LiteLLM's OpenAI provider (llama-server
+speaks the OpenAI API), so ADK, the callbacks and the streaming code are
+unchanged; it plugs into LiteLlm as its llm_client like the router does.
+"""
+
+import asyncio
+import os
+import shlex
+import sys
+from functools import cached_property
+from typing import Any
+
+from google.adk.models.lite_llm import LiteLLMClient
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "ollama").lower()
+LLAMACPP_URL = os.environ.get("LLAMACPP_URL", "unix:/tmp/vishal_agent_llama.sock")
+LLAMACPP_MODEL = os.environ.get("LLAMACPP_MODEL", "")
+LLAMACPP_BIN = os.environ.get("LLAMACPP_BIN", "llama-server")
+LLAMACPP_THREADS = int(os.environ.get("LLAMACPP_THREADS") or os.cpu_count() or 4)
+LLAMACPP_BATCH_THREADS = int(os.environ.get("LLAMACPP_BATCH_THREADS") or LLAMACPP_THREADS)
+LLAMACPP_PARALLEL = int(os.environ.get("LLAMACPP_PARALLEL", "4"))
+LLAMACPP_CTX = int(os.environ.get("LLAMACPP_CTX") or os.environ.get("OLLAMA_NUM_CTX", "8192"))
+LLAMACPP_ARGS = os.environ.get("LLAMACPP_ARGS", "")
+LLAMACPP_READ_TIMEOUT = float(os.environ.get("LLAMACPP_READ_TIMEOUT", "300"))
+
+# llama-server serves one model; the name only shows up in logs
+MODEL_ALIAS = "vishal-agent"
+# Host part of URLs sent over the Unix socket
+UDS_BASE = "http://llama.cpp"
+
+
+def socket_path(url: str = LLAMACPP_URL) -> str | None:
+    return url.removeprefix("unix:") if url.startswith("unix:") else None
+
+
+def server_command(url: str = LLAMACPP_URL) -> list[str]:
+    """llama-server command line from the LLAMACPP_* settings."""
+    path = socket_path(url)
+    if path:
+        # llama-server binds a Unix socket when the host ends in .sock
+        address = ["--host", path]
+    else:
+        host, _, port = url.split("://", 1)[-1].rstrip("/").rpartition(":")
+        address = ["--host", host or "127.0.0.1", "--port", port or "8080"]
+    return [
+        LLAMACPP_BIN,
+        "--model", LLAMACPP_MODEL,
+        "--alias", MODEL_ALIAS,
+        *address,
+        "--threads", str(LLAMACPP_THREADS),
+        "--threads-batch", str(LLAMACPP_BATCH_THREADS),
+        "--parallel", str(LLAMACPP_PARALLEL),
+        "--cont-batching",
+        # The context is split between the slots
+        "--ctx-size", str(LLAMACPP_CTX * LLAMACPP_PARALLEL),
+        # Reuse cached chunks even when the history before them changed
+        "--cache-reuse", "256",
+        # Chat template with tool calls (PROMPT_MODE=retrieval)
+        "--jinja",
+        *shlex.split(LLAMACPP_ARGS),
+    ]
+
+
+class LlamaCppClient(LiteLLMClient):
+    """LiteLLM client that sends the agent's model calls to llama-server."""
+
+    def __init__(self, url: str = LLAMACPP_URL):
+        self.url = url.rstrip("/")
+        self.base = UDS_BASE if socket_path(self.url) else self.url
+        self.requests = 0
+        self.failures = 0
+        self.warm_up_seconds: float | None = None
+
+    @cached_property
+    def openai(self):
+        """The worker's OpenAI client (created on first use, after gunicorn forks)."""
+        import httpx
+        from openai import AsyncOpenAI
+
+        path = socket_path(self.url)
+        transport = httpx.AsyncHTTPTransport(
+            uds=path,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+            retries=1,
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(LLAMACPP_READ_TIMEOUT, connect=5.0),
+        )
+        return AsyncOpenAI(base_url=f"{self.base}/v1", api_key="llama.cpp", http_client=client, max_retries=0)
+
+    async def acompletion(self, model: Any, messages: Any, tools: Any, **kwargs: Any):
+        # Ollama settings and the Ollama HTTP handler don't apply; llama-server
+        # has the model and its context fixed at start
+        for key in ("keep_alive", "num_ctx", "api_base", "client"):
+            kwargs.pop(key, None)
+        extra_body = {**(kwargs.pop("extra_body", None) or {}), "cache_prompt": True}
+        self.requests += 1
+        try:
+            return await super().acompletion(
+                f"openai/{MODEL_ALIAS}",
+                messages,
+                tools,
+                api_base=f"{self.base}/v1",
+                api_key="llama.cpp",
+                client=self.openai,
+                extra_body=extra_body,
+                **kwargs,
+            )
+        except Exception:
+            self.failures += 1
+            raise
+
+    async def warm_up(self, instruction: str) -> None:
+        """Prefill the instruction into every slot (one request per slot, at once)."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def one():
+            await self.openai.chat.completions.create(
+                model=MODEL_ALIAS,
+                messages=[{"role": "system", "content": instruction}, {"role": "user", "content": "hi"}],
+                max_tokens=1,
+                extra_body={"cache_prompt": True},
+            )
+
+        try:
+            await asyncio.gather(*(one() for _ in range(LLAMACPP_PARALLEL)))
+        except Exception as e:
+            print(f"⚠️ llama.cpp warm-up failed on {self.url}: {e}")
+            return
+        self.warm_up_seconds = round(loop.time() - start, 3)
+        print(f"🔥 Warmed up {LLAMACPP_PARALLEL} llama.cpp slots on {self.url} in {self.warm_up_seconds:.2f}s")
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "requests": self.requests,
+            "failures": self.failures,
+            "warm_up_seconds": self.warm_up_seconds,
+        }
+
+
+def create_llamacpp_client() -> LlamaCppClient | None:
+    """llama-server client when LLM_BACKEND=llamacpp, else None (Ollama)."""
+    if LLM_BACKEND not in ("ollama", "llamacpp"):
+        raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND}")
+    if LLM_BACKEND != "llamacpp":
+        return None
+    return LlamaCppClient()
+
+
+if __name__ == "__main__":
+    if not LLAMACPP_MODEL:
+        sys.exit("Set LLAMACPP_MODEL to the GGUF file to serve")
+    path = socket_path()
+    if path and os.path.exists(path):
+        os.unlink(path)
+    command = server_command()
+    print(f"🦙 {shlex.join(command)}")
+    os.execvp(command[0], command)
@@ -0,0 +1,383 @@
+"""
+Metrics and Tracing
+
+Prometheus metrics for the request path, served on GET /metrics:
+
+- agent_http_request_seconds      request duration by route/method/status
+                                  (until the last body byte, so SSE streams
+                                  are measured end to end)
+- agent_answers_total             where answers came from: faq, cache,
+                                  coalesced or model
+- agent_stage_seconds             ensure_session, admission_queue,
+                                  run_async, flush_turn, ...
+- agent_ttft_seconds              time to first streamed text, as seen by
+                                  /run_sse clients (includes queueing and
+                                  speculative drafts)
+- agent_drafts_total              speculative drafts accepted / rejected
+- agent_draft_lead_seconds        how much earlier a draft's text arrived
+                                  than the model's
+- agent_llm_ttft_seconds          model call start -> first token
+- agent_llm_inter_token_seconds   gap between streamed chunks
+- agent_llm_call_seconds          whole model call
+- agent_llm_tokens                prompt (in) and completion (out) tokens per call
+- agent_llm_backend_requests      model calls per backend with LLM_BACKENDS
+- agent_ollama_request_seconds    warm-up and keep_alive pings, cold (model
+                                  had to be loaded) or warm
+- agent_ollama_model_loads        pings that found the model unloaded
+- agent_db_seconds                database statement time by operation
+- agent_sse_serialize_seconds     time spent encoding SSE events / NDJSON lines
+- agent_event_loop_lag_seconds    how late the loop monitor's timer fired
+                                  (see diagnostics.py)
+- agent_event_loop_stalls_total   loop stalls over LOOP_STALL_THRESHOLD
+- agent_generation_budget_tokens  max_tokens granted per turn, after load
+                                  tightening (see budgets.py)
+- agent_generation_tokens         completion tokens per budgeted model call,
+                                  by endpoint and whether it was cut short
+- agent_generation_seconds        budgeted model call duration, same labels
+- agent_generation_truncations    calls cut by max_tokens or the deadline
+- agent_generation_tokens_saved   estimated tokens the cut calls didn't
+                                  generate, by endpoint and reason
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does) so
+every worker writes its samples there and /metrics aggregates them.
+prometheus-client is optional: without it all metrics are no-ops.
+
+Spans use the OpenTelemetry API, so they nest with ADK's own invocation /
+call_llm spans. Without a configured exporter the API is a no-op;
+TRACING=console prints spans locally, TRACING=otlp exports via
+opentelemetry-exporter-otlp (if installed).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import AsyncGenerator
+
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram
+except ImportError:
+    prometheus_client = None
+
+TRACING = os.environ.get("TRACING", "none").lower()
+
+
+# ============================================
+# Prometheus
+# ============================================
+
+class _NoopMetric:
+    """Stand-in when prometheus-client is not installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _histogram(name, documentation, labels=(), buckets=None):
+    if prometheus_client is None:
+        return _NoopMetric()
+    kwargs = {"buckets": buckets} if buckets else {}
+    return Histogram(name, documentation, labels, **kwargs)
+
+
+def _counter(name, documentation, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return Counter(name, documentation, labels)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+HTTP_REQUEST_SECONDS = _histogram(
+    "agent_http_request_seconds", "HTTP request duration including the streamed body",
+    ("path", "method", "status"), LATENCY_BUCKETS,
+)
+ANSWERS = _counter("agent_answers_total", "Answers by source", ("endpoint", "source"))
+STAGE_SECONDS = _histogram("agent_stage_seconds", "Time spent per request stage", ("stage",), LATENCY_BUCKETS)
+TTFT_SECONDS = _histogram(
+    "agent_ttft_seconds", "Request start to first streamed text", ("endpoint",), LATENCY_BUCKETS,
+)
+DRAFTS = _counter(
+    "agent_drafts_total", "Speculative drafts by outcome (accepted, rejected, none = model was first)",
+    ("endpoint", "source", "outcome"),
+)
+DRAFT_LEAD_SECONDS = _histogram(
+    "agent_draft_lead_seconds", "Draft's first text to the model's first text", ("endpoint",), LATENCY_BUCKETS,
+)
+LLM_TTFT_SECONDS = _histogram("agent_llm_ttft_seconds", "Model call start to first token", (), LATENCY_BUCKETS)
+LLM_INTER_TOKEN_SECONDS = _histogram(
+    "agent_llm_inter_token_seconds", "Gap between streamed model chunks", (), FAST_BUCKETS,
+)
+LLM_CALL_SECONDS = _histogram("agent_llm_call_seconds", "Whole model call duration", (), LATENCY_BUCKETS)
+LLM_TOKENS = _histogram("agent_llm_tokens", "Tokens per model call", ("direction",), TOKEN_BUCKETS)
+LLM_BACKEND_REQUESTS = _counter(
+    "agent_llm_backend_requests_total", "Model calls per backend and outcome (ok, failover, error)",
+    ("backend", "model", "outcome"),
+)
+OLLAMA_REQUEST_SECONDS = _histogram(
+    "agent_ollama_request_seconds", "Warm-up and keep-alive requests to Ollama", ("kind", "state"), LATENCY_BUCKETS,
+)
+OLLAMA_MODEL_LOADS = _counter("agent_ollama_model_loads_total", "Warm-ups/pings that found the model unloaded")
+DB_SECONDS = _histogram("agent_db_seconds", "Database statement duration", ("operation",), FAST_BUCKETS)
+SSE_SERIALIZE_SECONDS = _histogram(
+    "agent_sse_serialize_seconds", "Time to encode one SSE event", (), FAST_BUCKETS,
+)
+LOOP_LAG_SECONDS = _histogram(
+    "agent_event_loop_lag_seconds", "How late the loop monitor woke up", (), FAST_BUCKETS,
+)
+LOOP_STALLS = _counter("agent_event_loop_stalls_total", "Event loop stalls longer than LOOP_STALL_THRESHOLD")
+GENERATION_BUDGET_TOKENS = _histogram(
+    "agent_generation_budget_tokens", "max_tokens granted per turn after load tightening", ("endpoint",), TOKEN_BUCKETS,
+)
+GENERATION_TOKENS = _histogram(
+    "agent_generation_tokens", "Completion tokens per budgeted model call", ("endpoint", "truncated"), TOKEN_BUCKETS,
+)
+GENERATION_SECONDS = _histogram(
+    "agent_generation_seconds", "Budgeted model call duration", ("endpoint", "truncated"), LATENCY_BUCKETS,
+)
+GENERATION_TRUNCATIONS = _counter(
+    "agent_generation_truncations_total", "Budgeted model calls cut short, by reason (max_tokens, deadline)",
+    ("endpoint", "reason"),
+)
+GENERATION_TOKENS_SAVED = _counter(
+    "agent_generation_tokens_saved_total", "Estimated completion tokens not generated because of a budget cut",
+    ("endpoint", "reason"),
+)
+WS_TURNS = _counter("agent_ws_turns_total", "/ws turns by outcome (done, cancelled, error, rejected)", ("outcome",))
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus exposition of this worker, or of all workers in multiprocess mode."""
+    if prometheus_client is None:
+        return b"# prometheus-client is not installed\n", "text/plain; charset=utf-8"
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class FirstTextTimer:
+    """Observes agent_ttft_seconds once, when a request streams its first text."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.done = False
+
+    def mark(self) -> None:
+        if not self.done:
+            self.done = True
+            TTFT_SECONDS.labels(self.endpoint).observe(time.perf_counter() - self.start)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request until its last body chunk is sent.
+
+    Also opens the request's root span, so the stage spans of one request
+    share a trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        root_path = scope.get("root_path", "")
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                HTTP_REQUEST_SECONDS.labels(route_label(scope, root_path), scope["method"], str(status["code"])).observe(
+                    time.perf_counter() - start
+                )
+            await send(message)
+
+        with tracer.start_as_current_span(f"{scope['method']} {scope['path']}", kind=trace.SpanKind.SERVER) as span:
+            await self.app(scope, receive, timed_send)
+            span.update_name(f"{scope['method']} {route_label(scope, root_path)}")
+            span.set_attribute("http.status_code", status["code"])
+
+
+def route_label(scope, root_path: str = "") -> str:
+    """Route template of a request ("/apps/{app_name}/..."), not its path: bounded label cardinality.
+
+    The router fills in scope["route"] while handling the request; in a
+    mounted app (/a2a) it is the sub-app's route, under the mount's root_path.
+    """
+    route = scope.get("route")
+    if route is None or not hasattr(route, "path"):
+        return "<unmatched>"
+    return scope.get("root_path", "")[len(root_path):] + route.path
+
+
+# ============================================
+# Tracing
+# ============================================
+
+def _configure_tracing() -> None:
+    if TRACING not in ("console", "otlp"):
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    if TRACING == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("⚠️ TRACING=otlp needs opentelemetry-exporter-otlp, tracing disabled")
+            return
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter()
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "vishal_agent"}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    print(f"🔭 Tracing enabled ({TRACING})")
+
+
+_configure_tracing()
+tracer = trace.get_tracer("vishal_agent")
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Span + stage histogram around a block (not for code that yields)."""
+    start = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes=attributes):
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def traced(name: str):
+    """Decorator form of stage() for coroutines."""
+    def decorate(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+async def traced_stream(name: str, stream: AsyncGenerator, **attributes) -> AsyncGenerator:
+    """Span + stage histogram around an async generator.
+
+    The span is only made current while the wrapped generator runs, never
+    across our own yields (same approach as ADK's call_llm span), so spans
+    created inside - ADK's invocation and call_llm spans - nest under it.
+    """
+    span = tracer.start_span(name, attributes=attributes)
+    start = time.perf_counter()
+    try:
+        while True:
+            with trace.use_span(span, end_on_exit=False):
+                try:
+                    item = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+            yield item
+    except Exception as e:
+        span.set_status(Status(StatusCode.ERROR, str(e)))
+        raise
+    finally:
+        await stream.aclose()
+        span.end()
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+# ============================================
+# Model call callbacks
+# ============================================
+
+class _LlmCall:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_chunk: float | None = None
+
+
+_llm_call: ContextVar[_LlmCall | None] = ContextVar("llm_call", default=None)
+
+
+def llm_metrics_before(callback_context, llm_request):
+    """before_model_callback: start timing the model call."""
+    _llm_call.set(_LlmCall())
+    return None
+
+
+def llm_metrics_after(callback_context, llm_response):
+    """after_model_callback: TTFT, inter-token latency and token counts."""
+    call = _llm_call.get()
+    if call is None:
+        return None
+    now = time.perf_counter()
+    has_content = bool(llm_response.content and llm_response.content.parts)
+
+    if llm_response.partial:
+        if has_content:
+            if call.last_chunk is None:
+                LLM_TTFT_SECONDS.observe(now - call.start)
+                trace.get_current_span().add_event("first_token")
+            else:
+                LLM_INTER_TOKEN_SECONDS.observe(now - call.last_chunk)
+            call.last_chunk = now
+        return None
+
+    if call.last_chunk is None and has_content:
+        # Non-streaming call: the whole answer arrives at once
+        LLM_TTFT_SECONDS.observe(now - call.start)
+    LLM_CALL_SECONDS.observe(now - call.start)
+    usage = llm_response.usage_metadata
+    if usage is not None:
+        if usage.prompt_token_count:
+            LLM_TOKENS.labels("in").observe(usage.prompt_token_count)
+        if usage.candidates_token_count:
+            LLM_TOKENS.labels("out").observe(usage.candidates_token_count)
+    _llm_call.set(None)
+    return None
+
+
+# ============================================
+# Database
+# ============================================
+
+def instrument_engine(engine) -> None:
+    """Record statement durations of an async SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if starts:
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+            DB_SECONDS.labels(operation).observe(time.perf_counter() - starts.pop())
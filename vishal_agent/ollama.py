@@ -0,0 +1,167 @@
+"""
+Ollama Connection Pool and Warm-up
+
+LiteLLM otherwise picks HTTP clients from its own short-lived cache. Here
+every model call of a worker goes through one long-lived client instead, so
+connections to Ollama are reused between turns:
+
+- OLLAMA_POOL_SIZE connections at most, idle ones kept for
+  OLLAMA_POOL_KEEPALIVE seconds
+- OLLAMA_CONNECT_TIMEOUT / OLLAMA_READ_TIMEOUT bound slow or dead backends
+
+When a worker starts (server lifespan), each Ollama backend gets a warm-up
+generation: the agent instruction plus a one-token answer. That loads the
+model and fills Ollama's prompt cache for the instruction prefix, so the
+first visitor doesn't pay for it. Afterwards a ping every
+OLLAMA_PING_INTERVAL seconds refreshes keep_alive so the model stays
+resident, and keeps a pooled connection open.
+
+Ollama reports how long it spent loading the model, which tells a cold
+start (model loaded from disk) from a warm one. Both are logged and
+recorded in agent_ollama_request_seconds{kind, state}.
+"""
+
+import asyncio
+import os
+import time
+from functools import cache
+
+from .metrics import OLLAMA_MODEL_LOADS, OLLAMA_REQUEST_SECONDS
+
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "32"))
+OLLAMA_POOL_KEEPALIVE = float(os.environ.get("OLLAMA_POOL_KEEPALIVE", "300"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_WARMUP = os.environ.get("OLLAMA_WARMUP", "1").lower() not in ("0", "off", "false")
+OLLAMA_PING_INTERVAL = float(os.environ.get("OLLAMA_PING_INTERVAL", "240"))
+
+# Loading a model takes seconds; a resident model reports a few milliseconds
+COLD_LOAD_SECONDS = 0.5
+
+
+@cache
+def http_client():
+    """The worker's shared LiteLLM HTTP handler for Ollama calls."""
+    import httpx
+    from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=OLLAMA_POOL_SIZE,
+            max_keepalive_connections=OLLAMA_POOL_SIZE,
+            keepalive_expiry=OLLAMA_POOL_KEEPALIVE,
+        ),
+        # One retry for connections Ollama closed while they sat in the pool
+        retries=1,
+    )
+    return AsyncHTTPHandler(
+        timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        transport=transport,
+    )
+
+
+def ollama_model_name(model: str) -> str:
+    """"ollama_chat/llama3.2:latest" -> "llama3.2:latest"."""
+    return model.split("/", 1)[1] if "/" in model else model
+
+
+class OllamaKeepAlive:
+    """Warm-up and keep_alive pings for each (backend, model) pair."""
+
+    def __init__(self, targets: list[tuple[str, str]], instruction: str, keep_alive: str, num_ctx: int):
+        self.targets = targets
+        self.instruction = instruction
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.last: dict[str, dict] = {}
+
+    async def _request(self, kind: str, base: str, path: str, body: dict) -> dict:
+        start = time.perf_counter()
+        response = await http_client().client.post(f"{base}{path}", json=body)
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        load_seconds = response.json().get("load_duration", 0) / 1e9
+        state = "cold" if load_seconds >= COLD_LOAD_SECONDS else "warm"
+        OLLAMA_REQUEST_SECONDS.labels(kind, state).observe(elapsed)
+        if state == "cold":
+            OLLAMA_MODEL_LOADS.inc()
+        result = {"kind": kind, "state": state, "seconds": round(elapsed, 3), "load_seconds": round(load_seconds, 3)}
+        self.last[f"{base} {body['model']}"] = result
+        return result
+
+    async def warm_up(self, base: str, model: str) -> dict:
+        """Load the model and prefill the instruction with a one-token answer."""
+        result = await self._request("warmup", base, "/api/chat", {
+            "model": model,
+            "messages": [{"role": "system", "content": self.instruction}, {"role": "user", "content": "hi"}],
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx, "num_predict": 1},
+        })
+        print(f"🔥 Warmed up {model} on {base} in {result['seconds']:.2f}s "
+              f"({result['state']}, model load {result['load_seconds']:.2f}s)")
+        return result
+
+    async def ping(self, base: str, model: str) -> dict:
+        """Refresh keep_alive without generating anything."""
+        result = await self._request("ping", base, "/api/generate", {
+            "model": model,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx},
+        })
+        if result["state"] == "cold":
+            print(f"🧊 {model} on {base} had been unloaded (reloaded in {result['load_seconds']:.2f}s)")
+        return result
+
+    async def _each(self, call) -> None:
+        async def one(base, model):
+            try:
+                await call(base, model)
+            except Exception as e:
+                print(f"⚠️ Ollama {call.__name__} failed for {model} on {base}: {e}")
+        await asyncio.gather(*(one(base, model) for base, model in self.targets))
+
+    async def run(self) -> None:
+        """Warm up once, then ping until cancelled."""
+        if OLLAMA_WARMUP:
+            await self._each(self.warm_up)
+        if OLLAMA_PING_INTERVAL <= 0:
+            return
+        while True:
+            await asyncio.sleep(OLLAMA_PING_INTERVAL)
+            await self._each(self.ping)
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": OLLAMA_POOL_SIZE,
+            "ping_interval": OLLAMA_PING_INTERVAL,
+            "last": self.last,
+        }
+
+
+def create_keep_alive(
+    model: str | None,
+    router,
+    instruction: str,
+    keep_alive: str,
+    num_ctx: int,
+    extra_targets: list[tuple[str, str]] = (),
+) -> OllamaKeepAlive | None:
+    """Warm-up/ping task for every Ollama backend and model, or None if disabled.
+
+    model is None when the agent's model isn't served by Ollama (llama.cpp);
+    extra_targets are further (base URL, Ollama model name) pairs to keep loaded.
+    """
+    if not OLLAMA_WARMUP and OLLAMA_PING_INTERVAL <= 0:
+        return None
+    models = [model, router.small_model] if router and router.small_model else [model]
+    models = [ollama_model_name(m) for m in models if m and m.startswith("ollama")]
+    if not models and not extra_targets:
+        return None
+    bases = [b.url for b in router.backends] if router else [os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")]
+    return OllamaKeepAlive(
+        targets=[(base, m) for base in bases for m in models] + list(extra_targets),
+        instruction=instruction,
+        keep_alive=keep_alive,
+        num_ctx=num_ctx,
+    )
@@ -0,0 +1,273 @@
+"""
+LLM Backend Router
+
+Spreads model calls over several Ollama instances instead of the single
+OLLAMA_API_BASE. It plugs into LiteLlm as its llm_client, so ADK, the
+callbacks and the streaming code are unchanged.
+
+- LLM_BACKENDS lists the instances with optional weights:
+      LLM_BACKENDS=http://ollama-1:11434*2,http://ollama-2:11434
+- Each call goes to the healthy backend with the fewest requests in flight
+  per unit of weight (least outstanding requests, per worker); ties go to
+  the backend with the fewest requests so far per unit of weight
+- Connection errors, timeouts and 5xx answers count as failures; after
+  LLM_EJECT_AFTER failures in a row a backend is ejected for
+  LLM_EJECT_SECONDS. A background health check (LLM_HEALTH_PATH every
+  LLM_HEALTH_INTERVAL seconds) ejects dead backends early and brings
+  recovered ones back
+- A call that fails before its first token is retried on the next backend,
+  so clients never see the failover. Once tokens have been streamed the
+  error is passed on (the partial answer can't be taken back)
+- With LLM_SMALL_MODEL set, short prompts (at most LLM_SMALL_MAX_WORDS
+  words, e.g. "who is vishal?") go to the smaller model and everything else
+  to MODEL. Every backend must have both models pulled
+
+If all backends are ejected, all of them are tried anyway (fail open).
+"""
+
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass
+from functools import cache
+from typing import Any
+
+from google.adk.models.lite_llm import LiteLLMClient
+from opentelemetry import trace
+
+from .metrics import LLM_BACKEND_REQUESTS
+
+LLM_EJECT_AFTER = int(os.environ.get("LLM_EJECT_AFTER", "3"))
+LLM_EJECT_SECONDS = float(os.environ.get("LLM_EJECT_SECONDS", "30"))
+LLM_HEALTH_INTERVAL = float(os.environ.get("LLM_HEALTH_INTERVAL", "10"))
+LLM_HEALTH_PATH = os.environ.get("LLM_HEALTH_PATH", "/api/version")
+LLM_SMALL_MAX_WORDS = int(os.environ.get("LLM_SMALL_MAX_WORDS", "12"))
+
+
+@dataclass
+class Backend:
+    url: str
+    weight: float = 1.0
+    outstanding: int = 0
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+
+    @property
+    def ejected(self) -> bool:
+        return time.monotonic() < self.ejected_until
+
+    def load(self) -> tuple[float, float]:
+        # Fewest in flight per weight; when idle, spread by weight
+        return self.outstanding / self.weight, self.requests / self.weight
+
+
+def parse_backends(raw: str) -> list[Backend]:
+    """Parse "url*weight,url,..." (weight defaults to 1)."""
+    backends = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("*")
+        backends.append(Backend(url=url.rstrip("/"), weight=float(weight or 1)))
+    return backends
+
+
+@cache
+def _failover_errors() -> tuple[type[Exception], ...]:
+    """Errors worth retrying on another backend (not bad requests)."""
+    import httpx
+    import litellm
+
+    return (
+        litellm.APIConnectionError,
+        litellm.Timeout,
+        litellm.ServiceUnavailableError,
+        litellm.InternalServerError,
+        litellm.RateLimitError,
+        httpx.TransportError,
+        OSError,
+    )
+
+
+def last_user_words(messages: list) -> int | None:
+    """Word count of the last message if it is a plain user message."""
+    if not messages:
+        return None
+    last = messages[-1]
+    role = last.get("role") if isinstance(last, dict) else getattr(last, "role", None)
+    content = last.get("content") if isinstance(last, dict) else getattr(last, "content", None)
+    if role != "user":
+        return None
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    if not isinstance(content, str):
+        return None
+    return len(content.split())
+
+
+class LlmRouter(LiteLLMClient):
+    """LiteLLM client that balances calls over several Ollama backends."""
+
+    def __init__(self, backends: list[Backend], small_model: str | None = None, small_max_words: int = LLM_SMALL_MAX_WORDS):
+        self.backends = backends
+        self.small_model = small_model
+        self.small_max_words = small_max_words
+        self.models: dict[str, int] = {}
+        self.failovers = 0
+
+    # ---------- Selection ----------
+
+    def choose_model(self, model: str, messages: list) -> str:
+        if self.small_model:
+            words = last_user_words(messages)
+            if words is not None and words <= self.small_max_words:
+                return self.small_model
+        return model
+
+    def candidates(self) -> list[Backend]:
+        """Backends in the order to try them: healthy ones by load, then ejected ones."""
+        shuffled = random.sample(self.backends, len(self.backends))
+        healthy = sorted((b for b in shuffled if not b.ejected), key=Backend.load)
+        ejected = sorted((b for b in shuffled if b.ejected), key=lambda b: b.ejected_until)
+        return healthy + ejected
+
+    # ---------- Health ----------
+
+    def record_success(self, backend: Backend) -> None:
+        backend.consecutive_failures = 0
+        backend.ejected_until = 0.0
+
+    def record_failure(self, backend: Backend, error: Exception) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= LLM_EJECT_AFTER and not backend.ejected:
+            backend.ejected_until = time.monotonic() + LLM_EJECT_SECONDS
+            print(f"⚠️ LLM backend {backend.url} ejected for {LLM_EJECT_SECONDS:.0f}s: {error}")
+
+    async def check_health(self, client) -> None:
+        for backend in self.backends:
+            try:
+                response = await client.get(f"{backend.url}{LLM_HEALTH_PATH}")
+                response.raise_for_status()
+            except Exception as e:
+                self.record_failure(backend, e)
+                continue
+            if backend.ejected:
+                print(f"✅ LLM backend {backend.url} is back")
+            self.record_success(backend)
+
+    async def run_health_checks(self) -> None:
+        """Probe every backend periodically (runs for the lifetime of the worker)."""
+        import httpx
+
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            while True:
+                await self.check_health(client)
+                await asyncio.sleep(LLM_HEALTH_INTERVAL)
+
+    # ---------- Calls ----------
+
+    async def acompletion(self, model: Any, messages: Any, tools: Any, **kwargs: Any):
+        model = self.choose_model(model, messages)
+        self.models[model] = self.models.get(model, 0) + 1
+        if kwargs.get("stream"):
+            return self._stream(model, messages, tools, kwargs)
+
+        last_error = None
+        for backend in self.candidates():
+            backend.outstanding += 1
+            backend.requests += 1
+            try:
+                response = await super().acompletion(model, messages, tools, api_base=backend.url, **kwargs)
+            except _failover_errors() as e:
+                last_error = self._failed(backend, model, e)
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._succeeded(backend, model)
+            return response
+        raise last_error
+
+    async def _stream(self, model: str, messages: Any, tools: Any, kwargs: dict):
+        last_error = None
+        for backend in self.candidates():
+            backend.outstanding += 1
+            backend.requests += 1
+            stream = None
+            try:
+                try:
+                    stream = await super().acompletion(model, messages, tools, api_base=backend.url, **kwargs)
+                    chunks = stream.__aiter__()
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    self._succeeded(backend, model)
+                    return
+                except _failover_errors() as e:
+                    # Nothing streamed yet - try the next backend
+                    last_error = self._failed(backend, model, e)
+                    continue
+
+                yield first
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                except _failover_errors() as e:
+                    self._failed(backend, model, e, mid_stream=True)
+                    raise
+                self._succeeded(backend, model)
+                return
+            finally:
+                backend.outstanding -= 1
+                # Closed early (deadline, cancelled turn): end the backend's request too
+                if stream is not None and hasattr(stream, "aclose"):
+                    await stream.aclose()
+        raise last_error
+
+    def _succeeded(self, backend: Backend, model: str) -> None:
+        self.record_success(backend)
+        LLM_BACKEND_REQUESTS.labels(backend.url, model, "ok").inc()
+        span = trace.get_current_span()
+        span.set_attribute("llm.backend", backend.url)
+        span.set_attribute("llm.routed_model", model)
+
+    def _failed(self, backend: Backend, model: str, error: Exception, mid_stream: bool = False) -> Exception:
+        self.record_failure(backend, error)
+        if not mid_stream:
+            self.failovers += 1
+        LLM_BACKEND_REQUESTS.labels(backend.url, model, "error" if mid_stream else "failover").inc()
+        return error
+
+    def stats(self) -> dict:
+        return {
+            "backends": [
+                {
+                    "url": b.url,
+                    "weight": b.weight,
+                    "outstanding": b.outstanding,
+                    "requests": b.requests,
+                    "failures": b.failures,
+                    "ejected": b.ejected,
+                }
+                for b in self.backends
+            ],
+            "models": self.models,
+            "failovers": self.failovers,
+        }
+
+
+def create_llm_router() -> LlmRouter | None:
+    """Router from LLM_BACKENDS / LLM_SMALL_MODEL, or None for a single backend."""
+    raw = os.environ.get("LLM_BACKENDS", "")
+    small_model = os.environ.get("LLM_SMALL_MODEL") or None
+    if not raw and not small_model:
+        return None
+    source = "LLM_BACKENDS" if raw else "OLLAMA_API_BASE"
+    backends = parse_backends(raw or os.environ.get("OLLAMA_API_BASE", "http://localhost:11434"))
+    if not backends:
+        # e.g. LLM_BACKENDS="," - every call would fail with nothing to try
+        raise ValueError(f"{source} lists no backends")
+    return LlmRouter(backends, small_model=small_model)
@@ -4,11 +4,71 @@ Production ASGI Server for ADK Agent
 This module creates a production-ready FastAPI application that exposes:
 1. /run - Non-streaming agent execution
 2. /run_sse - Streaming agent execution (SSE)
-3. /a2a/* - A2A protocol endpoints
+3. /run_ndjson - Streaming agent execution (newline-delimited JSON)
+4. /run_batch - Many prompts per request, results streamed as NDJSON
+5. /ws - Multi-turn chat over one WebSocket, bound to one session
+6. /a2a/* - A2A protocol endpoints
+7. /stats - FAQ, response cache, coalescing, admission and budget counters
+8. /admin/profile - Sampling profile of the worker (collapsed stacks)
 
 Session storage:
 - Uses PostgreSQL via DatabaseSessionService for production (scalable, multi-worker)
 - Falls back to InMemorySessionService if DATABASE_URL is not set (development)
+- SESSION_STORE=sqlite uses a local SQLite file through the same code path
+- SESSION_STORE=shared keeps sessions in one in-memory store per host that
+  all workers share over a Unix socket (see session_store.py)
+- Connection pool settings come from DB_* variables (see db.py)
+- With PostgreSQL, hot sessions are cached per worker and a turn's events are
+  written in one batch (see sessions.py, SESSION_CACHE=0 to disable)
+- Sessions idle for longer than SESSION_TTL are pruned in the background
+- Replayed history is compacted to a token budget before each model call
+  (see history.py)
+
+FAQ fast path (see faq.py):
+- Messages matching one of the curated example questions are answered with
+  the stored answer without calling the model (FAQ_FAST_PATH, FAQ_THRESHOLD)
+
+Response caching (see cache.py):
+- First-turn questions are answered from the response cache when possible
+- RESPONSE_CACHE=memory|postgres|off selects the backend (default: memory)
+- Identical first-turn prompts in flight share one generation (see singleflight.py)
+
+Admission control (see admission.py):
+- Generations go through a bounded, per-user fair queue; overload is
+  rejected early with 429/503 and Retry-After
+
+Generation budgets (see budgets.py):
+- Each model-generated turn gets max tokens, a deadline and stop sequences
+  per endpoint and intent, tightened while requests are queued; cut answers
+  are flagged "truncated" and not cached
+
+SSE streaming (see streaming.py):
+- Generations run in the background and are read from a buffer: tokens are
+  batched, idle streams get heartbeats, abandoned streams are cancelled and
+  reconnecting clients resume with Last-Event-ID
+- Optionally a draft (closest FAQ answer or small model) is streamed while the model prefills, and kept or dropped once the
+  model's text arrives (see draft.py, DRAFT_SOURCES)
+
+WebSocket chat (see websocket.py):
+- /ws binds one connection to one session for many turns, streams compact
+  frames, and cancels the generation on a cancel message or disconnect
+
+Metrics and tracing (see metrics.py):
+- /metrics exposes Prometheus histograms for request stages, TTFT,
+  inter-token latency, tokens and database time (aggregated across
+  gunicorn workers with PROMETHEUS_MULTIPROC_DIR)
+- Request stages are OpenTelemetry spans (TRACING=console|otlp to export)
+
+Event loop diagnostics (see diagnostics.py):
+- Per-worker loop lag monitor and a watchdog that logs the loop thread's
+  stack when the loop is blocked for LOOP_STALL_THRESHOLD seconds
+- /admin/profile samples a live worker (needs ADMIN_TOKEN)
+
+Startup (see startup.py):
+- The A2A app is built on the first /a2a request (A2A_APP=lazy|eager|off).
+  It runs on this server's runner, sessions and admission control, with a
+  bounded task store (see a2a_service.py)
+- gunicorn.conf.py preloads the app so workers share imported modules
 
 For production deployment with multiple workers:
     gunicorn vishal_agent.server:app -w 4 -k uvicorn.workers.UvicornWorker
@@ -17,38 +77,75 @@ For development:
     uvicorn vishal_agent.server:app --reload
 """
 
+import asyncio
+import hmac
 import os
+import threading
+import time
 import uuid
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Awaitable, Callable, Literal
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from google.adk.runners import Runner
 from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.events import Event
 from google.genai import types
 
-from .agent import root_agent
+from .agent import root_agent, KNOWLEDGE, MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, llamacpp_client, llm_router
+from .cache import PostgresCacheBackend, create_response_cache, normalize_message, replay_chunks
+from .admission import ANONYMOUS_USER, AdmissionRejected, QueuePosition, Ticket, create_admission_controller, queue_key
+from .budgets import BUDGET_DEADLINE, BUDGET_MAX_TOKENS, BUDGET_TIGHTEN_QUEUE, create_generation_budgets, truncation_flags
+from .faq import create_faq_index
+from .history import history_compaction_enabled, history_stats
+from .db import database_url, get_engine, pool_health
+from .diagnostics import (
+    ADMIN_TOKEN,
+    PROFILE_MAX_SECONDS,
+    ProfileBusy,
+    create_loop_monitor,
+    render_collapsed,
+    sample_stacks,
+)
+from .draft import DRAFT_API_BASE, DRAFT_MODEL, DRAFT_SOURCES, create_drafter
+from .ollama import create_keep_alive, http_client
+from .metrics import ANSWERS, FirstTextTimer, MetricsMiddleware, render_metrics, traced, traced_stream
+from .sessions import (
+    SESSION_TTL,
+    CachedSessionService,
+    SharedSessionService,
+    create_session_service,
+    run_session_pruner,
+    session_stats,
+)
+from .singleflight import Flight, create_single_flight, start_flight, wait_for_remote_answer
+from .startup import A2A_APP, LazyApp, preload_request_path_imports
+from .streaming import ResumableStreams, encode_event, encode_line, stream_events
+from .websocket import (
+    CLOSE_NORMAL,
+    CLOSE_TRY_AGAIN_LATER,
+    WS_IDLE_TIMEOUT,
+    FrameSender,
+    SlowConsumer,
+    WebSocketStats,
+    receive_message,
+    send_flight,
+)
+
+# Modules the first model call would otherwise import (see startup.py)
+preload_request_path_imports()
 
 # ============================================
 # Session Management
 # ============================================
 
-# Check for DATABASE_URL environment variable
-DATABASE_URL = os.environ.get("DATABASE_URL")
+# Check for DATABASE_URL environment variable (or the SQLite stand-in)
+DATABASE_URL = database_url()
 
-if DATABASE_URL:
-    # Use PostgreSQL for production (supports multiple workers)
-    from google.adk.sessions import DatabaseSessionService
-    print(f"🗄️ Using DatabaseSessionService with PostgreSQL")
-    session_service = DatabaseSessionService(db_url=DATABASE_URL)
-else:
-    # Fallback to in-memory for development
-    from google.adk.sessions import InMemorySessionService
-    print("⚠️ Using InMemorySessionService (sessions not shared between workers)")
-    session_service = InMemorySessionService()
+session_service = create_session_service(DATABASE_URL)
 
 # Create runner
 runner = Runner(
@@ -58,20 +155,664 @@ runner = Runner(
 )
 
 
+@traced("ensure_session")
 async def ensure_session(user_id: str, session_id: str):
     """Ensure session exists, create if not."""
+    if isinstance(session_service, (CachedSessionService, SharedSessionService)):
+        return await session_service.get_or_create_session(
+            app_name=root_agent.name,
+            user_id=user_id,
+            session_id=session_id
+        )
+    
     try:
-        return await session_service.get_session(
+        session = await session_service.get_session(
             app_name=root_agent.name,
             user_id=user_id,
             session_id=session_id
         )
     except Exception:
-        return await session_service.create_session(
+        session = None
+    
+    # get_session returns None (rather than raising) for unknown sessions
+    if session is None:
+        session = await session_service.create_session(
             app_name=root_agent.name,
             user_id=user_id,
             session_id=session_id
         )
+    return session
+
+
+# Token-by-token streaming; runs only read it, so one instance serves every turn
+STREAMING_RUN_CONFIG = RunConfig(streaming_mode=StreamingMode.SSE)
+
+
+async def run_turn(user_id: str, session_id: str, content: types.Content, run_config: RunConfig | None = None):
+    """runner.run_async, retried once if the session was lost between ensure and run.
+    
+    The runner looks the session up before producing anything, so the retry
+    never repeats events.
+    """
+    for attempt in range(2):
+        try:
+            async for event in traced_stream("run_async", runner.run_async(
+                user_id=user_id,
+                session_id=session_id,
+                new_message=content,
+                run_config=run_config
+            )):
+                yield event
+            return
+        except ValueError as e:
+            if attempt or "Session not found" not in str(e):
+                raise
+        # Session was lost (e.g. pruned or created on another worker), recreate and retry
+        await ensure_session(user_id, session_id)
+
+
+@traced("flush_turn")
+async def flush_turn(user_id: str, session_id: str):
+    """Persist the events buffered during a turn (no-op without the session cache)."""
+    if isinstance(session_service, CachedSessionService):
+        await session_service.flush_session(root_agent.name, user_id, session_id)
+
+
+async def record_exchange(session, content: types.Content, response_text: str):
+    """Append a user/agent exchange to the session without running the model.
+    
+    Keeps session history coherent when an answer is served from the cache,
+    so follow-up turns still see what was asked and answered.
+    """
+    invocation_id = f"e-{uuid.uuid4()}"
+    await session_service.append_event(
+        session,
+        Event(invocation_id=invocation_id, author="user", content=content)
+    )
+    await session_service.append_event(
+        session,
+        Event(
+            invocation_id=invocation_id,
+            author=root_agent.name,
+            content=types.Content(role="model", parts=[types.Part(text=response_text)])
+        )
+    )
+    await flush_turn(session.user_id, session.id)
+
+
+# ============================================
+# Response Cache
+# ============================================
+
+response_cache = create_response_cache(
+    instruction=str(root_agent.instruction),
+    model=MODEL,
+    database_url=DATABASE_URL,
+)
+
+if response_cache:
+    print(f"💾 Response cache enabled ({type(response_cache.backend).__name__})")
+
+
+def message_text(message: "Message") -> str:
+    """Concatenate the text parts of an incoming message."""
+    return " ".join(part.text for part in message.parts)
+
+
+def event_text(event) -> str | None:
+    """Concatenate the text parts of an agent event."""
+    if not event.content or not event.content.parts:
+        return None
+    text = "".join(part.text for part in event.content.parts if getattr(part, 'text', None))
+    return text or None
+
+
+def run_event_data(event) -> dict:
+    """Serialize an event for the /run response."""
+    return {
+        "author": getattr(event, 'author', None),
+        "content": event.content.model_dump() if event.content else None,
+        "is_final": event.is_final_response()
+    }
+
+
+def summary_event_data(event) -> dict:
+    """Compact event for verbosity=summary: text and tool names, no content dump."""
+    event_data = {
+        "author": getattr(event, 'author', None),
+        "is_final": event.is_final_response(),
+    }
+    text = event_text(event)
+    if text:
+        event_data["text"] = text
+    calls = [call.name for call in event.get_function_calls()]
+    if calls:
+        event_data["function_calls"] = calls
+    responses = [response.name for response in event.get_function_responses()]
+    if responses:
+        event_data["function_responses"] = responses
+    return event_data
+
+
+# Event serializer per verbosity (final: no events, just the response text)
+EVENT_SERIALIZERS = {
+    "final": None,
+    "summary": summary_event_data,
+    "full": run_event_data,
+}
+
+
+def sse_event_data(event) -> dict:
+    """Serialize an event for the /run_sse stream."""
+    event_data = {
+        "author": getattr(event, 'author', None),
+        "is_final": event.is_final_response(),
+    }
+    
+    if event.content and event.content.parts:
+        for part in event.content.parts:
+            if hasattr(part, 'text') and part.text:
+                event_data["text"] = part.text
+    if event_data["is_final"]:
+        event_data.update(truncation_flags(event))
+    
+    return event_data
+
+
+def answer_event(text: str, partial: bool = False) -> Event:
+    """An agent event carrying text that did not come from the model."""
+    return Event(
+        author=root_agent.name,
+        partial=partial,
+        content=types.Content(role="model", parts=[types.Part(text=text)])
+    )
+
+
+def run_response(session_id: str, text: str | None, events: list | None, **flags) -> dict:
+    """/run response body; events is None for verbosity=final."""
+    response = {"session_id": session_id, "response": text}
+    if events is not None:
+        response["events"] = events
+    return {**response, **flags}
+
+
+def canned_run_response(session_id: str, text: str, verbosity: str, **flags) -> dict:
+    """/run response for an answer that did not come from the model."""
+    serialize = EVENT_SERIALIZERS[verbosity]
+    return run_response(session_id, text, [serialize(answer_event(text))] if serialize else None, **flags)
+
+
+def canned_flight(text: str, key: str = "canned") -> Flight:
+    """A finished stream replaying a stored answer in token-like chunks, so clients see no difference."""
+    flight = Flight(key)
+    for chunk in replay_chunks(text):
+        flight.publish(answer_event(chunk, partial=True))
+    flight.publish(answer_event(text))
+    flight.finish()
+    return flight
+
+
+def sse_payload(item) -> dict:
+    """SSE payload for a stream item (queue update, agent event or ready-made dict)."""
+    if isinstance(item, QueuePosition):
+        return {"queue_position": item.position}
+    if isinstance(item, dict):
+        return item
+    return sse_event_data(item)
+
+
+def ndjson_payload(item, serialize) -> dict | None:
+    """/run_ndjson line for a stream item: text deltas, plus complete events unless verbosity=final."""
+    if isinstance(item, QueuePosition):
+        return {"queue_position": item.position}
+    if isinstance(item, dict):
+        return item
+    if item.partial:
+        text = event_text(item)
+        return {"text": text} if text else None
+    return {"event": serialize(item)} if serialize else None
+
+
+def ws_frame(item) -> dict | None:
+    """Compact /ws frame for a stream item: text deltas as "t", queue positions as "q"."""
+    if isinstance(item, QueuePosition):
+        return {"q": item.position}
+    if isinstance(item, dict):
+        if "text" in item:
+            # Draft text
+            frame = dict(item)
+            frame["t"] = frame.pop("text")
+            return frame
+        return item
+    if item.partial:
+        text = event_text(item)
+        return {"t": text} if text else None
+    return None
+
+
+def streaming_response(chunks: AsyncGenerator[str, None], media_type: str = "text/event-stream") -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",  # Disable nginx buffering
+        }
+    )
+
+
+# ============================================
+# Ollama Warm-up
+# ============================================
+
+ollama_keep_alive = create_keep_alive(
+    # llama-server is warmed up by its client instead (see llamacpp.py)
+    model=None if llamacpp_client else MODEL,
+    router=llm_router,
+    instruction=str(root_agent.instruction),
+    keep_alive=OLLAMA_KEEP_ALIVE,
+    num_ctx=OLLAMA_NUM_CTX,
+    # Keep the draft model resident too, or drafts would wait for it to load
+    extra_targets=[(DRAFT_API_BASE, DRAFT_MODEL)] if "model" in DRAFT_SOURCES else [],
+)
+
+
+# ============================================
+# FAQ Fast Path
+# ============================================
+
+faq_index = create_faq_index(KNOWLEDGE["examples"])
+
+if faq_index:
+    print(f"⚡ FAQ fast path enabled ({len(faq_index.intents)} intents, threshold {faq_index.threshold})")
+
+
+# ============================================
+# Speculative Drafts
+# ============================================
+
+drafter = create_drafter(KNOWLEDGE["examples"], faq_index, keep_alive=OLLAMA_KEEP_ALIVE)
+
+if drafter:
+    print(f"✏️ Speculative drafts from {', '.join(drafter.sources)} on {', '.join(sorted(drafter.endpoints))}")
+
+
+def with_draft(producer, endpoint: str, user_text: str, requested: bool | None):
+    """Wrap a flight producer so its stream opens with a draft, if drafting applies."""
+    if not drafter or not drafter.enabled(endpoint, requested):
+        return producer
+    speculation = drafter.source_for(user_text)
+    if speculation is None:
+        return producer
+    source, draft = speculation
+    return lambda: drafter.speculate(endpoint, source, draft, producer)
+
+
+# ============================================
+# Admission Control
+# ============================================
+
+admission = create_admission_controller()
+
+# How often queued SSE clients get a queue-position update
+QUEUE_POSITION_INTERVAL = float(os.environ.get("QUEUE_POSITION_INTERVAL", "1.0"))
+
+if admission:
+    print(f"🚦 Admission control: {admission.max_concurrency} concurrent generations, queue of {admission.max_queue}")
+
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    """Translate an admission rejection into a 429/503 with Retry-After."""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=e.detail,
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+async def wait_for_slot(ticket: Ticket) -> AsyncGenerator[QueuePosition, None]:
+    """Wait until the ticket is admitted, yielding queue positions meanwhile."""
+    last_position = None
+    while not ticket.granted.is_set():
+        position = admission.position(ticket)
+        if position != last_position:
+            last_position = position
+            yield QueuePosition(position)
+        await admission.wait(ticket, timeout=QUEUE_POSITION_INTERVAL)
+
+
+# ============================================
+# Generation Budgets
+# ============================================
+
+generation_budgets = create_generation_budgets(KNOWLEDGE["examples"], faq_index)
+
+if generation_budgets:
+    print(
+        f"✂️ Generation budgets: {BUDGET_MAX_TOKENS} tokens / {BUDGET_DEADLINE:g}s by default,"
+        f" tightened from {BUDGET_TIGHTEN_QUEUE} queued requests"
+    )
+
+
+def budget_run_config(endpoint: str, user_text: str, base: RunConfig | None = STREAMING_RUN_CONFIG) -> RunConfig | None:
+    """The streaming run config with this turn's generation budget (see budgets.py); base with budgets off.
+    
+    Called once the turn has its admission slot, so the budget reflects the
+    requests still waiting behind it. Budgeted turns always stream: the
+    deadline is enforced on the model's stream.
+    """
+    if not generation_budgets:
+        return base
+    budget = generation_budgets.for_request(endpoint, user_text, queued=admission.queued if admission else 0)
+    return STREAMING_RUN_CONFIG.model_copy(update={"custom_metadata": {"budget": budget.metadata()}})
+
+
+# ============================================
+# Request Coalescing (single-flight)
+# ============================================
+
+single_flight, shared_flight_lock = create_single_flight(
+    database_url=DATABASE_URL,
+    shared_cache=isinstance(getattr(response_cache, "backend", None), PostgresCacheBackend),
+)
+
+SINGLE_FLIGHT_WAIT = float(os.environ.get("SINGLE_FLIGHT_WAIT", "60"))
+
+if single_flight:
+    print(f"🛫 Single-flight coalescing enabled{' (shared across workers)' if shared_flight_lock else ''}")
+
+
+async def generate_answer(
+    user_id: str,
+    session_id: str,
+    content: types.Content,
+    user_text: str,
+    endpoint: str,
+    cacheable: bool = True,
+    granted: asyncio.Event | None = None,
+    on_finish: Callable[[], Awaitable] | None = None,
+):
+    """Run one streaming generation for a session, then cache the answer.
+    
+    Yields QueuePosition updates while waiting for an admission slot, then
+    the agent events; errors propagate (they end the flight). granted is set
+    once the turn has its slot (a model draft waits for it). Only cacheable
+    answers not cut short by their budget are cached. on_finish runs after
+    the turn is flushed, however it ended.
+    """
+    final_response = None
+    truncated = False
+    ticket = None
+    try:
+        if admission:
+            ticket = admission.enqueue(queue_key(user_id, session_id))
+            async for update in traced_stream("admission_queue", wait_for_slot(ticket)):
+                yield update
+        if granted:
+            # A model draft may start now, under this turn's slot
+            granted.set()
+        
+        async for event in run_turn(user_id, session_id, content, budget_run_config(endpoint, user_text)):
+            if event.is_final_response() and event_text(event):
+                final_response = event_text(event)
+                truncated = truncation_flags(event).get("truncated", False)
+            yield event
+        
+        if final_response:
+            ANSWERS.labels(endpoint, "model").inc()
+        if response_cache and cacheable and final_response and not truncated:
+            await response_cache.store(user_text, final_response)
+    finally:
+        if ticket:
+            admission.release(ticket)
+        await flush_turn(user_id, session_id)
+        if on_finish:
+            await on_finish()
+
+
+async def record_flight_answer(flight: Flight, session, content: types.Content):
+    """Record a coalesced answer in a follower's session once the flight lands.
+    
+    Runs on its own so history stays complete even if the follower's
+    connection drops before the end.
+    """
+    while not flight.done:
+        await flight.wait()
+    answer = flight_answer(flight)
+    if answer and flight.error is None:
+        await record_exchange(session, content, answer)
+
+
+def flight_final(flight: Flight) -> Event | None:
+    """The final answer event among a flight's items so far."""
+    final = None
+    for item in flight.items:
+        if isinstance(item, Event) and item.is_final_response() and event_text(item):
+            final = item
+    return final
+
+
+def flight_answer(flight: Flight) -> str | None:
+    """The final answer text among a flight's items so far."""
+    final = flight_final(flight)
+    return event_text(final) if final else None
+
+
+def flight_key(user_text: str) -> str:
+    """Coalescing key for a first-turn prompt (same as its response cache key)."""
+    normalized = normalize_message(user_text)
+    if response_cache:
+        return response_cache.key_for(normalized)
+    return f"{root_agent.name}:{normalized}"
+
+
+async def join_generation(
+    user_id: str,
+    session_id: str,
+    content: types.Content,
+    user_text: str,
+    endpoint: str,
+    wrap=lambda producer: producer,
+) -> tuple[Flight, bool]:
+    """Join (or lead) the generation for an identical first-turn prompt.
+    
+    Returns the flight and whether this request is its leader. The leader's
+    session receives the events from the runner; followers must record the
+    exchange in their own session. wrap decorates the producer if this
+    request starts the flight.
+    """
+    key = flight_key(user_text)
+    on_finish = (lambda: shared_flight_lock.release(key)) if shared_flight_lock else None
+    producer = wrap(lambda granted=None: generate_answer(
+        user_id, session_id, content, user_text, endpoint, granted=granted, on_finish=on_finish,
+    ))
+    
+    if shared_flight_lock and key not in single_flight:
+        if not await shared_flight_lock.acquire(key):
+            # Another worker is generating this answer - wait for the shared cache
+            answer = await wait_for_remote_answer(
+                shared_flight_lock,
+                key,
+                lambda: response_cache.lookup(user_text),
+                timeout=SINGLE_FLIGHT_WAIT,
+            )
+            if answer is not None:
+                return canned_flight(answer, key), False
+    
+    return single_flight.join(key, producer)
+
+
+# ============================================
+# Streaming Runs (SSE and NDJSON)
+# ============================================
+
+sse_streams = ResumableStreams()
+
+
+async def prepare_stream(request: "RunRequest", endpoint: str):
+    """Shared setup of /run_sse and /run_ndjson before the response starts.
+    
+    Ensures the session exists and rejects overload while a proper status
+    code can still be sent. Returns the session id and a coroutine function
+    that starts (or joins) the generation once the response is under way and
+    returns (stream id, flight, response flags).
+    """
+    session_id = request.session_id or f"session-{uuid.uuid4().hex[:8]}"
+    
+    # Prepare message
+    content = types.Content(
+        role=request.new_message.role,
+        parts=[types.Part(text=part.text) for part in request.new_message.parts]
+    )
+    
+    # Ensure session exists (handles multi-worker scenarios)
+    session = await ensure_session(request.user_id, session_id)
+    
+    try:
+        begin = await plan_stream(
+            request.user_id, session_id, content, message_text(request.new_message), endpoint,
+            request.draft, session=session,
+        )
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    
+    async def start() -> tuple[str, Flight, dict]:
+        flight, flags = await begin()
+        return sse_streams.register(flight), flight, flags
+    
+    return session_id, start
+
+
+async def plan_stream(
+    user_id: str,
+    session_id: str,
+    content: types.Content,
+    user_text: str,
+    endpoint: str,
+    draft: bool | None,
+    session=None,
+):
+    """Decide how a streamed turn is answered and return a coroutine function starting it.
+    
+    session is the turn's session when it was just loaded; None for a later
+    turn on a /ws connection (not fresh, loaded only if a canned answer must
+    be recorded). Raises AdmissionRejected if the turn needs a new
+    generation and the queue is full. The coroutine function returns the
+    flight and the response flags.
+    """
+    faq = faq_index.match(user_text) if faq_index else None
+    
+    # Only first-turn questions are cacheable - later turns depend on history
+    fresh = session is not None and not session.events
+    cacheable = response_cache is not None and fresh
+    if faq is not None:
+        cached = faq.intent.answer
+    else:
+        cached = await response_cache.lookup(user_text) if cacheable else None
+    coalesce = fresh and single_flight is not None
+    
+    # Reject early if this request would need a new generation and the queue is full
+    if admission and cached is None and not (coalesce and flight_key(user_text) in single_flight):
+        admission.check(queue_key(user_id, session_id))
+    
+    async def start() -> tuple[Flight, dict]:
+        if cached is not None:
+            # FAQ or response cache answer - no model call
+            await record_exchange(session or await ensure_session(user_id, session_id), content, cached)
+            ANSWERS.labels(endpoint, "faq" if faq is not None else "cache").inc()
+            flags = {"cached": False, "faq_intent": faq.intent.id} if faq is not None else {"cached": True}
+            return canned_flight(cached), flags
+        if coalesce:
+            # Multicast one generation to every identical first-turn prompt
+            flight, leader = await join_generation(
+                user_id, session_id, content, user_text, endpoint,
+                wrap=lambda producer: with_draft(producer, endpoint, user_text, draft),
+            )
+            if not leader:
+                ANSWERS.labels(endpoint, "coalesced").inc()
+                asyncio.create_task(record_flight_answer(flight, session, content))
+            return flight, {"cached": False, "coalesced": not leader}
+        producer = lambda granted=None: generate_answer(
+            user_id, session_id, content, user_text, endpoint, cacheable=cacheable, granted=granted,
+        )
+        flight = start_flight(f"{endpoint}-{uuid.uuid4().hex[:12]}", with_draft(producer, endpoint, user_text, draft))
+        return flight, {"cached": False}
+    
+    return start
+
+
+# ============================================
+# Batch Runs
+# ============================================
+
+# Upper bound for a batch's concurrency (requests may ask for less)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+# How often an item waits for Retry-After and tries again when admission rejects it
+BATCH_ADMISSION_RETRIES = int(os.environ.get("BATCH_ADMISSION_RETRIES", "3"))
+
+
+def answer_source(result: dict) -> str:
+    """Where a /run response came from: faq, cache, coalesced or model."""
+    if "faq_intent" in result:
+        return "faq"
+    if result.get("cached"):
+        return "cache"
+    if result.get("coalesced"):
+        return "coalesced"
+    return "model"
+
+
+async def discard_session(user_id: str, session_id: str) -> None:
+    try:
+        await session_service.delete_session(app_name=root_agent.name, user_id=user_id, session_id=session_id)
+    except Exception as e:
+        print(f"⚠️ Could not delete temporary session {session_id}: {e}")
+
+
+async def run_batch_item(
+    index: int,
+    item: "BatchItem",
+    verbosity: str,
+    semaphore: asyncio.Semaphore,
+    session_locks: dict[str, asyncio.Lock],
+) -> dict:
+    """Run one /run_batch item; a failure becomes an error result, not a failed batch."""
+    result = {"index": index} if item.id is None else {"index": index, "id": item.id}
+    temporary = item.session_id is None
+    session_id = item.session_id or f"batch-{uuid.uuid4().hex[:12]}"
+    request = RunRequest(
+        user_id=item.user_id,
+        session_id=session_id,
+        new_message=item.new_message,
+        verbosity=verbosity,
+    )
+    # Turns of one session must not interleave
+    lock = session_locks.setdefault(session_id, asyncio.Lock())
+    try:
+        async with lock, semaphore:
+            start = time.perf_counter()
+            for attempt in range(BATCH_ADMISSION_RETRIES + 1):
+                try:
+                    response = await run_once(request, endpoint="run_batch")
+                    break
+                except AdmissionRejected as e:
+                    if attempt == BATCH_ADMISSION_RETRIES:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+            result["seconds"] = round(time.perf_counter() - start, 3)
+        if temporary:
+            del response["session_id"]
+        result.update(response)
+    except AdmissionRejected as e:
+        result.update(error=e.detail, status=e.status_code)
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if temporary:
+            await discard_session(item.user_id, session_id)
+    return result
 
 
 # ============================================
@@ -86,15 +827,40 @@ class Message(BaseModel):
     parts: list[MessagePart]
 
 class RunRequest(BaseModel):
-    user_id: str = "default_user"
+    user_id: str = ANONYMOUS_USER
     session_id: str | None = None
     new_message: Message
     streaming: bool = False
+    # /run and /run_ndjson: which events to include besides the final text
+    verbosity: Literal["final", "summary", "full"] = "full"
+    # /run_sse and /run_ndjson: stream a draft while the model prefills
+    # (default: DRAFT_ENDPOINTS)
+    draft: bool | None = None
+
+class BatchItem(BaseModel):
+    # Echoed back on the result line, to match results to items
+    id: str | None = None
+    user_id: str = "batch"
+    # Set: the turn runs in (and is kept in) that session; items sharing a
+    # session run in order. Unset: a temporary session, deleted afterwards
+    session_id: str | None = None
+    new_message: Message
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+    concurrency: int | None = None
+    verbosity: Literal["final", "summary", "full"] = "final"
 
 class SessionCreateRequest(BaseModel):
-    user_id: str = "default_user"
+    user_id: str = ANONYMOUS_USER
     session_id: str | None = None
 
+# ============================================
+# Event Loop Diagnostics
+# ============================================
+
+loop_monitor = create_loop_monitor()
+
 # ============================================
 # Lifespan Management
 # ============================================
@@ -104,8 +870,40 @@ async def lifespan(app: FastAPI):
     # Startup
     print(f"🚀 Starting ADK Agent Server: {root_agent.name}")
     print(f"📡 Ollama API Base: {os.environ.get('OLLAMA_API_BASE', 'not set')}")
+    if loop_monitor:
+        loop_monitor.start()
+    pruner = None
+    if DATABASE_URL and SESSION_TTL > 0:
+        pruner = asyncio.create_task(run_session_pruner(session_service))
+    # Warm up in the background, so a slow or absent Ollama doesn't block startup
+    warmer = asyncio.create_task(ollama_keep_alive.run()) if ollama_keep_alive else None
+    health_checks = None
+    if llm_router:
+        print(f"🔀 LLM router: {', '.join(b.url for b in llm_router.backends)}"
+              f"{f' (short prompts -> {llm_router.small_model})' if llm_router.small_model else ''}")
+        health_checks = asyncio.create_task(llm_router.run_health_checks())
+    llama_warmer = None
+    if llamacpp_client:
+        print(f"🦙 LLM backend: llama.cpp on {llamacpp_client.url}")
+        llama_warmer = asyncio.create_task(llamacpp_client.warm_up(str(root_agent.instruction)))
+    if a2a_app is not None and A2A_APP == "eager":
+        await a2a_app.start()
     yield
     # Shutdown
+    if a2a_app is not None:
+        await a2a_app.aclose()
+    if pruner:
+        pruner.cancel()
+    if health_checks:
+        health_checks.cancel()
+    if warmer:
+        warmer.cancel()
+    if llama_warmer:
+        llama_warmer.cancel()
+    if loop_monitor:
+        loop_monitor.stop()
+    await http_client().close()
+    await session_service.flush()
     print("👋 Shutting down ADK Agent Server")
 
 # ============================================
@@ -128,6 +926,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request durations for /metrics, measured until the last byte of the body
+app.add_middleware(MetricsMiddleware)
+
 # ============================================
 # Endpoints
 # ============================================
@@ -137,6 +938,81 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "agent": root_agent.name}
 
+@app.get("/health/db")
+async def database_health():
+    """Connection pool occupancy and database round-trip check"""
+    if not DATABASE_URL:
+        return {"status": "disabled", "detail": "In-memory sessions (DATABASE_URL not set)"}
+    health = await pool_health(get_engine(DATABASE_URL))
+    if health["status"] != "healthy":
+        raise HTTPException(status_code=503, detail=health)
+    return health
+
+@app.get("/stats")
+async def stats():
+    """FAQ, cache, coalescing, admission and budget counters for this worker"""
+    return {
+        "faq": faq_index.stats() if faq_index else None,
+        "response_cache": await response_cache.stats() if response_cache else None,
+        "single_flight": single_flight.stats() if single_flight else None,
+        "admission": admission.stats() if admission else None,
+        "sessions": await session_stats(session_service),
+        "history": history_stats.stats() if history_compaction_enabled() else None,
+        "llm_router": llm_router.stats() if llm_router else None,
+        "llamacpp": llamacpp_client.stats() if llamacpp_client else None,
+        "ollama": ollama_keep_alive.stats() if ollama_keep_alive else None,
+        "sse_streams": sse_streams.stats(),
+        "websockets": ws_stats.stats(),
+        "drafts": drafter.stats() if drafter else None,
+        "budgets": generation_budgets.stats() if generation_budgets else None,
+        "a2a_tasks": await a2a_task_store.stats() if a2a_task_store else None,
+        "event_loop": loop_monitor.stats() if loop_monitor else None,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (all workers when PROMETHEUS_MULTIPROC_DIR is set)"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/admin/profile")
+async def profile_worker(
+    seconds: float = 10,
+    interval_ms: float = 10,
+    threads: Literal["loop", "all"] = "loop",
+    idle: bool = False,
+    x_admin_token: str | None = Header(None),
+):
+    """Sample this worker's stacks for a while and return them as collapsed stacks
+    
+    The output is flamegraph.pl / speedscope / inferno input. threads=all
+    also samples the worker's other threads (thread pools); idle=true keeps
+    the samples of a loop waiting for I/O. Requires ADMIN_TOKEN.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (ADMIN_TOKEN not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid X-Admin-Token")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=422, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=422, detail="interval_ms must be between 1 and 1000")
+    
+    thread_ids = {threading.get_ident()} if threads == "loop" else None
+    try:
+        stacks, counts = await asyncio.to_thread(sample_stacks, thread_ids, seconds, interval_ms / 1000, idle)
+    except ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        content=render_collapsed(stacks),
+        media_type="text/plain",
+        headers={
+            "X-Profile-Samples": str(counts["samples"]),
+            "X-Profile-Idle-Samples": str(counts["idle"]),
+            "X-Worker-Pid": str(os.getpid()),
+        },
+    )
+
 @app.post("/sessions")
 async def create_session(request: SessionCreateRequest):
     """Create a new session"""
@@ -156,12 +1032,21 @@ async def create_session(request: SessionCreateRequest):
 
 @app.post("/run")
 async def run_agent(request: RunRequest):
-    """Run agent and return complete response (non-streaming)"""
+    """Run agent and return complete response (non-streaming)
     
+    verbosity=final skips serializing the intermediate events entirely.
+    """
+    try:
+        return await run_once(request)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+async def run_once(request: RunRequest, endpoint: str = "run") -> dict:
+    """One complete /run turn (raises AdmissionRejected when overloaded)."""
     session_id = request.session_id or f"session-{uuid.uuid4().hex[:8]}"
     
     # Ensure session exists (handles multi-worker scenarios)
-    await ensure_session(request.user_id, session_id)
+    session = await ensure_session(request.user_id, session_id)
     
     # Prepare message
     content = types.Content(
@@ -169,142 +1054,416 @@ async def run_agent(request: RunRequest):
         parts=[types.Part(text=part.text) for part in request.new_message.parts]
     )
     
-    # Collect all events
-    events = []
+    user_text = message_text(request.new_message)
+    
+    # Canned answers don't depend on history, so the FAQ applies on any turn
+    faq = faq_index.match(user_text) if faq_index else None
+    if faq is not None:
+        await record_exchange(session, content, faq.intent.answer)
+        ANSWERS.labels(endpoint, "faq").inc()
+        return canned_run_response(session_id, faq.intent.answer, request.verbosity, cached=False, faq_intent=faq.intent.id)
+    
+    # Only first-turn questions are cacheable - later turns depend on history
+    fresh = not session.events
+    cacheable = response_cache is not None and fresh
+    
+    if cacheable:
+        cached = await response_cache.lookup(user_text)
+        if cached is not None:
+            await record_exchange(session, content, cached)
+            ANSWERS.labels(endpoint, "cache").inc()
+            return canned_run_response(session_id, cached, request.verbosity, cached=True)
+    
+    serialize = EVENT_SERIALIZERS[request.verbosity]
+    events = [] if serialize else None
     final_response = None
+    truncation = {}
     
+    def collect(event) -> None:
+        nonlocal final_response, truncation
+        # Budgeted turns stream; /run only returns complete events
+        if event.partial:
+            return
+        if serialize:
+            events.append(serialize(event))
+        if event.is_final_response() and event_text(event):
+            final_response = event_text(event)
+            truncation = truncation_flags(event)
+    
+    if fresh and single_flight is not None:
+        # Share one generation between identical first-turn prompts
+        flight, leader = await join_generation(request.user_id, session_id, content, user_text, endpoint)
+        async for event in flight.subscribe():
+            if isinstance(event, Event):
+                collect(event)
+        
+        # The leader's answer is counted by generate_answer
+        if not leader:
+            if final_response:
+                await record_exchange(session, content, final_response)
+            ANSWERS.labels(endpoint, "coalesced").inc()
+        
+        return run_response(session_id, final_response, events, cached=False, coalesced=not leader, **truncation)
+    
+    ticket = None
     try:
-        async for event in runner.run_async(
-            user_id=request.user_id,
-            session_id=session_id,
-            new_message=content
-        ):
-            events.append({
-                "author": getattr(event, 'author', None),
-                "content": event.content.model_dump() if event.content else None,
-                "is_final": event.is_final_response()
-            })
-            
-            if event.is_final_response() and event.content and event.content.parts:
-                final_response = event.content.parts[0].text
-    except ValueError as e:
-        if "Session not found" in str(e):
-            # Session was lost, recreate and retry
-            await ensure_session(request.user_id, session_id)
-            async for event in runner.run_async(
-                user_id=request.user_id,
-                session_id=session_id,
-                new_message=content
-            ):
-                events.append({
-                    "author": getattr(event, 'author', None),
-                    "content": event.content.model_dump() if event.content else None,
-                    "is_final": event.is_final_response()
-                })
-                
-                if event.is_final_response() and event.content and event.content.parts:
-                    final_response = event.content.parts[0].text
-        else:
-            raise
+        if admission:
+            ticket = admission.enqueue(queue_key(request.user_id, session_id))
+            async for _ in traced_stream("admission_queue", wait_for_slot(ticket)):
+                pass
+        
+        async for event in run_turn(request.user_id, session_id, content, budget_run_config(endpoint, user_text, base=None)):
+            collect(event)
+    finally:
+        if ticket:
+            admission.release(ticket)
+        await flush_turn(request.user_id, session_id)
     
-    return {
-        "session_id": session_id,
-        "response": final_response,
-        "events": events
-    }
+    if cacheable and final_response and not truncation.get("truncated"):
+        await response_cache.store(user_text, final_response)
+    ANSWERS.labels(endpoint, "model").inc()
+    
+    return run_response(session_id, final_response, events, cached=False, **truncation)
+
+@app.post("/run_batch")
+async def run_batch(request: BatchRequest):
+    """Run many prompts and stream one NDJSON result line per item as it finishes
+    
+    The last line reports totals and throughput for the whole batch.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    if admission:
+        # Stay within the per-user queue, otherwise items would just be rejected
+        concurrency = min(concurrency, admission.max_queue_per_user)
+    
+    async def line_generator() -> AsyncGenerator[str, None]:
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        session_locks: dict[str, asyncio.Lock] = {}
+        totals = {"succeeded": 0, "failed": 0, "sources": {}}
+        tasks = [
+            asyncio.create_task(run_batch_item(index, item, request.verbosity, semaphore, session_locks))
+            for index, item in enumerate(request.items)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if "error" in result:
+                    totals["failed"] += 1
+                else:
+                    totals["succeeded"] += 1
+                    source = answer_source(result)
+                    totals["sources"][source] = totals["sources"].get(source, 0) + 1
+                yield encode_line(result)
+        finally:
+            # Client went away - don't keep generating for nobody
+            for task in tasks:
+                task.cancel()
+        
+        elapsed = time.perf_counter() - start
+        yield encode_line({
+            "done": True,
+            "items": len(tasks),
+            **totals,
+            "concurrency": concurrency,
+            "seconds": round(elapsed, 3),
+            "items_per_second": round(len(tasks) / elapsed, 2) if elapsed > 0 else None,
+        })
+    
+    return streaming_response(traced_stream("batch_stream", line_generator()), media_type="application/x-ndjson")
 
 @app.post("/run_sse")
-async def run_agent_sse(request: RunRequest):
-    """Run agent with Server-Sent Events streaming"""
+async def run_agent_sse(request: RunRequest, last_event_id: str | None = Header(None)):
+    """Run agent with Server-Sent Events streaming
     
-    session_id = request.session_id or f"session-{uuid.uuid4().hex[:8]}"
+    Reconnecting with a Last-Event-ID header resumes the stream from the
+    buffer instead of starting a new generation.
+    """
     
-    # Prepare message
-    content = types.Content(
-        role=request.new_message.role,
-        parts=[types.Part(text=part.text) for part in request.new_message.parts]
-    )
+    if last_event_id:
+        resumed = sse_streams.resume(last_event_id)
+        if resumed is None:
+            raise HTTPException(status_code=410, detail="Stream expired, send the message again without Last-Event-ID")
+        stream_id, flight, start = resumed
+        
+        async def resume_generator() -> AsyncGenerator[str, None]:
+            async for chunk in stream_events(sse_streams, stream_id, flight, sse_payload, start=start):
+                yield chunk
+            yield "data: [DONE]\n\n"
+        
+        return streaming_response(resume_generator())
+    
+    session_id, start_stream = await prepare_stream(request, "run_sse")
+    ttft = FirstTextTimer("run_sse")
     
     async def event_generator() -> AsyncGenerator[str, None]:
         """Generate SSE events"""
-        import json
-        
-        # Always ensure session exists inside the generator
-        # This handles multi-worker scenarios where session might not exist in this worker
-        await ensure_session(request.user_id, session_id)
+        try:
+            stream_id, flight, _ = await start_stream()
+        except Exception as e:
+            yield encode_event({'error': str(e)})
+            yield "data: [DONE]\n\n"
+            return
         
-        # Enable SSE streaming mode for token-by-token streaming
-        run_config = RunConfig(streaming_mode=StreamingMode.SSE)
+        async for chunk in stream_events(sse_streams, stream_id, flight, sse_payload, ttft=ttft):
+            yield chunk
+        yield "data: [DONE]\n\n"
+    
+    return streaming_response(traced_stream("sse_stream", event_generator()))
+
+@app.post("/run_ndjson")
+async def run_agent_ndjson(request: RunRequest):
+    """Run agent and stream newline-delimited JSON (for non-browser clients)
+    
+    One JSON object per line: queue positions, text deltas, complete events
+    (per verbosity) and finally the /run response fields with "done": true.
+    """
+    session_id, start_stream = await prepare_stream(request, "run_ndjson")
+    ttft = FirstTextTimer("run_ndjson")
+    serialize = EVENT_SERIALIZERS[request.verbosity]
+    
+    async def line_generator() -> AsyncGenerator[str, None]:
+        try:
+            _, flight, flags = await start_stream()
+        except Exception as e:
+            yield encode_line({'error': str(e)})
+            return
         
+        final = None
+        items = flight.subscribe()
         try:
-            async for event in runner.run_async(
-                user_id=request.user_id,
-                session_id=session_id,
-                new_message=content,
-                run_config=run_config
-            ):
-                event_data = {
-                    "author": getattr(event, 'author', None),
-                    "is_final": event.is_final_response(),
-                }
-                
-                if event.content and event.content.parts:
-                    for part in event.content.parts:
-                        if hasattr(part, 'text') and part.text:
-                            event_data["text"] = part.text
-                
-                yield f"data: {json.dumps(event_data)}\n\n"
-        except ValueError as e:
-            if "Session not found" in str(e):
-                # Session was lost between ensure and run, recreate and retry
-                await ensure_session(request.user_id, session_id)
-                async for event in runner.run_async(
-                    user_id=request.user_id,
-                    session_id=session_id,
-                    new_message=content,
-                    run_config=run_config
-                ):
-                    event_data = {
-                        "author": getattr(event, 'author', None),
-                        "is_final": event.is_final_response(),
-                    }
-                    
-                    if event.content and event.content.parts:
-                        for part in event.content.parts:
-                            if hasattr(part, 'text') and part.text:
-                                event_data["text"] = part.text
-                    
-                    yield f"data: {json.dumps(event_data)}\n\n"
-            else:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            async for item in items:
+                if isinstance(item, Event) and item.is_final_response() and event_text(item):
+                    final = item
+                data = ndjson_payload(item, serialize)
+                if data is None:
+                    continue
+                if "text" in data:
+                    ttft.mark()
+                yield encode_line(data)
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield encode_line({'error': str(e)})
+        finally:
+            await items.aclose()
+            sse_streams.detach(flight)
         
-        yield "data: [DONE]\n\n"
+        yield encode_line({
+            "session_id": session_id,
+            "response": event_text(final) if final else None,
+            **flags,
+            **(truncation_flags(final) if final else {}),
+            "done": True,
+        })
     
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",  # Disable nginx buffering
-        }
-    )
+    return streaming_response(traced_stream("ndjson_stream", line_generator()), media_type="application/x-ndjson")
+
+# ============================================
+# WebSocket Chat
+# ============================================
+
+ws_stats = WebSocketStats()
+
+
+def pin_session(user_id: str, session_id: str, pinned: bool = True) -> None:
+    """Keep a session in the session cache while a connection uses it."""
+    if isinstance(session_service, CachedSessionService):
+        if pinned:
+            session_service.pin(root_agent.name, user_id, session_id)
+        else:
+            session_service.unpin(root_agent.name, user_id, session_id)
+
+
+async def ws_turn(sender: FrameSender, user_id: str, session_id: str, session, turn: int, message: dict, state: dict):
+    """One /ws turn: stream the answer, then a done frame.
+    
+    While state["cancellable"] is set, cancelling the task cancels the turn
+    (and its generation, unless other requests share it).
+    """
+    text = message.get("text")
+    draft = message.get("draft")
+    if not isinstance(text, str) or not text.strip() or not isinstance(draft, (bool, type(None))):
+        ws_stats.turn("error")
+        await sender.send({"error": "A run message needs a non-empty \"text\"", "turn": turn})
+        await sender.send({"done": True, "turn": turn})
+        return
+    
+    content = types.Content(role="user", parts=[types.Part(text=text)])
+    ttft = FirstTextTimer("ws")
+    flight = None
+    flags = {}
+    failure = None
+    cancelled = False
+    state["cancellable"] = True
+    try:
+        try:
+            begin = await plan_stream(user_id, session_id, content, text, "ws", draft, session=session)
+            flight, flags = await begin()
+        except AdmissionRejected as e:
+            failure = "rejected", {"error": e.detail, "status": e.status_code, "retry_after": e.retry_after}
+        except Exception as e:
+            failure = "error", {"error": str(e)}
+        if flight is not None:
+            flight.subscribers += 1
+            try:
+                await send_flight(sender, flight, ws_frame, ttft=ttft)
+            finally:
+                flight.subscribers -= 1
+                if not flight.done and flight.subscribers == 0 and flight.task is not None:
+                    flight.task.cancel()
+    except asyncio.CancelledError:
+        cancelled = True
+    finally:
+        state["cancellable"] = False
+    
+    if flight is not None and flight.task is not None and not flags.get("coalesced"):
+        # This turn's own generation has stopped and is flushed before the next
+        # turn; a follower's answer is recorded by record_flight_answer instead
+        await asyncio.wait({flight.task})
+    if cancelled:
+        ws_stats.turn("cancelled")
+        await sender.send({"done": True, "turn": turn, "cancelled": True})
+        return
+    if failure is None and flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+        failure = "error", {"error": str(flight.error)}
+    if failure is not None:
+        outcome, error = failure
+        ws_stats.turn(outcome)
+        await sender.send({**error, "turn": turn})
+        await sender.send({"done": True, "turn": turn})
+        return
+    ws_stats.turn("done")
+    final = flight_final(flight)
+    await sender.send({
+        "done": True,
+        "turn": turn,
+        "response": event_text(final) if final else None,
+        **flags,
+        **(truncation_flags(final) if final else {}),
+    })
+
+
+@app.websocket("/ws")
+async def chat_socket(
+    websocket: WebSocket,
+    user_id: str = ANONYMOUS_USER,
+    session_id: str | None = None,
+    frames: Literal["text", "binary"] = "text",
+):
+    """Multi-turn chat on one connection, bound to one session (see websocket.py)"""
+    session_id = session_id or f"session-{uuid.uuid4().hex[:8]}"
+    await websocket.accept()
+    session = await ensure_session(user_id, session_id)
+    pin_session(user_id, session_id)
+    sender = FrameSender(websocket, binary=frames == "binary")
+    ws_stats.opened()
+    turn: asyncio.Task | None = None
+    turns = 0
+    state = {"cancellable": False}
+    
+    def finished(task: asyncio.Task) -> None:
+        if not task.cancelled() and isinstance(task.exception(), SlowConsumer):
+            ws_stats.slow_consumers += 1
+            asyncio.create_task(websocket.close(code=CLOSE_TRY_AGAIN_LATER))
+    
+    try:
+        await sender.send({"session_id": session_id, "ready": True})
+        while True:
+            try:
+                message = await receive_message(websocket, WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if turn is not None and not turn.done():
+                    continue
+                await websocket.close(code=CLOSE_NORMAL, reason="idle")
+                break
+            except ValueError as e:
+                await sender.send({"error": str(e)})
+                continue
+            if message is None:
+                break
+            
+            kind = message.get("type", "run")
+            if kind == "cancel":
+                if turn is not None and not turn.done() and state["cancellable"]:
+                    turn.cancel()
+                    # Wait for the generation to stop, so a following run starts cleanly
+                    await asyncio.wait({turn})
+            elif kind == "run":
+                if turn is not None and not turn.done():
+                    await sender.send({"error": "A turn is already running, cancel it first"})
+                    continue
+                turns += 1
+                # The session object is only current before the first turn
+                turn = asyncio.create_task(
+                    ws_turn(sender, user_id, session_id, session if turns == 1 else None, turns, message, state)
+                )
+                turn.add_done_callback(finished)
+            else:
+                await sender.send({"error": f"Unknown message type: {kind}"})
+    except (WebSocketDisconnect, SlowConsumer, RuntimeError):
+        # Gone while sending (RuntimeError: the socket is already closed)
+        pass
+    finally:
+        if turn is not None and not turn.done():
+            turn.cancel()
+            await asyncio.wait({turn})
+        pin_session(user_id, session_id, pinned=False)
+        ws_stats.closed(sender)
 
 # ============================================
 # Mount A2A Application (optional)
 # ============================================
 
-try:
-    from .agent import a2a_app
-    from starlette.routing import Mount
+a2a_app = None
+a2a_task_store = None
+
+
+@asynccontextmanager
+async def a2a_turn(user_id: str, session_id: str):
+    """Admission slot and session flush around an A2A turn, as for /run."""
+    ticket = admission.enqueue(queue_key(user_id, session_id)) if admission else None
+    try:
+        if ticket:
+            async for _ in traced_stream("admission_queue", wait_for_slot(ticket)):
+                pass
+        yield
+    finally:
+        if ticket:
+            admission.release(ticket)
+        await flush_turn(user_id, session_id)
+
+
+def build_a2a_app():
+    """The A2A app on this server's runner, sessions and admission control (see a2a_service.py)."""
+    global a2a_task_store
+    from . import agent as agent_module
+    from .a2a_service import A2A_PUBLIC_URL, SharedRunnerExecutor, create_task_store, task_store_lifespan
     
-    # Mount A2A at /a2a path
-    app.mount("/a2a", a2a_app)
-    print("✅ A2A endpoints mounted at /a2a")
-except Exception as e:
-    print(f"⚠️ A2A endpoints not available: {e}")
+    a2a_task_store = create_task_store(DATABASE_URL)
+    return agent_module.create_a2a_app(
+        # Where the mount below is reached, not a port of its own
+        url=A2A_PUBLIC_URL or "http://localhost:8000/a2a/",
+        runner=runner,
+        task_store=a2a_task_store,
+        agent_executor_factory=lambda shared_runner: SharedRunnerExecutor(shared_runner, a2a_turn),
+        lifespan=task_store_lifespan(a2a_task_store),
+    )
+
+
+if A2A_APP != "off":
+    # Built on the first /a2a request unless A2A_APP=eager (see startup.py)
+    a2a_app = LazyApp(build_a2a_app, "A2A")
+    if A2A_APP == "eager":
+        try:
+            # With gunicorn --preload this happens once, in the master
+            a2a_app.build()
+        except Exception as e:
+            print(f"⚠️ A2A endpoints not available: {e}")
+            a2a_app = None
+    if a2a_app is not None:
+        app.mount("/a2a", a2a_app)
+        print(f"✅ A2A endpoints mounted at /a2a ({A2A_APP})")
 
 # ============================================
 # Run directly for development
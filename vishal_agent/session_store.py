@@ -0,0 +1,324 @@
+"""
+Shared Session Store
+
+Sessions for single-host deployments without PostgreSQL. With
+SESSION_STORE=shared, one small process keeps every session in memory and
+the gunicorn workers reach it over a Unix socket (SESSION_STORE_SOCKET), so
+a session created by one worker is there for all of them:
+
+- gunicorn.conf.py starts the store next to the workers. Without it (plain
+  uvicorn, a custom gunicorn command) the first worker that finds no store
+  serves it from its own event loop; a lock file next to the socket makes
+  sure only one process ever serves a socket
+- Every operation runs to completion in the store's event loop, so appends
+  from different workers never interleave halfway
+- Sessions idle for longer than SESSION_TTL (0 = never) are evicted. Beyond
+  SESSION_STORE_MAX_MB the least recently used sessions go first
+- Protocol: one JSON object per line in each direction. Events travel as
+  the JSON text the worker produced and are stored as-is; the store never
+  parses them
+
+Sessions live as long as the store process. SharedSessionService in
+sessions.py is the client. This module only needs the standard library
+(orjson when installed), so the store process doesn't import the agent:
+
+    python vishal_agent/session_store.py --socket /tmp/vishal_agent_sessions.sock
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import time
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SESSION_STORE_SOCKET = os.environ.get("SESSION_STORE_SOCKET", "/tmp/vishal_agent_sessions.sock")
+SESSION_STORE_MAX_MB = float(os.environ.get("SESSION_STORE_MAX_MB", "256"))
+SESSION_TTL = float(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+
+# Longest request/response line (a session with all of its events)
+LINE_LIMIT = 64 * 1024 * 1024
+# Rough per-session bookkeeping overhead for the memory cap
+SESSION_OVERHEAD = 512
+
+APP_PREFIX = "app:"
+USER_PREFIX = "user:"
+TEMP_PREFIX = "temp:"
+
+
+def dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode()
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def split_state(state: dict) -> tuple[dict, dict, dict]:
+    """(app, user, session) parts of a state dict, without prefixes; temp: keys dropped."""
+    app, user, session = {}, {}, {}
+    for key, value in (state or {}).items():
+        if key.startswith(APP_PREFIX):
+            app[key[len(APP_PREFIX):]] = value
+        elif key.startswith(USER_PREFIX):
+            user[key[len(USER_PREFIX):]] = value
+        elif not key.startswith(TEMP_PREFIX):
+            session[key] = value
+    return app, user, session
+
+
+class StoreError(Exception):
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+class _Session:
+    __slots__ = ("app_name", "user_id", "id", "state", "events", "last_update_time", "touched", "size")
+
+    def __init__(self, app_name: str, user_id: str, session_id: str, state: dict):
+        self.app_name = app_name
+        self.user_id = user_id
+        self.id = session_id
+        self.state = state
+        # (timestamp, event JSON)
+        self.events: list[tuple[float, str]] = []
+        self.last_update_time = time.time()
+        self.touched = time.monotonic()
+        self.size = SESSION_OVERHEAD + len(dumps(state))
+
+
+class SessionStore:
+    """All sessions of a host, in LRU order (least recently used first)."""
+
+    def __init__(self, ttl: float = SESSION_TTL, max_bytes: int = int(SESSION_STORE_MAX_MB * 1024 * 1024)):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sessions: OrderedDict[tuple[str, str, str], _Session] = OrderedDict()
+        self.app_state: dict[str, dict] = {}
+        self.user_state: dict[tuple[str, str], dict] = {}
+        self.bytes = 0
+        self.requests = 0
+        self.evicted = {"ttl": 0, "memory": 0}
+        self.lock = None
+        self.evictions: asyncio.Task | None = None
+
+    # ---------- Bookkeeping ----------
+
+    def _expired(self, session: _Session, now: float) -> bool:
+        return self.ttl > 0 and now - session.touched > self.ttl
+
+    def _touch(self, key, session: _Session) -> None:
+        session.touched = time.monotonic()
+        self.sessions.move_to_end(key)
+
+    def _resize(self, session: _Session, delta: int) -> None:
+        session.size += delta
+        self.bytes += delta
+
+    def _remove(self, key) -> None:
+        session = self.sessions.pop(key, None)
+        if session is not None:
+            self.bytes -= session.size
+
+    def evict(self) -> None:
+        """Drop idle sessions, then the least recently used ones while over the cap."""
+        now = time.monotonic()
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if self._expired(session, now):
+                self.evicted["ttl"] += 1
+            elif self.bytes > self.max_bytes:
+                self.evicted["memory"] += 1
+            else:
+                break
+            self._remove(key)
+
+    def _lookup(self, key) -> _Session | None:
+        session = self.sessions.get(key)
+        if session is not None and self._expired(session, time.monotonic()):
+            self.evicted["ttl"] += 1
+            self._remove(key)
+            return None
+        return session
+
+    def _apply_state(self, app_name: str, user_id: str, session: _Session, state: dict) -> None:
+        app, user, own = split_state(state)
+        if app:
+            self.app_state.setdefault(app_name, {}).update(app)
+        if user:
+            self.user_state.setdefault((app_name, user_id), {}).update(user)
+        if own:
+            before = len(dumps(session.state))
+            session.state.update(own)
+            self._resize(session, len(dumps(session.state)) - before)
+
+    def _session_json(self, session: _Session, events: list[str] | None = None) -> str:
+        state = dict(session.state)
+        state.update({APP_PREFIX + k: v for k, v in self.app_state.get(session.app_name, {}).items()})
+        state.update({USER_PREFIX + k: v for k, v in self.user_state.get((session.app_name, session.user_id), {}).items()})
+        head = dumps({
+            "id": session.id,
+            "app_name": session.app_name,
+            "user_id": session.user_id,
+            "state": state,
+            "last_update_time": session.last_update_time,
+        })
+        if events is None:
+            return head
+        return f'{head[:-1]},"events":[{",".join(events)}]}}'
+
+    # ---------- Operations ----------
+
+    def op_create(self, key: list, state: dict | None = None) -> str:
+        key = tuple(key)
+        if self._lookup(key) is not None:
+            raise StoreError("exists", f"Session with id {key[2]} already exists.")
+        return self._create(key, state)
+
+    def _create(self, key: tuple, state: dict | None) -> str:
+        session = _Session(*key, {})
+        self.sessions[key] = session
+        self.bytes += session.size
+        self._apply_state(key[0], key[1], session, state or {})
+        self.evict()
+        return self._session_json(session, [])
+
+    def op_get(self, key: list, num_recent_events: int | None = None, after_timestamp: float | None = None) -> str:
+        key = tuple(key)
+        session = self._lookup(key)
+        if session is None:
+            return "null"
+        self._touch(key, session)
+        events = session.events
+        if num_recent_events is not None:
+            events = events[-num_recent_events:] if num_recent_events > 0 else []
+        if after_timestamp is not None:
+            events = [event for event in events if event[0] >= after_timestamp]
+        return self._session_json(session, [event for _, event in events])
+
+    def op_get_or_create(self, key: list) -> str:
+        session = self._lookup(tuple(key))
+        if session is None:
+            return self._create(tuple(key), None)
+        return self.op_get(key)
+
+    def op_append(self, key: list, event: str, timestamp: float, state_delta: dict | None = None) -> str:
+        key = tuple(key)
+        session = self._lookup(key)
+        if session is None:
+            raise StoreError("not_found", f"Session {key[2]} not found.")
+        session.events.append((timestamp, event))
+        session.last_update_time = timestamp
+        self._resize(session, len(event))
+        if state_delta:
+            self._apply_state(key[0], key[1], session, state_delta)
+        self._touch(key, session)
+        self.evict()
+        return "null"
+
+    def op_delete(self, key: list) -> str:
+        self._remove(tuple(key))
+        return "null"
+
+    def op_list(self, app_name: str, user_id: str | None = None) -> str:
+        sessions = [
+            self._session_json(session)
+            for (app, user, _), session in self.sessions.items()
+            if app == app_name and (user_id is None or user == user_id)
+        ]
+        return f"[{','.join(sessions)}]"
+
+    def op_user_state(self, app_name: str, user_id: str) -> str:
+        return dumps(self.user_state.get((app_name, user_id), {}))
+
+    def op_stats(self) -> str:
+        return dumps({
+            "sessions": len(self.sessions),
+            "events": sum(len(s.events) for s in self.sessions.values()),
+            "mb": round(self.bytes / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "requests": self.requests,
+            "evicted": self.evicted,
+        })
+
+    def handle(self, line: bytes) -> str:
+        """One request line -> one response line."""
+        self.requests += 1
+        try:
+            request = loads(line)
+            op = getattr(self, f"op_{request.pop('op')}", None)
+            if op is None:
+                raise StoreError("bad_request", "Unknown operation")
+            return f'{{"result":{op(**request)}}}\n'
+        except StoreError as e:
+            return dumps({"error": str(e), "kind": e.kind}) + "\n"
+        except Exception as e:
+            return dumps({"error": str(e), "kind": "bad_request"}) + "\n"
+
+    # ---------- Server ----------
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                writer.write(self.handle(line).encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def run_evictions(self) -> None:
+        while True:
+            await asyncio.sleep(max(1.0, min(self.ttl / 4, 60.0)))
+            self.evict()
+
+
+async def serve(path: str = SESSION_STORE_SOCKET, store: SessionStore | None = None) -> asyncio.Server | None:
+    """Serve a store on path, unless another process already does (then None).
+
+    The process that holds the lock file serves the socket; the lock goes
+    away with the process, so a stale socket file is simply replaced.
+    """
+    lock = open(f"{path}.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    if os.path.exists(path):
+        os.unlink(path)
+    store = store or SessionStore()
+    # The server references the store, which keeps the lock and the eviction task alive
+    store.lock = lock
+    store.evictions = asyncio.create_task(store.run_evictions())
+    return await asyncio.start_unix_server(store.serve_connection, path=path, limit=LINE_LIMIT)
+
+
+async def main(path: str) -> None:
+    server = await serve(path)
+    if server is None:
+        print(f"⚠️ A session store is already serving {path}")
+        return
+    print(f"🗃️ Shared session store listening on {path} "
+          f"(TTL {SESSION_TTL:.0f}s, max {SESSION_STORE_MAX_MB:.0f} MB)")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared in-memory session store for the agent workers")
+    parser.add_argument("--socket", default=SESSION_STORE_SOCKET)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.socket))
+    except KeyboardInterrupt:
+        pass
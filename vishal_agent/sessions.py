@@ -0,0 +1,618 @@
+"""
+Cached Session Service
+
+Every turn used to cost a pile of database round trips: ensure_session
+(get_session, then create_session on a miss), the runner's own get_session,
+and one locked read-modify-write transaction per appended event.
+
+CachedSessionService wraps ADK's DatabaseSessionService and cuts that down:
+
+- Hot sessions live in a per-worker LRU. A cached session is only served
+  after a single-row version check (the session's update marker in the
+  sessions table), so writes from other workers are never missed
+- Sessions can be pinned (a /ws connection pins its session while it is
+  open), the LRU never evicts those
+- get_or_create_session replaces get-then-create with one upsert
+  transaction
+- append_event only buffers the event (and applies it to the in-memory
+  session); flush_session writes all events of a turn in one transaction,
+  with the same stale-session check ADK does per event
+
+Non-partial events are kept in memory until the turn is flushed, so the
+server flushes in a finally block after every runner call.
+
+The version check, the upsert and the batched write use helpers of
+DatabaseSessionService that are not public API (written against ADK 2.12,
+see requirements.txt). If an ADK version lacks one of them, the server uses
+the plain DatabaseSessionService instead of failing at the first turn.
+
+Sessions idle for longer than SESSION_TTL are pruned from the database by a
+background task (run_session_pruner), their events go with them (ON DELETE
+CASCADE).
+
+SESSION_STORE=shared (without DATABASE_URL) keeps sessions in one
+in-memory store per host that all workers reach over a Unix socket
+(session_store.py); SharedSessionService is its client.
+"""
+
+import asyncio
+import copy
+import os
+import random
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, DatabaseSessionService, Session, State
+from google.adk.sessions import _session_util
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.errors.session_not_found_error import SessionNotFoundError
+from google.adk.errors._stale_session_error import StaleSessionError
+
+from . import session_store
+from .db import get_engine
+
+SessionKey = tuple[str, str, str]
+
+
+def _key(app_name: str, user_id: str, session_id: str) -> SessionKey:
+    return (app_name, user_id, session_id)
+
+
+def _merge_state(app_state: dict, user_state: dict) -> dict:
+    """State of a new session: app and user state under their prefixes."""
+    merged = {State.APP_PREFIX + key: value for key, value in app_state.items()}
+    merged.update({State.USER_PREFIX + key: value for key, value in user_state.items()})
+    return merged
+
+
+# DatabaseSessionService internals the cache relies on
+_INNER_HELPERS = (
+    "_get_schema_classes",
+    "_rollback_on_exception_session",
+    "_with_session_lock",
+    "_supports_row_level_locking",
+    "_uses_naive_datetime",
+)
+
+
+class CachedSessionService(BaseSessionService):
+    """LRU + write-batching layer in front of a DatabaseSessionService."""
+
+    @staticmethod
+    def missing_helpers(inner: DatabaseSessionService) -> list[str]:
+        """Internals of this ADK version's DatabaseSessionService the cache can't find."""
+        return [name for name in _INNER_HELPERS if not callable(getattr(inner, name, None))]
+
+    def __init__(self, inner: DatabaseSessionService, max_entries: int = 1024):
+        self.inner = inner
+        self.max_entries = max_entries
+        self._sessions: OrderedDict[SessionKey, Session] = OrderedDict()
+        self._pending: dict[SessionKey, tuple[Session, list[Event]]] = {}
+        # Pin count per session (never evicted while pinned)
+        self._pinned: Counter[SessionKey] = Counter()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.flushes = 0
+        self.flushed_events = 0
+
+    # ----------------------------------------
+    # LRU
+    # ----------------------------------------
+
+    def _remember(self, session: Session) -> None:
+        key = _key(session.app_name, session.user_id, session.id)
+        self._sessions[key] = copy.deepcopy(session)
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_entries:
+            oldest = next((k for k in self._sessions if k not in self._pinned), None)
+            if oldest is None:
+                break
+            del self._sessions[oldest]
+
+    def pin(self, app_name: str, user_id: str, session_id: str) -> None:
+        """Keep a session in the LRU until it is unpinned as often as it was pinned."""
+        self._pinned[_key(app_name, user_id, session_id)] += 1
+
+    def unpin(self, app_name: str, user_id: str, session_id: str) -> None:
+        key = _key(app_name, user_id, session_id)
+        self._pinned[key] -= 1
+        if self._pinned[key] <= 0:
+            del self._pinned[key]
+
+    def _forget(self, key: SessionKey) -> None:
+        self._sessions.pop(key, None)
+
+    async def _storage_marker(self, key: SessionKey) -> str | None:
+        """Current update marker of a session row (one round trip), None if missing."""
+        from sqlalchemy import select
+
+        schema = self.inner._get_schema_classes()
+        app_name, user_id, session_id = key
+        async with self.inner._rollback_on_exception_session(read_only=True) as sql:
+            row = (await sql.execute(
+                select(schema.StorageSession)
+                .filter(schema.StorageSession.app_name == app_name)
+                .filter(schema.StorageSession.user_id == user_id)
+                .filter(schema.StorageSession.id == session_id)
+            )).scalars().one_or_none()
+            return row.get_update_marker() if row is not None else None
+
+    async def _cached(self, key: SessionKey) -> tuple[Session | None, bool]:
+        """Return (copy of cached session, row exists) after a version check."""
+        cached = self._sessions.get(key)
+        if cached is None:
+            return None, True
+        marker = await self._storage_marker(key)
+        if marker is None:
+            self._forget(key)
+            return None, False
+        if marker != cached._storage_update_marker:
+            self.stale += 1
+            self._forget(key)
+            return None, True
+        self._sessions.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(cached), True
+
+    # ----------------------------------------
+    # Reads
+    # ----------------------------------------
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        if config is not None:
+            # Partial reads (recent events only etc.) are never cached
+            return await self.inner.get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+
+        key = _key(app_name, user_id, session_id)
+        session, exists = await self._cached(key)
+        if session is not None:
+            return session
+        if not exists:
+            return None
+
+        self.misses += 1
+        session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        if session is not None:
+            self._remember(session)
+        return session
+
+    async def get_or_create_session(self, *, app_name: str, user_id: str, session_id: str) -> Session:
+        """Return the session, creating it if needed, in as few round trips as possible."""
+        key = _key(app_name, user_id, session_id)
+        session, _ = await self._cached(key)
+        if session is not None:
+            return session
+
+        self.misses += 1
+        session = await self._upsert(app_name, user_id, session_id)
+        if session is None:
+            # Row already existed - load its events
+            session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        if session is None:
+            # Deleted between the upsert and the read
+            session = await self.inner.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        self._remember(session)
+        return session
+
+    async def _upsert(self, app_name: str, user_id: str, session_id: str) -> Session | None:
+        """Create the session (and its app/user state rows) in one transaction.
+
+        Returns the new session, or None if it already existed.
+        """
+        dialect = self.inner.db_engine.dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            # No portable upsert - plain get, then create
+            if await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id):
+                return None
+            return await self.inner.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+        await self.inner.prepare_tables()
+        schema = self.inner._get_schema_classes()
+        now = datetime.now(timezone.utc)
+        if self.inner._uses_naive_datetime():
+            now = now.replace(tzinfo=None)
+
+        async with self.inner._rollback_on_exception_session() as sql:
+            # "DO UPDATE SET <pk> = <pk>" so RETURNING yields the existing state too
+            app_stmt = insert(schema.StorageAppState).values(app_name=app_name, state={}, update_time=now)
+            app_state = (await sql.execute(
+                app_stmt.on_conflict_do_update(
+                    index_elements=["app_name"],
+                    set_={"app_name": app_stmt.excluded.app_name},
+                ).returning(schema.StorageAppState.state)
+            )).scalar_one()
+
+            user_stmt = insert(schema.StorageUserState).values(
+                app_name=app_name, user_id=user_id, state={}, update_time=now
+            )
+            user_state = (await sql.execute(
+                user_stmt.on_conflict_do_update(
+                    index_elements=["app_name", "user_id"],
+                    set_={"user_id": user_stmt.excluded.user_id},
+                ).returning(schema.StorageUserState.state)
+            )).scalar_one()
+
+            created = (await sql.execute(
+                insert(schema.StorageSession)
+                .values(app_name=app_name, user_id=user_id, id=session_id, state={}, create_time=now, update_time=now)
+                .on_conflict_do_nothing()
+                .returning(schema.StorageSession.update_time)
+            )).scalar_one_or_none()
+            await sql.commit()
+
+        if created is None:
+            return None
+        storage_session = schema.StorageSession(
+            app_name=app_name, user_id=user_id, id=session_id, state={}, update_time=created
+        )
+        return storage_session.to_session(state=_merge_state(app_state, user_state))
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session = await self.inner.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+        self._remember(session)
+        return session
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await self.inner.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = _key(app_name, user_id, session_id)
+        self._pending.pop(key, None)
+        self._forget(key)
+        await self.inner.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    # ----------------------------------------
+    # Batched writes
+    # ----------------------------------------
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+
+        key = _key(session.app_name, session.user_id, session.id)
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] is not session:
+            # Another turn on the same session - write its batch first
+            await self.flush_session(*key)
+
+        self._apply_temp_state(session, event)
+        event = self._trim_temp_delta_state(event)
+        self._pending.setdefault(key, (session, []))[1].append(event)
+        return self._commit_event_to_session(session, event)
+
+    async def flush_session(self, app_name: str, user_id: str, session_id: str) -> None:
+        """Write the events buffered for one session in a single transaction."""
+        key = _key(app_name, user_id, session_id)
+        pending = self._pending.pop(key, None)
+        if not pending:
+            return
+        session, events = pending
+        try:
+            await self._write(session, events)
+        except Exception:
+            self._forget(key)
+            raise
+        self.flushes += 1
+        self.flushed_events += len(events)
+        self._remember(session)
+
+    async def flush(self) -> None:
+        for key in list(self._pending):
+            await self.flush_session(*key)
+
+    async def _write(self, session: Session, events: list[Event]) -> None:
+        """Batched equivalent of DatabaseSessionService.append_event."""
+        from sqlalchemy import select
+
+        inner = self.inner
+        schema = inner._get_schema_classes()
+        locking = inner._supports_row_level_locking()
+
+        app_delta, user_delta, session_delta = {}, {}, {}
+        for event in events:
+            deltas = _session_util.extract_json_safe_state_delta(event.actions.state_delta or {})
+            app_delta.update(deltas["app"])
+            user_delta.update(deltas["user"])
+            session_delta.update(deltas["session"])
+
+        async with inner._with_session_lock(
+            app_name=session.app_name, user_id=session.user_id, session_id=session.id
+        ):
+            async with inner._rollback_on_exception_session() as sql:
+                stmt = (
+                    select(schema.StorageSession)
+                    .filter(schema.StorageSession.app_name == session.app_name)
+                    .filter(schema.StorageSession.user_id == session.user_id)
+                    .filter(schema.StorageSession.id == session.id)
+                )
+                if locking:
+                    stmt = stmt.with_for_update()
+                storage_session = (await sql.execute(stmt)).scalars().one_or_none()
+                if storage_session is None:
+                    raise SessionNotFoundError(f"Session {session.id} not found.")
+                if storage_session.get_update_marker() != session._storage_update_marker:
+                    raise StaleSessionError(
+                        f"Session {session.id} was modified in storage since it was loaded."
+                    )
+
+                if app_delta:
+                    app_state = await sql.get(schema.StorageAppState, session.app_name, with_for_update=locking)
+                    app_state.state.update(app_delta)
+                if user_delta:
+                    user_state = await sql.get(
+                        schema.StorageUserState, (session.app_name, session.user_id), with_for_update=locking
+                    )
+                    user_state.state.update(user_delta)
+                if session_delta:
+                    storage_session.state.update(session_delta)
+
+                update_time = datetime.fromtimestamp(events[-1].timestamp, timezone.utc)
+                if inner._uses_naive_datetime():
+                    update_time = update_time.replace(tzinfo=None)
+                storage_session.update_time = update_time
+                sql.add_all([schema.StorageEvent.from_event(session, event) for event in events])
+
+                # Read before commit (post-commit attribute access can lazy-load)
+                last_update_time = storage_session.get_update_timestamp()
+                marker = storage_session.get_update_marker()
+                await sql.commit()
+
+        session.last_update_time = last_update_time
+        session._storage_update_marker = marker
+
+    def stats(self) -> dict:
+        return {
+            "cached_sessions": len(self._sessions),
+            "pinned_sessions": len(self._pinned),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "pending_sessions": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_events": self.flushed_events,
+        }
+
+
+# ============================================
+# Shared in-memory store (SESSION_STORE=shared)
+# ============================================
+
+class SharedSessionService(BaseSessionService):
+    """Client of the per-host session store (see session_store.py).
+
+    Keeps a small pool of Unix socket connections per worker. If no store
+    is listening, the worker serves one itself (only one process can hold
+    a socket's lock, the others keep connecting).
+    """
+
+    def __init__(self, path: str = session_store.SESSION_STORE_SOCKET, pool_size: int = 8):
+        self.path = path
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._server = None
+        self.requests = 0
+        self.reconnects = 0
+
+    async def _connect(self, timeout: float = 10.0) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            try:
+                return await asyncio.open_unix_connection(self.path, limit=session_store.LINE_LIMIT)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self._server is None:
+                    self._server = await session_store.serve(self.path)
+                    if self._server is not None:
+                        print(f"🗃️ No session store on {self.path}, serving it from worker {os.getpid()}")
+                        continue
+                if asyncio.get_running_loop().time() > deadline:
+                    raise
+                # Another process holds the lock and is about to listen
+                await asyncio.sleep(0.05)
+
+    async def _call(self, op: str, **fields) -> Any:
+        line = (session_store.dumps({"op": op, **fields}) + "\n").encode()
+        async with self._slots:
+            self.requests += 1
+            for attempt in range(2):
+                pooled = bool(self._idle)
+                reader, writer = self._idle.pop() if pooled else await self._connect()
+                try:
+                    writer.write(line)
+                    await writer.drain()
+                    response = await reader.readline()
+                    if not response:
+                        raise ConnectionResetError("Session store closed the connection")
+                except ConnectionError:
+                    writer.close()
+                    if pooled and attempt == 0:
+                        # Store restarted since the connection was pooled
+                        self.reconnects += 1
+                        continue
+                    raise
+                except BaseException:
+                    # Cancelled mid-request: the response would go to the next caller
+                    writer.close()
+                    raise
+                self._idle.append((reader, writer))
+                break
+
+        response = session_store.loads(response)
+        if "error" in response:
+            if response["kind"] == "exists":
+                raise AlreadyExistsError(response["error"])
+            if response["kind"] == "not_found":
+                raise SessionNotFoundError(response["error"])
+            raise RuntimeError(f"Session store: {response['error']}")
+        return response["result"]
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = (session_id or "").strip() or str(uuid.uuid4())
+        result = await self._call("create", key=_key(app_name, user_id, session_id), state=state)
+        return Session.model_validate(result)
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        result = await self._call(
+            "get",
+            key=_key(app_name, user_id, session_id),
+            num_recent_events=config.num_recent_events if config else None,
+            after_timestamp=config.after_timestamp if config else None,
+        )
+        return Session.model_validate(result) if result is not None else None
+
+    async def get_or_create_session(self, *, app_name: str, user_id: str, session_id: str) -> Session:
+        """Return the session, creating it if needed, in one round trip."""
+        result = await self._call("get_or_create", key=_key(app_name, user_id, session_id))
+        return Session.model_validate(result)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        result = await self._call("list", app_name=app_name, user_id=user_id)
+        return ListSessionsResponse(sessions=[Session.model_validate(session) for session in result])
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await self._call("delete", key=_key(app_name, user_id, session_id))
+
+    async def get_user_state(self, *, app_name: str, user_id: str) -> dict[str, Any]:
+        return await self._call("user_state", app_name=app_name, user_id=user_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+
+        self._apply_temp_state(session, event)
+        event = self._trim_temp_delta_state(event)
+        await self._call(
+            "append",
+            key=_key(session.app_name, session.user_id, session.id),
+            event=event.model_dump_json(exclude_none=True),
+            timestamp=event.timestamp,
+            state_delta=event.actions.state_delta or None,
+        )
+        return self._commit_event_to_session(session, event)
+
+    async def stats(self) -> dict:
+        return {
+            "store": await self._call("stats"),
+            "socket": self.path,
+            "served_here": self._server is not None,
+            "requests": self.requests,
+            "reconnects": self.reconnects,
+        }
+
+
+async def session_stats(service: BaseSessionService) -> dict | None:
+    if isinstance(service, SharedSessionService):
+        return await service.stats()
+    if isinstance(service, CachedSessionService):
+        return service.stats()
+    return None
+
+
+# ============================================
+# Expired session pruning
+# ============================================
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_PRUNE_INTERVAL = float(os.environ.get("SESSION_PRUNE_INTERVAL", "3600"))
+
+
+async def prune_expired_sessions(service: DatabaseSessionService, max_age: float) -> int:
+    """Delete sessions not updated for max_age seconds; returns the number deleted."""
+    from sqlalchemy import delete
+
+    await service.prepare_tables()
+    schema = service._get_schema_classes()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    if service._uses_naive_datetime():
+        cutoff = cutoff.replace(tzinfo=None)
+
+    async with service._rollback_on_exception_session() as sql:
+        result = await sql.execute(
+            delete(schema.StorageSession).where(schema.StorageSession.update_time < cutoff)
+        )
+        await sql.commit()
+    return result.rowcount or 0
+
+
+async def run_session_pruner(session_service: BaseSessionService) -> None:
+    """Prune expired sessions every SESSION_PRUNE_INTERVAL seconds (runs until cancelled)."""
+    service = getattr(session_service, "inner", session_service)
+    # Jitter so the workers of a deployment don't all prune at the same moment
+    await asyncio.sleep(random.uniform(0, min(SESSION_PRUNE_INTERVAL, 60)))
+    while True:
+        try:
+            deleted = await prune_expired_sessions(service, SESSION_TTL)
+            if deleted:
+                print(f"🧹 Pruned {deleted} sessions idle for more than {SESSION_TTL:.0f}s")
+        except Exception as e:
+            print(f"⚠️ Session pruning failed: {e}")
+        await asyncio.sleep(SESSION_PRUNE_INTERVAL)
+
+
+def create_session_service(database_url: str | None) -> BaseSessionService:
+    """Build the session service from DATABASE_URL and SESSION_* environment variables."""
+    if not database_url and os.environ.get("SESSION_STORE", "").lower() == "shared":
+        print(f"🗃️ Using the shared session store on {session_store.SESSION_STORE_SOCKET}")
+        return SharedSessionService(session_store.SESSION_STORE_SOCKET)
+
+    if not database_url:
+        # Fallback to in-memory for development
+        from google.adk.sessions import InMemorySessionService
+        print("⚠️ Using InMemorySessionService (sessions not shared between workers)")
+        return InMemorySessionService()
+
+    # Use PostgreSQL for production (supports multiple workers)
+    engine = get_engine(database_url)
+    print(f"🗄️ Using DatabaseSessionService with {'SQLite (stand-in)' if engine.dialect.name == 'sqlite' else 'PostgreSQL'}")
+    service = DatabaseSessionService(db_engine=engine)
+    if os.environ.get("SESSION_CACHE", "1").lower() in ("0", "off", "false"):
+        return service
+
+    missing = CachedSessionService.missing_helpers(service)
+    if missing:
+        print(f"⚠️ Session cache disabled, this ADK version has no {', '.join(missing)}")
+        return service
+
+    max_entries = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "1024"))
+    print(f"🧠 Session cache enabled ({max_entries} sessions, batched event writes)")
+    return CachedSessionService(service, max_entries=max_entries)
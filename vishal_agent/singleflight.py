@@ -0,0 +1,252 @@
+"""
+Single-Flight Request Coalescing
+
+When a portfolio link gets shared, many visitors send the same first
+message within seconds. Instead of one Ollama generation per visitor,
+identical stateless prompts share one in-flight generation:
+
+- The first request (the leader) starts the generation in a background task
+- Every request for the same key subscribes to the flight and receives all
+  events produced so far, then the live ones (SSE multicast)
+- The flight is forgotten once it completes, so later requests fall through
+  to the response cache or start a new generation
+
+Cross-worker coalescing (optional, SINGLE_FLIGHT_SHARED=1) uses a small lock
+table in the session database: the worker holding the lock generates, the
+others wait for the answer to show up in the shared response cache.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from typing import AsyncGenerator, AsyncIterator, Callable
+
+
+# ============================================
+# In-process flights
+# ============================================
+
+class Flight:
+    """One in-flight generation, multicast to every subscriber."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.items: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def publish(self, item) -> None:
+        self.items.append(item)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, timeout: float | None = None) -> None:
+        """Wait until the next item is published or the flight finishes."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def subscribe(self) -> AsyncIterator:
+        """Yield every item of the flight, replaying the ones already produced."""
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+
+
+async def run_flight(flight: Flight, producer: Callable[[], AsyncGenerator]) -> None:
+    """Publish producer()'s items into the flight, then finish it (with the error, if any)."""
+    error = None
+    try:
+        async for item in producer():
+            flight.publish(item)
+    except BaseException as e:
+        error = e
+    finally:
+        flight.finish(error)
+
+
+def start_flight(key: str, producer: Callable[[], AsyncGenerator]) -> Flight:
+    """A flight fed by producer() in a background task."""
+    flight = Flight(key)
+    flight.task = asyncio.create_task(run_flight(flight, producer))
+    return flight
+
+
+class SingleFlight:
+    """Registry of in-flight generations keyed by prompt."""
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def join(
+        self,
+        key: str,
+        producer: Callable[[], AsyncGenerator],
+    ) -> tuple[Flight, bool]:
+        """Join the flight for key, starting it with producer() if none exists.
+
+        Returns the flight and whether the caller is its leader.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.followers += 1
+            return flight, False
+
+        flight = start_flight(key, self._forget_after(key, producer))
+        self._flights[key] = flight
+        self.leaders += 1
+        return flight, True
+
+    def _forget_after(self, key: str, producer: Callable[[], AsyncGenerator]) -> Callable[[], AsyncGenerator]:
+        """producer, dropping the flight from the registry before it finishes."""
+        async def produce() -> AsyncGenerator:
+            try:
+                async for item in producer():
+                    yield item
+            finally:
+                self._flights.pop(key, None)
+
+        return produce
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
+
+
+# ============================================
+# Cross-worker lock table
+# ============================================
+
+class SharedFlightLock:
+    """Lock table in the session database so only one worker generates per prompt."""
+
+    TABLE = "inflight_prompts"
+
+    def __init__(self, db_url: str, stale_after: float = 120.0):
+        from .db import get_engine
+
+        self.engine = get_engine(db_url)
+        self.owner = uuid.uuid4().hex
+        self.stale_after = stale_after
+        self._ready = False
+
+    async def _prepare(self, conn) -> None:
+        from sqlalchemy import text
+
+        if self._ready:
+            return
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+            " prompt_key TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " started_at DOUBLE PRECISION NOT NULL)"
+        ))
+        self._ready = True
+
+    async def acquire(self, key: str) -> bool:
+        """Take the lock for key (stealing it if the holder looks dead)."""
+        from sqlalchemy import text
+
+        now = time.time()
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            row = (await conn.execute(
+                text(
+                    f"INSERT INTO {self.TABLE} (prompt_key, owner, started_at)"
+                    " VALUES (:key, :owner, :now)"
+                    " ON CONFLICT (prompt_key) DO UPDATE SET"
+                    " owner = EXCLUDED.owner, started_at = EXCLUDED.started_at"
+                    f" WHERE {self.TABLE}.started_at < :stale"
+                    " RETURNING owner"
+                ),
+                {"key": key, "owner": self.owner, "now": now, "stale": now - self.stale_after},
+            )).first()
+        return row is not None
+
+    async def held(self, key: str) -> bool:
+        from sqlalchemy import text
+
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            row = (await conn.execute(
+                text(f"SELECT 1 FROM {self.TABLE} WHERE prompt_key = :key AND started_at >= :stale"),
+                {"key": key, "stale": time.time() - self.stale_after},
+            )).first()
+        return row is not None
+
+    async def release(self, key: str) -> None:
+        from sqlalchemy import text
+
+        async with self.engine.begin() as conn:
+            await self._prepare(conn)
+            await conn.execute(
+                text(f"DELETE FROM {self.TABLE} WHERE prompt_key = :key AND owner = :owner"),
+                {"key": key, "owner": self.owner},
+            )
+
+
+async def wait_for_remote_answer(
+    lock: SharedFlightLock,
+    key: str,
+    lookup: Callable,
+    timeout: float,
+    interval: float = 0.25,
+) -> str | None:
+    """Poll the shared cache while another worker holds the lock for key."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        answer = await lookup()
+        if answer is not None:
+            return answer
+        if not await lock.held(key):
+            # Holder finished (or failed) - one last look at the cache
+            return await lookup()
+        await asyncio.sleep(interval)
+    return None
+
+
+def create_single_flight(database_url: str | None, shared_cache: bool) -> tuple[SingleFlight | None, SharedFlightLock | None]:
+    """Build the single-flight registry from SINGLE_FLIGHT* environment variables."""
+    if os.environ.get("SINGLE_FLIGHT", "1").lower() in ("0", "off", "false"):
+        return None, None
+
+    lock = None
+    if os.environ.get("SINGLE_FLIGHT_SHARED", "0").lower() in ("1", "on", "true"):
+        if database_url and shared_cache:
+            lock = SharedFlightLock(database_url)
+        else:
+            print("⚠️ SINGLE_FLIGHT_SHARED needs DATABASE_URL and RESPONSE_CACHE=postgres, coalescing per worker only")
+
+    return SingleFlight(), lock
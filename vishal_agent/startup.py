@@ -0,0 +1,86 @@
+"""
+Startup
+
+Keeps worker start-up short and moves one-off costs out of the request path:
+
+- The A2A app (google.adk.a2a, the a2a SDK, sse-starlette, ...) is only
+  built when /a2a is first requested. A2A_APP=eager builds it while the
+  server module is imported, A2A_APP=off doesn't mount it
+- Modules that the first turn would otherwise import (LiteLLM's tiktoken
+  encoding, ADK's A2A client, ...) are imported with the server module
+  instead
+- Nothing touches the event loop, the database or Ollama at import time, so
+  gunicorn --preload (gunicorn.conf.py, GUNICORN_PRELOAD) can import the app
+  once in the master and fork workers that share the imported modules
+  copy-on-write. Connections and background tasks are per worker (lifespan)
+
+benchmarks/startup.py reports import times and time-to-healthy.
+"""
+
+import asyncio
+import importlib
+import os
+import time
+from contextlib import AsyncExitStack
+from typing import Callable
+
+A2A_APP = os.environ.get("A2A_APP", "lazy").lower()
+
+# Imported by the first turn otherwise: ADK's Runner checks for remote A2A
+# agents on every run (imports the A2A client stack), its agent wrapper
+# builds the tool graph lazily (imports the auth stack), LiteLLM's token
+# counting loads the tiktoken encoding (~150ms). Missing ones are skipped
+REQUEST_PATH_IMPORTS = (
+    "google.adk.agents.remote_a2a_agent",
+    "google.adk.workflow.utils._workflow_graph_utils",
+    "litellm.litellm_core_utils.default_encoding",
+    "litellm._service_logger",
+)
+
+
+def preload_request_path_imports() -> None:
+    for module in REQUEST_PATH_IMPORTS:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+class LazyApp:
+    """ASGI app that builds the wrapped app and runs its lifespan on first use.
+
+    Mounted apps don't get lifespan events, so the wrapped app's lifespan is
+    run from here and closed with the server's (aclose()).
+    """
+
+    def __init__(self, factory: Callable, name: str):
+        self.factory = factory
+        self.name = name
+        self.app = None
+        self.started = False
+        self._lock = asyncio.Lock()
+        self._stack = AsyncExitStack()
+
+    def build(self) -> None:
+        if self.app is None:
+            start = time.perf_counter()
+            self.app = self.factory()
+            print(f"✅ {self.name} app built in {time.perf_counter() - start:.2f}s")
+
+    async def start(self) -> None:
+        async with self._lock:
+            if self.started:
+                return
+            if self.app is None:
+                # Mostly imports - keep the event loop serving other requests
+                await asyncio.to_thread(self.build)
+            await self._stack.enter_async_context(self.app.router.lifespan_context(self.app))
+            self.started = True
+
+    async def __call__(self, scope, receive, send):
+        if not self.started:
+            await self.start()
+        await self.app(scope, receive, send)
+
+    async def aclose(self) -> None:
+        await self._stack.aclose()
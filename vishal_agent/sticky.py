@@ -0,0 +1,517 @@
+"""
+Sticky Session Routing
+
+gunicorn hands each request to whichever worker accepts it first, and a
+load balancer spreads requests over replicas, so consecutive turns of a
+session land on different processes. Per-worker state then misses: the
+session cache (sessions.py), SSE resume buffers, the history already
+prefilled in the Ollama instance the worker talks to.
+
+StickyProxy is a small ASGI front proxy that sends every request of a
+session to the same upstream:
+
+- The session id comes from the X-Session-Id header, the JSON body
+  (session_id, A2A contextId) or the /apps/.../sessions/<id> path
+- A request that would start a new session (/run*, POST /sessions without
+  a session_id) gets one from the proxy: it is written into the JSON body,
+  so the server uses it, and returned in the X-Session-Id response header.
+  The first turn then lands where the later turns will. Other requests
+  without a session go to the upstream with the fewest requests in flight
+- Consistent hashing (STICKY_VNODES points per upstream on a hash ring):
+  when an upstream goes away or comes back only its own sessions move
+- Upstreams are health-checked (STICKY_HEALTH_PATH every
+  STICKY_HEALTH_INTERVAL seconds) and leave the ring when they fail; a
+  request that can't connect is retried on the session's next upstream
+- Responses are streamed through unbuffered (SSE, NDJSON)
+
+Upstreams are replicas (STICKY_UPSTREAMS=http://agent-1:8000,...) or, with
+--spawn N, single-process uvicorn workers on Unix sockets that the proxy
+starts and restarts itself - a drop-in for gunicorn where stickiness per
+worker matters. Run it as a script, so the proxy process doesn't import
+the agent itself:
+
+    python vishal_agent/sticky.py --spawn 4 --port 8000
+    python vishal_agent/sticky.py --upstream http://agent-1:8000 --upstream http://agent-2:8000
+
+For nginx instead, `python vishal_agent/sticky.py nginx --upstream ...`
+prints a config that hashes X-Session-Id consistently (nginx can't read the
+JSON body, so clients send the header). GET /_sticky/stats reports the
+ring and the requests per upstream. benchmarks/sticky.py compares session
+cache hit rates with and without sticky routing.
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+
+STICKY_VNODES = int(os.environ.get("STICKY_VNODES", "160"))
+STICKY_HEALTH_INTERVAL = float(os.environ.get("STICKY_HEALTH_INTERVAL", "2"))
+STICKY_HEALTH_PATH = os.environ.get("STICKY_HEALTH_PATH", "/health")
+STICKY_POLICY = os.environ.get("STICKY_POLICY", "hash").lower()
+STICKY_SOCKET_DIR = os.environ.get("STICKY_SOCKET_DIR", "/tmp")
+
+SESSION_HEADER = "x-session-id"
+# Endpoints that create the session when the request doesn't name one
+NEW_SESSION_PATHS = {"/run", "/run_sse", "/run_ndjson", "/sessions"}
+SESSION_PATH = re.compile(r"/apps/[^/]+/users/[^/]+/sessions/([^/?]+)")
+# Not forwarded in either direction (RFC 9110 section 7.6.1), plus Host
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host",
+}
+
+
+def key_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes: list[str] = (), vnodes: int = STICKY_VNODES):
+        self.vnodes = vnodes
+        self.nodes: set[str] = set()
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def _rebuild(self) -> None:
+        points = sorted((key_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def add(self, node: str) -> None:
+        if node not in self.nodes:
+            self.nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node: str) -> None:
+        if node in self.nodes:
+            self.nodes.discard(node)
+            self._rebuild()
+
+    def lookup(self, key: str) -> list[str]:
+        """Nodes in ring order from the key's position: owner first, then fallbacks."""
+        if not self._points:
+            return []
+        start = bisect.bisect(self._points, key_hash(key))
+        seen: list[str] = []
+        for i in range(len(self._points)):
+            node = self._owners[(start + i) % len(self._points)]
+            if node not in seen:
+                seen.append(node)
+                if len(seen) == len(self.nodes):
+                    break
+        return seen
+
+
+def session_key(path: str, headers: dict[str, str], body: bytes) -> str | None:
+    """Session id of a request, if it names one."""
+    if headers.get(SESSION_HEADER):
+        return headers[SESSION_HEADER]
+    match = SESSION_PATH.search(path)
+    if match:
+        return match.group(1)
+    if not body or not headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if data.get("session_id"):
+        return str(data["session_id"])
+    # A2A JSON-RPC: the context id is the session
+    message = (data.get("params") or {}).get("message") if isinstance(data.get("params"), dict) else None
+    if isinstance(message, dict) and (message.get("contextId") or message.get("context_id")):
+        return str(message.get("contextId") or message.get("context_id"))
+    return None
+
+
+def assign_session(body: bytes) -> tuple[bytes, str] | None:
+    """The JSON body with a new session_id (same format as the server's), or None if it isn't JSON."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    data["session_id"] = f"session-{uuid.uuid4().hex[:8]}"
+    return json.dumps(data).encode(), data["session_id"]
+
+
+@dataclass
+class Upstream:
+    url: str
+    healthy: bool = True
+    outstanding: int = 0
+    requests: int = 0
+    failures: int = 0
+    client: httpx.AsyncClient = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.url.startswith("unix:"):
+            transport = httpx.AsyncHTTPTransport(uds=self.url[len("unix:"):])
+            base_url = "http://localhost"
+        else:
+            transport = httpx.AsyncHTTPTransport()
+            base_url = self.url
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            # No read timeout: streams stay open as long as the upstream writes
+            timeout=httpx.Timeout(None, connect=5.0),
+        )
+
+
+class StickyProxy:
+    """ASGI app forwarding each session's requests to one upstream."""
+
+    def __init__(self, urls: list[str], policy: str = STICKY_POLICY, vnodes: int = STICKY_VNODES, workers: "WorkerPool | None" = None):
+        self.upstreams = {url: Upstream(url) for url in urls}
+        self.ring = HashRing(urls, vnodes)
+        self.policy = policy
+        self.workers = workers
+        self.keyed = 0
+        self.assigned = 0
+        self.unkeyed = 0
+        self.retries = 0
+        self._tasks: list[asyncio.Task] = []
+
+    # ---------- Routing ----------
+
+    def candidates(self, key: str | None) -> list[Upstream]:
+        if key is not None and self.policy == "hash":
+            order = self.ring.lookup(key) or list(self.upstreams)
+            return [self.upstreams[url] for url in order]
+        healthy = [u for u in self.upstreams.values() if u.healthy] or list(self.upstreams.values())
+        if key is not None:
+            # STICKY_POLICY=random: the non-sticky baseline
+            random.shuffle(healthy)
+            return healthy
+        return sorted(healthy, key=lambda u: (u.outstanding, u.requests))
+
+    def mark(self, upstream: Upstream, healthy: bool) -> None:
+        if healthy == upstream.healthy:
+            return
+        upstream.healthy = healthy
+        if healthy:
+            self.ring.add(upstream.url)
+            print(f"✅ Upstream {upstream.url} is back, rebalancing")
+        else:
+            self.ring.remove(upstream.url)
+            print(f"⚠️ Upstream {upstream.url} is down, its sessions move to the next upstream")
+
+    async def run_health_checks(self) -> None:
+        while True:
+            for upstream in list(self.upstreams.values()):
+                try:
+                    response = await upstream.client.get(STICKY_HEALTH_PATH, timeout=2.0)
+                    self.mark(upstream, response.status_code < 500)
+                except httpx.HTTPError:
+                    self.mark(upstream, False)
+            await asyncio.sleep(STICKY_HEALTH_INTERVAL)
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "ring": sorted(self.ring.nodes),
+            "keyed_requests": self.keyed,
+            "assigned_sessions": self.assigned,
+            "unkeyed_requests": self.unkeyed,
+            "retries": self.retries,
+            "upstreams": [
+                {
+                    "url": u.url,
+                    "healthy": u.healthy,
+                    "outstanding": u.outstanding,
+                    "requests": u.requests,
+                    "failures": u.failures,
+                }
+                for u in self.upstreams.values()
+            ],
+            "workers": self.workers.stats() if self.workers else None,
+        }
+
+    # ---------- ASGI ----------
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.proxy(scope, receive, send)
+        else:
+            # WebSockets aren't proxied
+            await send({"type": "websocket.close", "code": 1003})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._tasks.append(asyncio.create_task(self.run_health_checks()))
+                if self.workers:
+                    self._tasks.append(asyncio.create_task(self.workers.supervise()))
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for task in self._tasks:
+                    task.cancel()
+                for upstream in self.upstreams.values():
+                    await upstream.client.aclose()
+                if self.workers:
+                    self.workers.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def respond(self, send, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def proxy(self, scope, receive, send):
+        if scope["path"] == "/_sticky/stats":
+            await self.respond(send, 200, self.stats())
+            return
+
+        # Request bodies are small JSON documents - read them whole to find the session
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        key = session_key(scope["path"], headers, body)
+        assigned = None
+        if key is None and scope["method"] == "POST" and scope["path"] in NEW_SESSION_PATHS:
+            assigned = assign_session(body)
+        if assigned is not None:
+            body, key = assigned
+            self.assigned += 1
+        elif key is None:
+            self.unkeyed += 1
+        else:
+            self.keyed += 1
+
+        forwarded = [
+            (k, v) for k, v in headers.items()
+            if k not in HOP_BY_HOP and k not in ("content-length", "x-forwarded-for")
+        ]
+        # Append to the chain of earlier proxies (every X-Forwarded-For header, in order)
+        chain = [v.decode("latin-1") for k, v in scope["headers"] if k.lower() == b"x-forwarded-for"]
+        if scope.get("client"):
+            chain.append(scope["client"][0])
+        if chain:
+            forwarded.append(("x-forwarded-for", ", ".join(chain)))
+        if assigned is not None:
+            forwarded.append((SESSION_HEADER, key))
+        target = scope.get("raw_path", scope["path"].encode()).decode("latin-1")
+        if scope.get("query_string"):
+            target += "?" + scope["query_string"].decode("latin-1")
+
+        for attempt, upstream in enumerate(self.candidates(key)):
+            request = upstream.client.build_request(scope["method"], target, headers=forwarded, content=body)
+            upstream.outstanding += 1
+            try:
+                response = await upstream.client.send(request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # Never reached the upstream - safe to try the next one
+                upstream.outstanding -= 1
+                upstream.failures += 1
+                self.mark(upstream, False)
+                self.retries += 1
+                continue
+            except httpx.HTTPError as e:
+                upstream.outstanding -= 1
+                upstream.failures += 1
+                await self.respond(send, 502, {"detail": f"Upstream error: {e}"})
+                return
+            upstream.requests += 1
+            response_headers = [
+                (k.encode("latin-1"), v.encode("latin-1"))
+                for k, v in response.headers.multi_items()
+                if k.lower() not in HOP_BY_HOP
+            ]
+            if assigned is not None:
+                # Streams don't echo the session id - the client needs it for the next turn
+                response_headers.append((SESSION_HEADER.encode(), key.encode()))
+            try:
+                await send({
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": response_headers,
+                })
+                async for chunk in response.aiter_raw():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b""})
+            finally:
+                upstream.outstanding -= 1
+                await response.aclose()
+            return
+
+        await self.respond(send, 503, {"detail": "No upstream available"})
+
+
+# ============================================
+# Spawned workers (--spawn)
+# ============================================
+
+class WorkerPool:
+    """Single-process uvicorn workers on Unix sockets, restarted when they exit."""
+
+    def __init__(self, count: int, app: str = "vishal_agent.server:app", socket_dir: str = STICKY_SOCKET_DIR):
+        self.app = app
+        self.sockets = [os.path.join(socket_dir, f"vishal_agent_worker_{os.getpid()}_{i}.sock") for i in range(count)]
+        self.processes: list[subprocess.Popen | None] = [None] * count
+        self.restarts = 0
+        # Same multiprocess metrics setup as gunicorn.conf.py, so /metrics covers every worker
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/vishal_agent_metrics")
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+    @property
+    def urls(self) -> list[str]:
+        return [f"unix:{path}" for path in self.sockets]
+
+    def start(self, i: int) -> None:
+        self.processes[i] = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", self.app, "--uds", self.sockets[i], "--no-access-log",
+        ])
+
+    def start_all(self) -> None:
+        for i in range(len(self.sockets)):
+            self.start(i)
+
+    async def supervise(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            for i, process in enumerate(self.processes):
+                if process is not None and process.poll() is not None:
+                    print(f"⚠️ Worker {i} exited with {process.returncode}, restarting")
+                    self.restarts += 1
+                    self.start(i)
+
+    def stop(self) -> None:
+        for process in self.processes:
+            if process is not None:
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        for path in self.sockets:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def stats(self) -> dict:
+        return {"count": len(self.sockets), "restarts": self.restarts}
+
+
+# ============================================
+# nginx config
+# ============================================
+
+NGINX_TEMPLATE = """\
+# Generated by `python vishal_agent/sticky.py nginx`
+# Sessions stick to one upstream by the X-Session-Id request header
+# (consistent hashing: a failed upstream only moves its own sessions).
+# Requests without the header are spread per request.
+events {{}}
+
+http {{
+    map $http_x_session_id $sticky_key {{
+        ""      $request_id;
+        default $http_x_session_id;
+    }}
+
+    upstream adk_agent {{
+        hash $sticky_key consistent;
+{servers}
+        keepalive 32;
+    }}
+
+    server {{
+        listen {listen};
+
+        location / {{
+            proxy_pass http://adk_agent;
+            proxy_http_version 1.1;
+            proxy_set_header Connection "";
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            # Try the session's next upstream only if this one couldn't be reached
+            proxy_next_upstream error timeout;
+            # SSE / NDJSON: pass chunks through as they arrive
+            proxy_buffering off;
+            proxy_read_timeout {read_timeout}s;
+        }}
+    }}
+}}
+"""
+
+
+def nginx_config(upstreams: list[str], listen: int = 80, read_timeout: int = 300) -> str:
+    servers = "\n".join(
+        f"        server {url.removeprefix('http://').rstrip('/')} max_fails=2 fail_timeout=10s;"
+        for url in upstreams
+    )
+    return NGINX_TEMPLATE.format(servers=servers, listen=listen, read_timeout=read_timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sticky session proxy for the agent server")
+    parser.add_argument("command", nargs="?", choices=("serve", "nginx"), default="serve")
+    parser.add_argument("--upstream", action="append", default=[], help="Upstream base URL (repeatable, or STICKY_UPSTREAMS)")
+    parser.add_argument("--spawn", type=int, default=0, help="Start this many single-process workers as upstreams")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--policy", choices=("hash", "random"), default=STICKY_POLICY)
+    args = parser.parse_args()
+
+    upstreams = args.upstream or [u.strip() for u in os.environ.get("STICKY_UPSTREAMS", "").split(",") if u.strip()]
+    if args.command == "nginx":
+        if not upstreams:
+            parser.error("nginx needs --upstream")
+        print(nginx_config(upstreams, listen=args.port), end="")
+        return
+
+    workers = None
+    if args.spawn:
+        workers = WorkerPool(args.spawn)
+        workers.start_all()
+        upstreams = upstreams + workers.urls
+    if not upstreams:
+        parser.error("give --upstream, STICKY_UPSTREAMS or --spawn")
+
+    import uvicorn
+
+    print(f"🧭 Sticky proxy on :{args.port} ({args.policy}) -> {', '.join(upstreams)}")
+    proxy = StickyProxy(upstreams, policy=args.policy, workers=workers)
+    try:
+        uvicorn.run(proxy, host=args.host, port=args.port, log_level="warning")
+    finally:
+        if workers:
+            workers.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+SSE Streaming Pipeline
+
+/run_sse generations run in a background task that publishes into a Flight
+(the same multicast buffer single-flight uses). The HTTP response only
+reads from that buffer, which decouples the model from the client:
+
+- Token batching: the first text delta is sent at once (TTFT), later ones
+  are merged for up to SSE_BATCH_MS or SSE_BATCH_CHARS. A slow reader just
+  gets bigger batches instead of holding up the generation
+- Heartbeats: an SSE comment every SSE_HEARTBEAT seconds of silence (queue
+  wait, long prefill) keeps proxies from timing out and surfaces dead
+  connections
+- Disconnects: when the last reader of a stream goes away, the generation
+  is cancelled after SSE_RESUME_GRACE seconds, which also stops Ollama
+- Resume: every event carries "id: <stream>:<n>". A client that reconnects
+  with Last-Event-ID gets the rest of the stream from the buffer instead of
+  a new generation, for SSE_RESUME_TTL seconds after the stream finished
+
+/run_ndjson streams run the same way (including the cancellation) but are
+not resumable and not batched: one JSON object per line.
+
+Events are encoded with orjson when it is installed.
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncGenerator, Callable
+
+from .metrics import SSE_SERIALIZE_SECONDS, FirstTextTimer
+from .singleflight import Flight, start_flight
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SSE_BATCH_MS = float(os.environ.get("SSE_BATCH_MS", "30"))
+SSE_BATCH_CHARS = int(os.environ.get("SSE_BATCH_CHARS", "200"))
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
+SSE_RESUME_GRACE = float(os.environ.get("SSE_RESUME_GRACE", "10"))
+SSE_RESUME_TTL = float(os.environ.get("SSE_RESUME_TTL", "60"))
+
+HEARTBEAT = ": ping\n\n"
+
+
+def dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_event(data: dict, event_id: str | None = None) -> str:
+    """Encode one SSE event."""
+    start = time.perf_counter()
+    payload = f"data: {dumps(data)}\n\n"
+    if event_id is not None:
+        payload = f"id: {event_id}\n{payload}"
+    SSE_SERIALIZE_SECONDS.observe(time.perf_counter() - start)
+    return payload
+
+
+def encode_line(data: dict) -> str:
+    """Encode one NDJSON line."""
+    start = time.perf_counter()
+    line = dumps(data) + "\n"
+    SSE_SERIALIZE_SECONDS.observe(time.perf_counter() - start)
+    return line
+
+
+def _is_delta(data: dict) -> bool:
+    """A partial text event that can be merged with its neighbours."""
+    return not data.get("is_final") and "text" in data and data.keys() <= {"author", "is_final", "text"}
+
+
+class ResumableStreams:
+    """The worker's live SSE streams, by stream id."""
+
+    def __init__(self):
+        self._streams: dict[str, Flight] = {}
+        self.started = 0
+        self.resumed = 0
+        self.cancelled = 0
+
+    def start(self, producer: Callable[[], AsyncGenerator]) -> tuple[str, Flight]:
+        """Run producer() in the background and register its flight."""
+        flight = start_flight(f"sse-{uuid.uuid4().hex[:12]}", producer)
+        return self.register(flight), flight
+
+    def register(self, flight: Flight) -> str:
+        """Make a flight resumable (flights started elsewhere, e.g. single-flight)."""
+        stream_id = uuid.uuid4().hex[:12]
+        self._streams[stream_id] = flight
+        self.started += 1
+        if flight.task is not None:
+            flight.task.add_done_callback(lambda _: self._expire_later(stream_id))
+        else:
+            self._expire_later(stream_id)
+        return stream_id
+
+    def _expire_later(self, stream_id: str) -> None:
+        asyncio.get_running_loop().call_later(SSE_RESUME_TTL, self._streams.pop, stream_id, None)
+
+    def resume(self, last_event_id: str) -> tuple[str, Flight, int] | None:
+        """(stream id, flight, next item index) for a Last-Event-ID, if still known."""
+        stream_id, _, index = last_event_id.partition(":")
+        flight = self._streams.get(stream_id)
+        if flight is None or not index.isdigit():
+            return None
+        self.resumed += 1
+        return stream_id, flight, int(index) + 1
+
+    def detach(self, flight: Flight) -> None:
+        """A reader went away; cancel the generation if nobody comes back."""
+        if flight.subscribers == 0 and not flight.done and flight.task is not None:
+            asyncio.get_running_loop().call_later(SSE_RESUME_GRACE, self._cancel_if_abandoned, flight)
+
+    def _cancel_if_abandoned(self, flight: Flight) -> None:
+        if flight.subscribers == 0 and not flight.done:
+            self.cancelled += 1
+            flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self._streams),
+            "started": self.started,
+            "resumed": self.resumed,
+            "cancelled_on_disconnect": self.cancelled,
+        }
+
+
+async def stream_events(
+    streams: ResumableStreams,
+    stream_id: str,
+    flight: Flight,
+    to_payload: Callable[[object], dict],
+    start: int = 0,
+    ttft: FirstTextTimer | None = None,
+) -> AsyncGenerator[str, None]:
+    """Encode a flight as SSE: batched deltas, event ids and heartbeats."""
+    index = start
+    pending: dict | None = None
+    pending_id = 0
+    pending_since = 0.0
+    sent_text = start > 0
+    last_write = time.monotonic()
+
+    def flush() -> str:
+        nonlocal pending
+        chunk, pending = encode_event(pending, f"{stream_id}:{pending_id}"), None
+        return chunk
+
+    flight.subscribers += 1
+    try:
+        while True:
+            while index < len(flight.items):
+                data = to_payload(flight.items[index])
+                if _is_delta(data) and sent_text and SSE_BATCH_MS > 0:
+                    if pending is None:
+                        pending, pending_since = dict(data), time.monotonic()
+                    else:
+                        pending["text"] += data["text"]
+                    pending_id = index
+                    if len(pending["text"]) >= SSE_BATCH_CHARS:
+                        yield flush()
+                        last_write = time.monotonic()
+                else:
+                    if pending is not None:
+                        yield flush()
+                    if "text" in data:
+                        sent_text = True
+                        if ttft:
+                            ttft.mark()
+                    yield encode_event(data, f"{stream_id}:{index}")
+                    last_write = time.monotonic()
+                index += 1
+
+            now = time.monotonic()
+            if pending is not None and now - pending_since >= SSE_BATCH_MS / 1000:
+                yield flush()
+                last_write = now
+            if flight.done:
+                if pending is not None:
+                    yield flush()
+                if flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+                    yield encode_event({"error": str(flight.error)})
+                return
+            if now - last_write >= SSE_HEARTBEAT:
+                yield HEARTBEAT
+                last_write = now
+
+            timeout = SSE_HEARTBEAT - (now - last_write)
+            if pending is not None:
+                timeout = min(timeout, SSE_BATCH_MS / 1000 - (now - pending_since))
+            await flight.wait(max(timeout, 0))
+    finally:
+        flight.subscribers -= 1
+        streams.detach(flight)
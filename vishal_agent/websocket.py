@@ -0,0 +1,177 @@
+"""
+WebSocket Chat
+
+The portfolio widget used to open a new /run_sse request for every turn,
+and every turn paid for ensure_session, a new stream and its connection
+setup. GET /ws (server.py) holds one conversation on one connection:
+
+- The connection is bound to one session (?user_id=...&session_id=...,
+  a new session id if none is given). The session is looked up once, when
+  the connection opens, and pinned in the session cache until it closes
+- Client messages are JSON: {"type": "run", "text": "...", "draft": true}
+  starts a turn, {"type": "cancel"} stops the running one. Cancelling (or
+  closing the connection) cancels the generation itself, so
+  runner.run_async and the Ollama request stop; the turn is flushed before
+  the next one starts
+- Server frames are compact JSON: {"t": "..."} text deltas (with
+  "draft": true for draft text), {"q": N} queue positions,
+  {"draft": "accepted"|"rejected"}, {"error": "..."}, and one
+  {"done": true, ...} per turn with the answer and the /run_ndjson flags
+  (or "cancelled": true). ?frames=binary sends them as binary frames
+
+Backpressure per connection:
+
+- One turn at a time; a run message during a turn gets an error frame
+- The generation never waits for the socket: it publishes into a Flight,
+  and the sender merges the deltas that piled up while the previous frame
+  was being written into one frame. A slow client gets fewer, larger frames
+- A frame that can't be written within WS_SEND_TIMEOUT seconds closes the
+  connection (1013) and cancels its generation
+- Messages longer than WS_MAX_MESSAGE_CHARS are refused, and connections
+  without a message or turn for WS_IDLE_TIMEOUT seconds are closed
+
+The sticky proxy (sticky.py) doesn't proxy WebSockets; connect to the
+workers (or a load balancer with connection affinity) directly.
+"""
+
+import asyncio
+import json
+import os
+from typing import Callable
+
+from fastapi import WebSocket
+
+from .metrics import WS_TURNS, FirstTextTimer
+from .singleflight import Flight
+from .streaming import dumps
+
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "10"))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", "300"))
+WS_MAX_MESSAGE_CHARS = int(os.environ.get("WS_MAX_MESSAGE_CHARS", "4000"))
+
+# Close codes
+CLOSE_NORMAL = 1000
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class SlowConsumer(Exception):
+    """A frame could not be written within WS_SEND_TIMEOUT."""
+
+
+class FrameSender:
+    """Writes frames to one connection, as text or binary, with a send timeout."""
+
+    def __init__(self, websocket: WebSocket, binary: bool = False):
+        self.websocket = websocket
+        self.binary = binary
+        self.frames = 0
+        self.merged = 0
+
+    async def send(self, data: dict) -> None:
+        payload = dumps(data)
+        if self.binary:
+            message = {"type": "websocket.send", "bytes": payload.encode()}
+        else:
+            message = {"type": "websocket.send", "text": payload}
+        try:
+            await asyncio.wait_for(self.websocket.send(message), WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise SlowConsumer(f"frame not sent within {WS_SEND_TIMEOUT:g}s")
+        self.frames += 1
+
+
+async def receive_message(websocket: WebSocket, timeout: float) -> dict | None:
+    """The next client message as a dict; None when the client disconnected.
+
+    Raises asyncio.TimeoutError after timeout seconds of silence and
+    ValueError for messages that aren't a JSON object.
+    """
+    message = await asyncio.wait_for(websocket.receive(), timeout)
+    if message["type"] == "websocket.disconnect":
+        return None
+    raw = message.get("text")
+    if raw is None:
+        raw = (message.get("bytes") or b"").decode()
+    if len(raw) > WS_MAX_MESSAGE_CHARS:
+        raise ValueError(f"Messages are limited to {WS_MAX_MESSAGE_CHARS} characters")
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        raise ValueError("Messages must be JSON")
+    if not isinstance(data, dict):
+        raise ValueError("Messages must be JSON objects")
+    return data
+
+
+def _mergeable(a: dict, b: dict) -> bool:
+    """Consecutive text deltas of the same kind (model or draft text)."""
+    return "t" in a and a.keys() == b.keys() and a.keys() <= {"t", "draft"}
+
+
+async def send_flight(
+    sender: FrameSender,
+    flight: Flight,
+    to_frame: Callable[[object], dict | None],
+    ttft: FirstTextTimer | None = None,
+) -> None:
+    """Send a flight's items as frames until it finishes.
+
+    Everything published while the previous frame was being written goes out
+    together, with adjacent text deltas merged into one frame.
+    """
+    index = 0
+    while True:
+        frames: list[dict] = []
+        while index < len(flight.items):
+            frame = to_frame(flight.items[index])
+            index += 1
+            if frame is None:
+                continue
+            if frames and _mergeable(frames[-1], frame):
+                frames[-1] = {**frames[-1], "t": frames[-1]["t"] + frame["t"]}
+                sender.merged += 1
+            else:
+                frames.append(frame)
+        for frame in frames:
+            if ttft and "t" in frame:
+                ttft.mark()
+            await sender.send(frame)
+        if flight.done and index == len(flight.items):
+            return
+        if index == len(flight.items):
+            await flight.wait()
+
+
+class WebSocketStats:
+    """Connection and turn counters for /stats."""
+
+    def __init__(self):
+        self.open = 0
+        self.connections = 0
+        self.turns = {"done": 0, "cancelled": 0, "error": 0, "rejected": 0}
+        self.slow_consumers = 0
+        self.frames = 0
+        self.merged_frames = 0
+
+    def opened(self) -> None:
+        self.open += 1
+        self.connections += 1
+
+    def closed(self, sender: FrameSender) -> None:
+        self.open -= 1
+        self.frames += sender.frames
+        self.merged_frames += sender.merged
+
+    def turn(self, outcome: str) -> None:
+        self.turns[outcome] += 1
+        WS_TURNS.labels(outcome).inc()
+
+    def stats(self) -> dict:
+        return {
+            "open": self.open,
+            "connections": self.connections,
+            "turns": self.turns,
+            "slow_consumers": self.slow_consumers,
+            "frames": self.frames,
+            "merged_frames": self.merged_frames,
+        }